@@ -37,6 +37,7 @@ import cPickle
 import gearman
 import logging
 import os
+import shlex
 import time
 from socket import gethostname
 import sys
@@ -45,7 +46,10 @@ import traceback
 
 
 config = ConfigParser.SafeConfigParser(
-    defaults={'django_settings_module': 'settings.common'})
+    defaults={'django_settings_module': 'settings.common',
+              'persistentScriptWorkers': 'False',
+              'persistentScriptWorkerMaxTasks': '1000',
+              'taskTransport': 'gearman'})
 config.read("/etc/archivematica/MCPClient/clientConfig.conf")
 
 os.environ['DJANGO_SETTINGS_MODULE'] = config.get('MCPClient', 'django_settings_module')
@@ -62,6 +66,8 @@ from django_mysqlpool import auto_close_db
 from custom_handlers import GroupWriteRotatingFileHandler
 import databaseFunctions
 from executeOrRunSubProcess import executeOrRun
+from clientScriptWorker import ScriptWorker
+import taskTransport
 
 
 LOGGING_CONFIG = {
@@ -111,6 +117,8 @@ replacementDic = {
     "%clientScriptsDirectory%": config.get('MCPClient', "clientScriptsDirectory")
 }
 supportedModules = {}
+# Each gearman thread gets its own persistent script worker, if enabled
+threadLocal = threading.local()
 
 def loadSupportedModulesSupport(key, value):
     for key2, value2 in replacementDic.items():
@@ -138,70 +146,135 @@ def executeCommand(gearman_worker, gearman_job):
         execute = gearman_job.task
         logger.info('Executing %s (%s)', execute, gearman_job.unique)
         data = cPickle.loads(gearman_job.data)
+        if "tasks" in data:
+            return cPickle.dumps({"tasks": executeBatch(gearman_worker, execute, data)})
         utcDate = databaseFunctions.getUTCDate()
-        arguments = data["arguments"]#.encode("utf-8")
-        if isinstance(arguments, unicode):
-            arguments = arguments.encode("utf-8")
 
-        sInput = ""
         clientID = gearman_worker.worker_client_id
 
         task = Task.objects.get(taskuuid=gearman_job.unique)
         if task.starttime is not None:
-            exitCode = -1
-            stdOut = ""
-            stdError = """Detected this task has already started!
-Unable to determine if it completed successfully."""
-            return cPickle.dumps({"exitCode" : exitCode, "stdOut": stdOut, "stdError": stdError})
+            return cPickle.dumps(alreadyStartedResults())
         else:
             task.client = clientID
             task.starttime = utcDate
             task.save()
 
-        if execute not in supportedModules:
-            output = ["Error!", "Error! - Tried to run and unsupported command." ]
-            exitCode = -1
-            return cPickle.dumps({"exitCode" : exitCode, "stdOut": output[0], "stdError": output[1]})
-        command = supportedModules[execute]
-
-        replacementDic["%date%"] = utcDate.isoformat()
-        replacementDic["%jobCreatedDate%"] = data["createdDate"]
-        # Replace replacement strings
-        for key in replacementDic.keys():
-            command = command.replace ( key, replacementDic[key] )
-            arguments = arguments.replace ( key, replacementDic[key] )
-
-        key = "%taskUUID%"
-        value = gearman_job.unique.__str__()
-        arguments = arguments.replace(key, value)
-
-        # Add useful environment vars for client scripts
-        lib_paths = ['/usr/share/archivematica/dashboard/', '/usr/lib/archivematica/archivematicaCommon']
-        env_updates = {
-            'PYTHONPATH': os.pathsep.join(lib_paths),
-            'DJANGO_SETTINGS_MODULE': config.get('MCPClient', 'django_settings_module')
-        }
-
-        # Execute command
-        command += " " + arguments
-        logger.info('<processingCommand>{%s}%s</processingCommand>', gearman_job.unique, command)
-        exitCode, stdOut, stdError = executeOrRun("command", command, sInput, printing=False, env_updates=env_updates)
-        return cPickle.dumps({"exitCode": exitCode, "stdOut": stdOut, "stdError": stdError})
-    except OSError as ose:
-        logger.exception('Execution failed')
-        output = ["Archivematica Client Error!", traceback.format_exc()]
-        exitCode = 1
-        return cPickle.dumps({"exitCode": exitCode, "stdOut": output[0], "stdError": output[1]})
+        return cPickle.dumps(runTask(execute, gearman_job.unique, data["arguments"], data["createdDate"], utcDate))
     except Exception as e:
         logger.exception('Unexpected error')
         output = ["", traceback.format_exc()]
         return cPickle.dumps({"exitCode": -1, "stdOut": output[0], "stdError": output[1]})
 
 
+def executeBatch(gearman_worker, execute, data):
+    """
+    Run every task of a batched gearman job, one after the other.
+
+    Start times for all of the tasks are recorded with a single update.
+    Returns a dict of results keyed by task UUID.
+    """
+    utcDate = databaseFunctions.getUTCDate()
+    taskUUIDs = data["tasks"].keys()
+    started = set(Task.objects.filter(taskuuid__in=taskUUIDs, starttime__isnull=False).values_list('taskuuid', flat=True))
+    Task.objects.filter(taskuuid__in=taskUUIDs, starttime__isnull=True).update(client=gearman_worker.worker_client_id, starttime=utcDate)
+
+    results = {}
+    for taskUUID, taskData in data["tasks"].items():
+        if taskUUID in started:
+            results[taskUUID] = alreadyStartedResults()
+            continue
+        try:
+            results[taskUUID] = runTask(execute, taskUUID, taskData["arguments"], data["createdDate"], utcDate)
+        except Exception:
+            logger.exception('Unexpected error running task %s', taskUUID)
+            results[taskUUID] = {"exitCode": -1, "stdOut": "", "stdError": traceback.format_exc()}
+    return results
+
+
+def alreadyStartedResults():
+    return {"exitCode": -1, "stdOut": "", "stdError": """Detected this task has already started!
+Unable to determine if it completed successfully."""}
+
+
+def runTask(execute, taskUUID, arguments, createdDate, utcDate):
+    """Run a single task's command and return its exit code and output."""
+    if isinstance(arguments, unicode):
+        arguments = arguments.encode("utf-8")
+
+    sInput = ""
+
+    if execute not in supportedModules:
+        output = ["Error!", "Error! - Tried to run and unsupported command." ]
+        exitCode = -1
+        return {"exitCode" : exitCode, "stdOut": output[0], "stdError": output[1]}
+    command = supportedModules[execute]
+
+    replacementDic["%date%"] = utcDate.isoformat()
+    replacementDic["%jobCreatedDate%"] = createdDate
+    # Replace replacement strings
+    for key in replacementDic.keys():
+        command = command.replace ( key, replacementDic[key] )
+        arguments = arguments.replace ( key, replacementDic[key] )
+
+    key = "%taskUUID%"
+    value = taskUUID.__str__()
+    arguments = arguments.replace(key, value)
+
+    # Execute command
+    command += " " + arguments
+    logger.info('<processingCommand>{%s}%s</processingCommand>', taskUUID, command)
+    try:
+        argv = shlex.split(command)
+        if runsInScriptWorker(argv[0]):
+            exitCode, stdOut, stdError = getScriptWorker().run(argv)
+        else:
+            exitCode, stdOut, stdError = executeOrRun("command", argv, sInput, printing=False, env_updates=clientScriptEnvironment())
+    except OSError:
+        logger.exception('Execution failed')
+        output = ["Archivematica Client Error!", traceback.format_exc()]
+        exitCode = 1
+        return {"exitCode": exitCode, "stdOut": output[0], "stdError": output[1]}
+    return {"exitCode": exitCode, "stdOut": stdOut, "stdError": stdError}
+
+
+def clientScriptEnvironment():
+    """Useful environment vars for client scripts"""
+    lib_paths = ['/usr/share/archivematica/dashboard/', '/usr/lib/archivematica/archivematicaCommon']
+    return {
+        'PYTHONPATH': os.pathsep.join(lib_paths),
+        'DJANGO_SETTINGS_MODULE': config.get('MCPClient', 'django_settings_module')
+    }
+
+
+def runsInScriptWorker(executable):
+    """Python client scripts can be run by a persistent script worker instead of a new interpreter."""
+    if not config.getboolean('MCPClient', 'persistentScriptWorkers'):
+        return False
+    clientScriptsDirectory = config.get('MCPClient', "clientScriptsDirectory")
+    return executable.startswith(clientScriptsDirectory) and executable.endswith('.py')
+
+
+def getScriptWorker():
+    if not hasattr(threadLocal, 'scriptWorker'):
+        threadLocal.scriptWorker = ScriptWorker(clientScriptEnvironment(),
+            max_tasks=config.getint('MCPClient', 'persistentScriptWorkerMaxTasks'))
+    return threadLocal.scriptWorker
+
+
+def createWorker():
+    """A gearman worker, or its stand-in for the configured task transport."""
+    transport = config.get('MCPClient', "taskTransport")
+    if transport == 'local':
+        return taskTransport.createTaskWorker(transport, config.get('MCPClient', "localTaskQueueAddress"),
+                                              config.get('MCPClient', "localTaskQueueAuthkey"))
+    return taskTransport.createTaskWorker(transport, config.get('MCPClient', "MCPArchivematicaServer"))
+
+
 @auto_close_db
 def startThread(threadNumber):
     """Setup a gearman client, for the thread."""
-    gm_worker = gearman.GearmanWorker([config.get('MCPClient', "MCPArchivematicaServer")])
+    gm_worker = createWorker()
     hostID = gethostname() + "_" + threadNumber.__str__()
     gm_worker.set_client_id(hostID)
     for key in supportedModules.keys():
@@ -214,8 +287,9 @@ def startThread(threadNumber):
     while True:
         try:
             gm_worker.work()
+        # Also raised by the local transport's worker
         except gearman.errors.ServerUnavailable as inst:
-            logger.error('Gearman server is unavailable: %s. Retrying in %d seconds.', inst.args, failSleep)
+            logger.error('Task server is unavailable: %s. Retrying in %d seconds.', inst.args, failSleep)
             time.sleep(failSleep)
             if failSleep < failMaxSleep:
                 failSleep += failSleepIncrementor
@@ -235,6 +309,9 @@ def startThreads(t=1):
 if __name__ == '__main__':
     try:
         loadSupportedModules(config.get('MCPClient', "archivematicaClientModules"))
+        # Refuse to start on a bad task transport configuration, rather than
+        # have every thread fail
+        createWorker()
         startThreads(config.getint('MCPClient', "numberOfTasks"))
         while True:
             time.sleep(100)
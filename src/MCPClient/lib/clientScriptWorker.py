@@ -0,0 +1,199 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2013 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage archivematicaClient
+
+#~DOC~
+#
+# Runs Python client scripts inside a long-lived interpreter.
+#
+# Starting a new interpreter for every task means re-running django.setup()
+# and re-importing lxml, the models, etc. each time, which dominates the
+# runtime of short per-file scripts. A ScriptWorker starts this module once as
+# a separate process; the worker then executes each script it is sent as
+# __main__, with the same argv, exit code and stdout/stderr a subprocess
+# would have produced.
+
+from __future__ import print_function
+import cPickle
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import traceback
+
+LOGGER = logging.getLogger('archivematica.mcp.client')
+
+
+class ScriptWorker(object):
+    """Client side handle on a worker process; one per MCPClient thread."""
+
+    def __init__(self, env_updates, max_tasks=0):
+        """
+        :param dict env_updates: Changes to apply to the worker's environment.
+        :param int max_tasks: Restart the worker after this many scripts; 0 never restarts it.
+        """
+        self.env_updates = env_updates
+        self.max_tasks = max_tasks
+        self.process = None
+        self.tasks = 0
+
+    def start(self):
+        env = os.environ.copy()
+        env['PYTHONIOENCODING'] = 'utf-8'
+        env.update(self.env_updates)
+        self.process = subprocess.Popen([sys.executable, os.path.splitext(os.path.abspath(__file__))[0] + '.py'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.tasks = 0
+        LOGGER.info('Started client script worker %s', self.process.pid)
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait()
+        except (IOError, OSError):
+            pass
+        LOGGER.info('Stopped client script worker %s', self.process.pid)
+        self.process = None
+
+    def run(self, argv):
+        """
+        Run the script argv[0] with arguments argv[1:].
+
+        :returns: (exitCode, stdOut, stdError), as executeOrRun does.
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        try:
+            cPickle.dump(argv, self.process.stdin, cPickle.HIGHEST_PROTOCOL)
+            self.process.stdin.flush()
+            exitCode, stdOut, stdError = cPickle.load(self.process.stdout)
+        except (EOFError, IOError, cPickle.UnpicklingError):
+            LOGGER.exception('Client script worker failed running %s', argv)
+            self.stop()
+            return -1, "", "Client script worker exited unexpectedly while running " + argv[0]
+        self.tasks += 1
+        if self.max_tasks and self.tasks >= self.max_tasks:
+            self.stop()
+        return exitCode, stdOut, stdError
+
+
+def runScript(argv, codeCache):
+    """
+    Execute the script argv[0] as __main__ in this process.
+
+    The script's output is captured at the file descriptor level, so output of
+    commands it runs itself is included, as it would be for a subprocess.
+    Client script modules imported by the script are discarded afterwards so
+    every run starts from a clean module state.
+    """
+    script = argv[0]
+    mtime = os.path.getmtime(script)
+    if codeCache.get(script, (None, None))[0] != mtime:
+        with open(script) as f:
+            codeCache[script] = (mtime, compile(f.read(), script, 'exec', 0, True))
+    code = codeCache[script][1]
+
+    scriptDir = os.path.dirname(os.path.abspath(script))
+    if scriptDir not in sys.path:
+        sys.path.insert(0, scriptDir)
+    modules = set(sys.modules)
+
+    stdOut = tempfile.TemporaryFile()
+    stdError = tempfile.TemporaryFile()
+    savedStreams = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    sys.stdout.flush()
+    sys.stderr.flush()
+    savedFds = os.dup(1), os.dup(2)
+    os.dup2(stdOut.fileno(), 1)
+    os.dup2(stdError.fileno(), 2)
+    cwd = os.getcwd()
+    sys.argv = list(argv)
+
+    exitCode = 0
+    try:
+        exec code in {'__name__': '__main__', '__file__': script, '__builtins__': __builtins__}
+    except SystemExit as e:
+        if e.code is None:
+            exitCode = 0
+        elif isinstance(e.code, (int, long)):
+            exitCode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exitCode = 1
+    except Exception:
+        traceback.print_exc()
+        exitCode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(savedFds[0], 1)
+        os.dup2(savedFds[1], 2)
+        os.close(savedFds[0])
+        os.close(savedFds[1])
+        sys.stdout, sys.stderr = savedStreams
+        os.chdir(cwd)
+        for name in set(sys.modules) - modules:
+            path = getattr(sys.modules[name], '__file__', None) or ''
+            if os.path.dirname(os.path.abspath(path)) == scriptDir:
+                del sys.modules[name]
+
+    stdOut.seek(0)
+    stdError.seek(0)
+    return exitCode, stdOut.read(), stdError.read()
+
+
+def serve(requests, responses):
+    """Run the scripts read from requests until it is closed, writing results to responses."""
+    from django.db import connection
+    codeCache = {}
+    while True:
+        try:
+            argv = cPickle.load(requests)
+        except EOFError:
+            return
+        try:
+            result = runScript(argv, codeCache)
+        except Exception:
+            result = (-1, "", traceback.format_exc())
+        finally:
+            # As auto_close_db does for the client threads
+            connection.close()
+        cPickle.dump(result, responses, cPickle.HIGHEST_PROTOCOL)
+        responses.flush()
+
+
+if __name__ == '__main__':
+    # Keep the protocol pipes away from the standard descriptors, which are
+    # pointed at each script's output while it runs
+    requests = os.fdopen(os.dup(0), 'rb')
+    responses = os.fdopen(os.dup(1), 'wb')
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+    os.close(devnull)
+
+    import django
+    django.setup()
+    serve(requests, responses)
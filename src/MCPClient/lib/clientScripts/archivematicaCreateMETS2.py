@@ -26,10 +26,12 @@ from __future__ import print_function
 import collections
 import copy
 from glob import glob
+import itertools
 import lxml.etree as etree
 import os
 import re
 import sys
+import tempfile
 import traceback
 from uuid import uuid4
 
@@ -37,12 +39,13 @@ import django
 django.setup()
 # dashboard
 from django.contrib.auth.models import User
+from django.db.models import Q
 from django.utils import timezone
-from main.models import Agent, Derivation, DublinCore, Event, File, FileID, FPCommandOutput, SIP, SIPArrange, Transfer
+from main.models import Agent, Derivation, DublinCore, Event, File, FileID, FPCommandOutput, RightsStatement, SIP, SIPArrange, Transfer
 
 import archivematicaCreateMETSReingest
 from archivematicaCreateMETSMetadataCSV import parseMetadata
-from archivematicaCreateMETSRights import archivematicaGetRights
+from archivematicaCreateMETSRights import archivematicaGetRights, createRightsStatement, RIGHTS_PREFETCH
 from archivematicaCreateMETSRightsDspaceMDRef import archivematicaCreateMETSRightsDspaceMDRef
 from archivematicaCreateMETSTrim import getTrimDmdSec
 from archivematicaCreateMETSTrim import getTrimFileDmdSec
@@ -94,6 +97,7 @@ trimStructMapObjects = None
 ##group of the object and it's related access, license
 
 CSV_METADATA = {}
+UNIT_METADATA = None
 
 #move to common
 def newChild(parent, tag, text=None, tailText=None, sets=[]):
@@ -328,6 +332,105 @@ def createDSpaceDMDSec(label, dspace_mets_path, directoryPathSTR):
     return dmdsecs
 
 
+def _pathKey(path):
+    # currentLocation is stored as bytes, paths from disk may be either
+    if isinstance(path, unicode):
+        return path.encode('utf-8')
+    return path
+
+
+class UnitMetadata(object):
+    """
+    Everything the fileSec and amdSecs need about the files in a unit.
+
+    Each table is read once for the whole unit and kept in lookups keyed by
+    file UUID, so building the METS for a file doesn't query the database.
+    Characterization output is dropped once the file's amdSec has it.
+    Only used while building a METS from __main__; the functions that take a
+    fileUUID query the database directly for files it doesn't hold.
+
+    :param str fileGroupType: Name of the field linking Files to the unit, e.g. sip_id
+    :param str fileGroupIdentifier: UUID of the unit
+    """
+
+    def __init__(self, fileGroupType, fileGroupIdentifier):
+        self.files = {}
+        self.filesByLocation = {}
+        self.originals = []
+        for f in File.objects.filter(**{fileGroupType: fileGroupIdentifier}).select_related('transfer'):
+            self.files[f.uuid] = f
+            if f.removedtime is not None:
+                continue
+            self.filesByLocation[_pathKey(f.currentlocation)] = f
+            if f.filegrpuse == 'original':
+                self.originals.append(f)
+        # Ordered as File.objects.filter(...).first() would pick them
+        self.originals.sort(key=lambda f: f.uuid)
+        fileUUIDs = File.objects.filter(**{fileGroupType: fileGroupIdentifier}).values('uuid')
+
+        self.formats = collections.defaultdict(list)
+        rows = FileID.objects.filter(file_id__in=fileUUIDs).values_list('file_id', 'format_name', 'format_version', 'format_registry_name', 'format_registry_key')
+        for row in rows:
+            self.formats[row[0]].append(row[1:])
+
+        self.characterization = collections.defaultdict(list)
+        rows = FPCommandOutput.objects.filter(file_id__in=fileUUIDs, rule__purpose__in=['characterization', 'default_characterization']).values_list('file_id', 'content')
+        for fileUUID, content in rows:
+            self.characterization[fileUUID].append(content)
+
+        # Derivations with either end in the unit
+        self.derivedFrom = collections.defaultdict(list)
+        self.sourceOf = collections.defaultdict(list)
+        derivations = {}
+        for query in ({'source_file_id__in': fileUUIDs}, {'derived_file_id__in': fileUUIDs}):
+            for derivation in Derivation.objects.filter(**query).order_by('id'):
+                derivations[derivation.id] = derivation
+        for _, derivation in sorted(derivations.items()):
+            self.sourceOf[derivation.source_file_id].append(derivation)
+            self.derivedFrom[derivation.derived_file_id].append(derivation)
+
+        self.events = collections.defaultdict(list)
+        for event in Event.objects.filter(file_uuid_id__in=fileUUIDs).prefetch_related('agents'):
+            self.events[event.file_uuid_id].append(event)
+
+        self.rights = collections.defaultdict(list)
+        transferUUIDs = set(f.transfer_id for f in self.files.values() if f.transfer_id)
+        statements = RightsStatement.objects.filter(
+            Q(metadataappliestotype_id=FileMetadataAppliesToType, metadataappliestoidentifier__in=fileUUIDs) |
+            Q(metadataappliestotype_id=SIPMetadataAppliesToType, metadataappliestoidentifier=fileGroupIdentifier) |
+            Q(metadataappliestotype_id=TransferMetadataAppliesToType, metadataappliestoidentifier__in=transferUUIDs)
+        ).prefetch_related(*RIGHTS_PREFETCH)
+        for statement in statements:
+            self.rights[(statement.metadataappliestoidentifier, statement.metadataappliestotype_id)].append(statement)
+
+    def hasFile(self, fileUUID):
+        return fileUUID in self.files
+
+    def fileAt(self, currentLocation):
+        """The File in the unit at currentLocation, or None."""
+        return self.filesByLocation.get(_pathKey(currentLocation))
+
+    def originalsStartingWith(self, field, prefix):
+        """Original Files whose field starts with prefix, ordered by UUID."""
+        prefix = _pathKey(prefix)
+        return [f for f in self.originals if _pathKey(getattr(f, field)).startswith(prefix)]
+
+    def agents(self, fileUUID):
+        """The distinct Agents of the file's Events."""
+        agents = {}
+        for event in self.events[fileUUID]:
+            for agent in event.agents.all():
+                agents[agent.id] = agent
+        return [agent for _, agent in sorted(agents.items())]
+
+    def rightsStatements(self, metadataAppliesToList):
+        """RightsStatements for each (identifier, type) in metadataAppliesToList."""
+        ret = []
+        for key in metadataAppliesToList:
+            ret.extend(self.rights.get(key, []))
+        return ret
+
+
 def createTechMD(fileUUID):
     """
     Create a techMD containing a PREMIS:OBJECT for the file with fileUUID.
@@ -359,7 +462,10 @@ def create_premis_object(fileUUID):
     :param str fileUUID: UUID of the File to create an object for
     :return: premis:object Element, suitable for inserting into mets:xmlData
     """
-    f = File.objects.get(uuid=fileUUID)
+    if UNIT_METADATA is not None and UNIT_METADATA.hasFile(fileUUID):
+        f = UNIT_METADATA.files[fileUUID]
+    else:
+        f = File.objects.get(uuid=fileUUID)
     # PREMIS:OBJECT
     object_elem = etree.Element(ns.premisBNS + "object", nsmap={'premis': ns.premisNS})
     object_elem.set(ns.xsiBNS+"type", "premis:file")
@@ -393,14 +499,17 @@ def create_premis_object(fileUUID):
 
 
 def create_premis_object_formats(fileUUID):
-    files = FileID.objects.filter(file_id=fileUUID)
+    if UNIT_METADATA is not None and UNIT_METADATA.hasFile(fileUUID):
+        rows = UNIT_METADATA.formats[fileUUID]
+    else:
+        rows = FileID.objects.filter(file_id=fileUUID).values_list('format_name', 'format_version', 'format_registry_name', 'format_registry_key')
     elements = []
-    if not files.exists():
+    if not rows:
         fmt = etree.Element(ns.premisBNS + "format")
         formatDesignation = etree.SubElement(fmt, ns.premisBNS + "formatDesignation")
         etree.SubElement(formatDesignation, ns.premisBNS + "formatName").text = "Unknown"
         elements.append(fmt)
-    for row in files.values_list('format_name', 'format_version', 'format_registry_name', 'format_registry_key'):
+    for row in rows:
         fmt = etree.Element(ns.premisBNS + "format")
 
         formatDesignation = etree.SubElement(fmt, ns.premisBNS + "formatDesignation")
@@ -420,8 +529,13 @@ def create_premis_object_characteristics_extensions(fileUUID):
     elements = [objectCharacteristicsExtension]
 
     parser = etree.XMLParser(remove_blank_text=True)
-    documents = FPCommandOutput.objects.filter(file_id=fileUUID, rule__purpose__in=['characterization', 'default_characterization']).values_list('content')
-    for document, in documents:
+    if UNIT_METADATA is not None and UNIT_METADATA.hasFile(fileUUID):
+        # Each file's amdSec is written once; don't keep its tool output
+        # around for the rest of the METS
+        documents = UNIT_METADATA.characterization.pop(fileUUID, [])
+    else:
+        documents = FPCommandOutput.objects.filter(file_id=fileUUID, rule__purpose__in=['characterization', 'default_characterization']).values_list('content', flat=True)
+    for document in documents:
         # This needs to be converted into an str because lxml doesn't accept
         # XML documents in unicode strings if the document contains an
         # encoding declaration.
@@ -433,7 +547,10 @@ def create_premis_object_characteristics_extensions(fileUUID):
 def create_premis_object_derivations(fileUUID):
     elements = []
     # Derivations
-    derivations = Derivation.objects.filter(source_file_id=fileUUID, event__isnull=False)
+    if UNIT_METADATA is not None and UNIT_METADATA.hasFile(fileUUID):
+        derivations = [d for d in UNIT_METADATA.sourceOf[fileUUID] if d.event_id is not None]
+    else:
+        derivations = Derivation.objects.filter(source_file_id=fileUUID, event__isnull=False)
     for derivation in derivations:
         relationship = etree.Element(ns.premisBNS + "relationship")
         etree.SubElement(relationship, ns.premisBNS + "relationshipType").text = "derivation"
@@ -449,7 +566,10 @@ def create_premis_object_derivations(fileUUID):
 
         elements.append(relationship)
 
-    derivations = Derivation.objects.filter(derived_file_id=fileUUID, event__isnull=False)
+    if UNIT_METADATA is not None and UNIT_METADATA.hasFile(fileUUID):
+        derivations = [d for d in UNIT_METADATA.derivedFrom[fileUUID] if d.event_id is not None]
+    else:
+        derivations = Derivation.objects.filter(derived_file_id=fileUUID, event__isnull=False)
     for derivation in derivations:
         relationship = etree.Element(ns.premisBNS + "relationship")
         etree.SubElement(relationship, ns.premisBNS + "relationshipType").text = "derivation"
@@ -474,7 +594,13 @@ def createDigiprovMD(fileUUID):
     global globalDigiprovMDCounter
     ret = []
 
-    events = Event.objects.filter(file_uuid_id=fileUUID)
+    if UNIT_METADATA is not None and UNIT_METADATA.hasFile(fileUUID):
+        events = UNIT_METADATA.events[fileUUID]
+        agents = UNIT_METADATA.agents(fileUUID)
+    else:
+        events = Event.objects.filter(file_uuid_id=fileUUID)
+        agents = Agent.objects.filter(event__file_uuid_id=fileUUID).distinct()
+
     for event_record in events:
         globalDigiprovMDCounter += 1
         digiprovMD = etree.Element(ns.metsBNS + "digiprovMD", ID='digiprovMD_' + str(globalDigiprovMDCounter))
@@ -484,7 +610,6 @@ def createDigiprovMD(fileUUID):
         xmlData = etree.SubElement(mdWrap, ns.metsBNS + "xmlData")
         xmlData.append(createEvent(event_record))
 
-    agents = Agent.objects.filter(event__file_uuid_id=fileUUID).distinct()
     for agent in agents:
         globalDigiprovMDCounter += 1
         digiprovMD = etree.Element(ns.metsBNS + "digiprovMD", ID='digiprovMD_' + str(globalDigiprovMDCounter))
@@ -566,7 +691,11 @@ def getAMDSec(fileUUID, filePath, use, type, sip_uuid, transferUUID, itemdirecto
 
     if use == "original":
         metadataAppliesToList = [(fileUUID, FileMetadataAppliesToType), (sip_uuid, SIPMetadataAppliesToType), (transferUUID, TransferMetadataAppliesToType)]
-        for a in archivematicaGetRights(metadataAppliesToList, fileUUID):
+        if UNIT_METADATA is not None and UNIT_METADATA.hasFile(fileUUID):
+            rights = [createRightsStatement(s, fileUUID) for s in UNIT_METADATA.rightsStatements(metadataAppliesToList)]
+        else:
+            rights = archivematicaGetRights(metadataAppliesToList, fileUUID)
+        for a in rights:
             globalRightsMDCounter +=1
             rightsMD = etree.SubElement(AMD, ns.metsBNS + "rightsMD")
             rightsMD.set("ID", "rightsMD_" + globalRightsMDCounter.__str__())
@@ -681,14 +810,16 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
             DMDIDS = ""
             directoryPathSTR = itemdirectoryPath.replace(baseDirectoryPath, baseDirectoryName, 1)
 
-            kwargs = {
-                "removedtime__isnull": True,
-                fileGroupType: fileGroupIdentifier,
-                "currentlocation": directoryPathSTR
-            }
-            try:
-                f = File.objects.get(**kwargs)
-            except File.DoesNotExist:
+            if UNIT_METADATA is not None:
+                f = UNIT_METADATA.fileAt(directoryPathSTR)
+            else:
+                kwargs = {
+                    "removedtime__isnull": True,
+                    fileGroupType: fileGroupIdentifier,
+                    "currentlocation": directoryPathSTR
+                }
+                f = File.objects.filter(**kwargs).first()
+            if f is None:
                 print("No uuid for file: \"", directoryPathSTR, "\"", file=sys.stderr)
                 sharedVariablesAcrossModules.globalErrorCount += 1
                 continue
@@ -713,7 +844,6 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
 
                 trimAmdSec = etree.Element(ns.metsBNS + "amdSec")
                 globalAmdSecCounter += 1
-                amdSecs.append(trimAmdSec)
                 ID = "amdSec_" + globalAmdSecCounter.__str__()
                 trimAmdSec.set("ID", ID)
 
@@ -722,6 +852,7 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
                 digiprovMD.set("ID", "digiprovMD_" + str(globalDigiprovMDCounter))
 
                 trimAmdSec.append(digiprovMD)
+                amdSecs.append(trimAmdSec)
 
                 trimStructMapObjects.set("ADMID", ID)
 
@@ -767,19 +898,26 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
 
             elif typeOfTransfer == "Dspace" and (use in ("license", "text/ocr", "DSPACEMETS")):
                 # Dspace transfers are treated specially, but some of these fileGrpUses may be encountered in other types
-                kwargs = {
-                    "removedtime__isnull": True,
-                    fileGroupType: fileGroupIdentifier,
-                    "filegrpuse": "original",
-                    "originallocation__startswith": os.path.dirname(f.originallocation)
-                }
-                original_file = File.objects.filter(**kwargs).first()
+                if UNIT_METADATA is not None:
+                    original_files = UNIT_METADATA.originalsStartingWith('originallocation', os.path.dirname(f.originallocation))
+                    original_file = original_files[0] if original_files else None
+                else:
+                    kwargs = {
+                        "removedtime__isnull": True,
+                        fileGroupType: fileGroupIdentifier,
+                        "filegrpuse": "original",
+                        "originallocation__startswith": os.path.dirname(f.originallocation)
+                    }
+                    original_file = File.objects.filter(**kwargs).first()
                 if original_file is not None:
                     GROUPID = 'Group-' + original_file.uuid
 
             elif use in ("preservation", "text/ocr"):
                 # Derived files should be in the original file's group
-                d = Derivation.objects.get(derived_file_id=f.uuid)
+                if UNIT_METADATA is not None and len(UNIT_METADATA.derivedFrom[f.uuid]) == 1:
+                    d = UNIT_METADATA.derivedFrom[f.uuid][0]
+                else:
+                    d = Derivation.objects.get(derived_file_id=f.uuid)
                 GROUPID = "Group-" + d.source_file_id
 
             elif use == "service":
@@ -788,13 +926,19 @@ def createFileSec(directoryPath, parentDiv, baseDirectoryPath, baseDirectoryName
                 objectNameExtensionIndex = fileFileIDPath.rfind(".")
                 fileFileIDPath = fileFileIDPath[:objectNameExtensionIndex + 1]
 
-                kwargs = {
-                    "removedtime__isnull": True,
-                    fileGroupType: fileGroupIdentifier,
-                    "filegrpuse": "original",
-                    "currentlocation__startswith": fileFileIDPath
-                }
-                original_file = File.objects.get(**kwargs)
+                original_files = []
+                if UNIT_METADATA is not None:
+                    original_files = UNIT_METADATA.originalsStartingWith('currentlocation', fileFileIDPath)
+                if len(original_files) == 1:
+                    original_file = original_files[0]
+                else:
+                    kwargs = {
+                        "removedtime__isnull": True,
+                        fileGroupType: fileGroupIdentifier,
+                        "filegrpuse": "original",
+                        "currentlocation__startswith": fileFileIDPath
+                    }
+                    original_file = File.objects.get(**kwargs)
                 GROUPID = "Group-" + original_file.uuid
 
             elif use == "TRIM container metadata":
@@ -992,32 +1136,122 @@ def create_object_metadata(struct_map, baseDirectoryPath):
     return el
 
 
-def write_mets(tree, filename):
+def _in_mets_root(elem, nsmap):
     """
-    Write tree to filename, and a validate METS form.
+    Move elem into a stand-in METS root declaring nsmap.
+
+    Sections serialized on their own otherwise get generated namespace
+    prefixes (ns0:amdSec) instead of those of the METS they end up in.
+    """
+    etree.Element(ns.metsBNS + "mets", nsmap=nsmap).append(elem)
+    return elem
+
+
+class SpooledSections(object):
+    """
+    METS sections kept in a temporary file until the METS is written.
+
+    amdSecs are built along with the fileSec, but have to be written after
+    every dmdSec. Appending one serializes it so it can be freed; iterating
+    parses them back one at a time, after which no more can be appended.
+
+    :param str tag: Tag of the sections, e.g. ns.metsBNS + "amdSec"
+    :param dict nsmap: Namespaces of the METS the sections will be written to
+    """
+
+    def __init__(self, tag, nsmap):
+        self.tag = tag
+        self.nsmap = nsmap
+        self.count = 0
+        self.file = tempfile.TemporaryFile()
+        self.file.write('<sections>')
+        self.closed = False
+
+    def __len__(self):
+        return self.count
+
+    def append(self, elem):
+        if self.closed:
+            raise ValueError('Sections have already been read')
+        self.file.write(etree.tostring(_in_mets_root(elem, self.nsmap), encoding='utf-8'))
+        self.count += 1
+
+    def __iter__(self):
+        if not self.closed:
+            self.file.write('</sections>')
+            self.closed = True
+        self.file.seek(0)
+        for _, elem in etree.iterparse(self.file, tag=self.tag, huge_tree=True):
+            yield elem
+            # Drop each section once it has been used
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def write_mets_incrementally(filename, root_tag, root_attrib, nsmap, sections):
+    """
+    Write a METS to filename one section at a time.
+
+    Each top level section is serialized as it is taken from sections, so
+    sections can be generated, or read back from a SpooledSections, without
+    the whole METS being in memory at once.
 
-    :param ElementTree tree: METS ElementTree
     :param str filename: Filename to write the METS to
+    :param str root_tag: Tag of the root element, ns.metsBNS + "mets"
+    :param dict root_attrib: Attributes of the root element
+    :param dict nsmap: Namespaces to declare on the root element
+    :param sections: Iterable of the root's children, in order
     """
-    tree.write(filename, pretty_print=True, xml_declaration=True, encoding='utf-8')
+    with etree.xmlfile(filename, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(root_tag, attrib=root_attrib, nsmap=nsmap):
+            xf.write('\n')
+            for section in sections:
+                xf.write(_in_mets_root(section, nsmap), pretty_print=True)
 
+
+def write_validator_html(filename):
+    """
+    Write a form for validating the METS at filename next to it.
+
+    The METS is copied into the form a chunk at a time.
+
+    :param str filename: Filename of the METS
+    """
     import cgi
     validate_filename = filename + ".validatorTester.html"
-    fileContents = """<html>
+    with open(filename, 'rb') as mets, open(validate_filename, 'w') as f:
+        f.write("""<html>
 <body>
   <form method="post" action="http://pim.fcla.edu/validate/results">
     <label for="document">Enter XML Document:</label>
     <br/>
-    <textarea id="directinput" rows="12" cols="76" name="document">%s</textarea>
+    <textarea id="directinput" rows="12" cols="76" name="document">""")
+        # Only &, < and > are escaped, so chunks can be escaped separately
+        for chunk in iter(lambda: mets.read(1024 * 1024), ''):
+            f.write(cgi.escape(chunk))
+        f.write("""</textarea>
     <br/>
     <br/>
     <input type="submit" value="Validate" />
     <br/>
   </form>
 </body>
-</html>""" % (cgi.escape(etree.tostring(tree, pretty_print=True, xml_declaration=True, encoding='utf-8')))
-    with open(validate_filename, 'w') as f:
-        f.write(fileContents)
+</html>""")
+
+
+def write_mets(tree, filename, validator_html=True):
+    """
+    Write tree to filename, and optionally a validate METS form.
+
+    :param ElementTree tree: METS ElementTree
+    :param str filename: Filename to write the METS to
+    :param bool validator_html: If True, also write a form for validating the METS
+    """
+    tree.write(filename, pretty_print=True, xml_declaration=True, encoding='utf-8')
+    if validator_html:
+        write_validator_html(filename)
 
 if __name__ == '__main__':
     logger = get_script_logger("archivematica.mcp.client.createMETS2")
@@ -1031,6 +1265,7 @@ if __name__ == '__main__':
     parser.add_option("-t",  "--fileGroupType", action="store", dest="fileGroupType", default="sipUUID") #
     parser.add_option("-x",  "--xmlFile", action="store", dest="xmlFile", default="")
     parser.add_option("-a",  "--amdSec", action="store_true", dest="amdSec", default=False)
+    parser.add_option("--noValidatorHtml", action="store_false", dest="validatorHtml", default=True)
     (opts, args) = parser.parse_args()
 
     SIP_TYPE = opts.sip_type
@@ -1050,7 +1285,7 @@ if __name__ == '__main__':
             fileGroupIdentifier,
         )
         tree = etree.ElementTree(root)
-        write_mets(tree, XMLFile)
+        write_mets(tree, XMLFile, opts.validatorHtml)
         sys.exit(0)
     # End reingest
 
@@ -1069,6 +1304,15 @@ if __name__ == '__main__':
 
     structMap = etree.Element(ns.metsBNS + "structMap", TYPE='physical', ID='structMap_1', LABEL="Archivematica default")
     structMapDiv = etree.SubElement(structMap, ns.metsBNS + 'div', TYPE="Directory", LABEL=os.path.basename(baseDirectoryPath.rstrip('/')))
+    UNIT_METADATA = UnitMetadata(fileGroupType, fileGroupIdentifier)
+    # amdSecs can hold a lot of characterization output; keep them on disk
+    # until they're written
+    rootNSMap = {
+        'mets': ns.metsNS,
+        'xsi': ns.xsiNS,
+        'xlink': ns.xlinkNS,
+    }
+    amdSecs = SpooledSections(ns.metsBNS + "amdSec", rootNSMap)
     structMapDivObjects = createFileSec(objectsDirectoryPath, structMapDiv, baseDirectoryPath, baseDirectoryPathString, fileGroupIdentifier, fileGroupType, includeAmdSec)
 
     el = create_object_metadata(structMapDivObjects, baseDirectoryPath)
@@ -1085,16 +1329,12 @@ if __name__ == '__main__':
         if len(grp) > 0:
             fileSec.append(grp)
 
-    rootNSMap = {
-        'mets': ns.metsNS,
-        'xsi': ns.xsiNS,
-        'xlink': ns.xlinkNS,
-    }
-    root = etree.Element(ns.metsBNS + "mets",
-        nsmap = rootNSMap,
-        attrib = { "{" + ns.xsiNS + "}schemaLocation" : "http://www.loc.gov/METS/ http://www.loc.gov/standards/mets/version18/mets.xsd" },
-    )
-    etree.SubElement(root, ns.metsBNS + "metsHdr").set("CREATEDATE", timezone.now().strftime("%Y-%m-%dT%H:%M:%S"))
+    rootAttrib = { "{" + ns.xsiNS + "}schemaLocation" : "http://www.loc.gov/METS/ http://www.loc.gov/standards/mets/version18/mets.xsd" }
+    # The sections before the amdSecs, in order
+    header = []
+    metsHdr = etree.Element(ns.metsBNS + "metsHdr")
+    metsHdr.set("CREATEDATE", timezone.now().strftime("%Y-%m-%dT%H:%M:%S"))
+    header.append(metsHdr)
 
     dc = createDublincoreDMDSecFromDBData(SIPMetadataAppliesToType, fileGroupIdentifier, baseDirectoryPath)
     if dc != None:
@@ -1106,22 +1346,17 @@ if __name__ == '__main__':
             # Attach the DC metadata to the top level SIP div
             # See #9822 for details
             structMapDiv.set('DMDID', ID)
-        root.append(dmdSec)
-
-    for dmdSec in dmdSecs:
-        root.append(dmdSec)
+        header.append(dmdSec)
 
-    for amdSec in amdSecs:
-        root.append(amdSec)
+    header.extend(dmdSecs)
 
-    root.append(fileSec)
-    root.append(structMap)
-    for structMapIncl in getIncludedStructMap(baseDirectoryPath):
-        root.append(structMapIncl)
+    # The sections after the amdSecs, in order
+    footer = [fileSec, structMap]
+    footer.extend(getIncludedStructMap(baseDirectoryPath))
 
     arranged_structmap = build_arranged_structmap(structMap, fileGroupIdentifier)
     if arranged_structmap is not None:
-        root.append(arranged_structmap)
+        footer.append(arranged_structmap)
 
     printSectionCounters = True
     if printSectionCounters:
@@ -1131,7 +1366,8 @@ if __name__ == '__main__':
         print("RightsMDs:", globalRightsMDCounter)
         print("DigiprovMDs:", globalDigiprovMDCounter)
 
-    tree = etree.ElementTree(root)
-    write_mets(tree, XMLFile)
+    write_mets_incrementally(XMLFile, ns.metsBNS + "mets", rootAttrib, rootNSMap, itertools.chain(header, amdSecs, footer))
+    if opts.validatorHtml:
+        write_validator_html(XMLFile)
 
     sys.exit(sharedVariablesAcrossModules.globalErrorCount)
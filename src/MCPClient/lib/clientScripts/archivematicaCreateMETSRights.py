@@ -38,6 +38,21 @@ from sharedVariablesAcrossModules import sharedVariablesAcrossModules
 
 RIGHTS_BASIS_OTHER = ["Policy", "Donor"]
 
+# Everything createRightsStatement reads from a RightsStatement, for
+# prefetch_related when creating statements for many files
+RIGHTS_PREFETCH = (
+    'rightsstatementcopyright_set__rightsstatementcopyrightnote_set',
+    'rightsstatementcopyright_set__rightsstatementcopyrightdocumentationidentifier_set',
+    'rightsstatementlicense_set__rightsstatementlicensedocumentationidentifier_set',
+    'rightsstatementlicense_set__rightsstatementlicensenote_set',
+    'rightsstatementstatuteinformation_set__rightsstatementstatuteinformationnote_set',
+    'rightsstatementstatuteinformation_set__rightsstatementstatutedocumentationidentifier_set',
+    'rightsstatementotherrightsinformation_set__rightsstatementotherrightsdocumentationidentifier_set',
+    'rightsstatementotherrightsinformation_set__rightsstatementotherrightsinformationnote_set',
+    'rightsstatementrightsgranted_set__restrictions',
+    'rightsstatementrightsgranted_set__notes',
+)
+
 
 def formatDate(date):
     """hack fix for 0.8, easy dashboard insertion ISO 8601 -> edtfSimpleType"""
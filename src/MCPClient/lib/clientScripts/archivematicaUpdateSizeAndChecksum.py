@@ -18,8 +18,10 @@
 # along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import fcntl
 import os
 import re
+import sqlite3
 import sys
 import uuid
 
@@ -33,8 +35,6 @@ from custom_handlers import get_script_logger
 from databaseFunctions import insertIntoDerivations
 from fileOperations import updateSizeAndChecksum
 
-import metsrw
-
 import parse_mets_to_db
 
 logger = get_script_logger('archivematica.mcp.client.updateSizeAndChecksum')
@@ -52,61 +52,133 @@ def find_mets_file(unit_path):
             return os.path.join(src, m.group())
 
 
-def get_file_info_from_mets(shared_path, file_):
+# Columns of the per-transfer table of file information from the METS
+METS_FILE_INFO_COLUMNS = (
+    'uuid', 'file_size', 'checksum', 'checksum_type', 'derivation',
+    'format_registry_name', 'format_registry_key',
+)
+
+
+def _mets_file_info_path(transfer_location):
+    # Next to the METS, so that it goes away with the transfer. Only the
+    # metadata/transfers directory of a reingested AIP's transfer is copied
+    # into the SIP, and the transfer METS only describes objects/.
+    return os.path.join(transfer_location, 'metadata', 'mets-file-info.sqlite')
+
+
+def _mets_signature(mets_file):
+    stat = os.stat(mets_file)
+    return (mets_file, stat.st_mtime, stat.st_size)
+
+
+def _read_mets_file_info(table_path, signature, file_uuid):
     """
-    Get file size, checksum & type, and derivation for this file from METS.
+    Returns the row for `file_uuid` in the table at `table_path`, or None if
+    it's not there. Raises IOError if the table doesn't exist or was built
+    from a different METS file than `signature`.
+    """
+    if not os.path.isfile(table_path):
+        raise IOError('{} does not exist'.format(table_path))
+    conn = sqlite3.connect(table_path)
+    # Compare and return the paths and values as they were stored
+    conn.text_factory = str
+    try:
+        if conn.execute('SELECT mets, mtime, size FROM source').fetchone() != signature:
+            raise IOError('{} is out of date'.format(table_path))
+        row = conn.execute(
+            'SELECT {} FROM file_info WHERE uuid = ?'.format(', '.join(METS_FILE_INFO_COLUMNS)),
+            (file_uuid,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return dict(zip(METS_FILE_INFO_COLUMNS, row))
+
+
+def build_mets_file_info(mets_file, table_path):
+    """
+    Parse the METS file once and store the information of all its files in a
+    SQLite table at `table_path`, for get_file_info_from_mets to look up.
+    """
+    logger.info('Archivematica AIP: reading METS file %s.', mets_file)
+    tmp_path = '{}.{}'.format(table_path, uuid.uuid4())
+    conn = sqlite3.connect(tmp_path)
+    try:
+        with conn:
+            conn.execute('CREATE TABLE source (mets TEXT, mtime REAL, size INTEGER)')
+            conn.execute('INSERT INTO source VALUES (?, ?, ?)', _mets_signature(mets_file))
+            conn.execute('CREATE TABLE file_info ({} TEXT PRIMARY KEY, {} TEXT)'.format(
+                METS_FILE_INFO_COLUMNS[0], ' TEXT, '.join(METS_FILE_INFO_COLUMNS[1:])))
+            conn.executemany(
+                'INSERT OR REPLACE INTO file_info VALUES ({})'.format(', '.join('?' * len(METS_FILE_INFO_COLUMNS))),
+                ((info['uuid'], info['mediainfo_size'], info['checksum'],
+                  info['checksumtype'], info['derivation'],
+                  info['format_registry_name'], info['format_registry_key'])
+                 for info in parse_mets_to_db.iter_file_info(mets_file)))
+    except Exception:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+    # Readers see either the old table or the complete new one
+    os.rename(tmp_path, table_path)
+
+
+def get_mets_file_info(shared_path, transfer, file_uuid):
+    """
+    Look up the information of `file_uuid` in the original METS of `transfer`.
 
-    Given an instance of a File, return a dict with keys: file_size,
-    checksum and checksum_type, as they are described in the original METS
-    document of the transfer. The dict will be empty or missing keys on error.
+    The METS file is parsed only once per transfer, by the first task that
+    needs it; the other tasks wait for it and then read the table it built.
+    Returns None if the file is not in the METS, or if there is no METS.
     """
-    transfer = file_.transfer
     transfer_location = transfer.currentlocation.replace('%sharedPath%', shared_path, 1)
-
     mets_file = find_mets_file(transfer_location)
     if not mets_file:
         logger.info('Archivematica AIP: METS file not found in %s.', transfer_location)
-        return {}
+        return None
 
-    logger.info('Archivematica AIP: reading METS file %s.', mets_file)
-    mets = metsrw.METSDocument.fromfile(mets_file)
+    table_path = _mets_file_info_path(transfer_location)
+    signature = _mets_signature(mets_file)
+    try:
+        return _read_mets_file_info(table_path, signature, file_uuid)
+    except (IOError, sqlite3.Error):
+        pass
+
+    with open(mets_file) as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                # Another task may have built it while we waited for the lock
+                return _read_mets_file_info(table_path, signature, file_uuid)
+            except (IOError, sqlite3.Error):
+                build_mets_file_info(mets_file, table_path)
+            return _read_mets_file_info(table_path, signature, file_uuid)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
 
-    fsentry = mets.get_file(file_uuid=file_.uuid)
-    if not fsentry:
-        logger.error('Archivematica AIP: FSEntry with UUID %s not found', file_.uuid)
-        return {}
-    if not len(fsentry.amdsecs):
-        logger.error('Archivematica AIP: FSEntry.amdsecs is empty')
-        return {}
-    amdsec = fsentry.amdsecs[0]
-    for item in amdsec.subsections:
-        if item.subsection == 'techMD':
-            techmd = item
-    if not techmd:
-        logger.error('Archivematica AIP: techMD section could not be found')
-        return {}
-    if techmd.contents.mdtype != 'PREMIS:OBJECT':
-        logger.error('Archivematica AIP: PREMIS:OBJECT could not be found')
-        return {}
-    pobject = techmd.contents.document  # Element
 
-    size = pobject.findtext('premis:objectCharacteristics/premis:objectCharacteristicsExtension/Mediainfo/File/track[@type="General"]/File_size', namespaces=metsrw.utils.NAMESPACES)
-    checksum = pobject.findtext('premis:objectCharacteristics/premis:fixity/premis:messageDigest', namespaces=metsrw.utils.NAMESPACES)
-    checksum_type = pobject.findtext('premis:objectCharacteristics/premis:fixity/premis:messageDigestAlgorithm', namespaces=metsrw.utils.NAMESPACES)
+def get_file_info_from_mets(shared_path, file_):
+    """
+    Get file size, checksum & type, and derivation for this file from METS.
 
-    derivation_uuid = None
-    related_uuid = pobject.findtext('premis:relationship/premis:relatedObjectIdentification/premis:relatedObjectIdentifierValue', namespaces=metsrw.utils.NAMESPACES)
-    rel = pobject.findtext('premis:relationship/premis:relationshipSubType', namespaces=metsrw.utils.NAMESPACES)
-    if rel == 'is source of':
-        derivation_uuid = related_uuid
+    Given an instance of a File, return a dict with keys: file_size,
+    checksum and checksum_type, as they are described in the original METS
+    document of the transfer. The dict will be empty or missing keys on error.
+    """
+    info = get_mets_file_info(shared_path, file_.transfer, file_.uuid)
+    if info is None:
+        logger.error('Archivematica AIP: file with UUID %s not found in METS', file_.uuid)
+        return {}
 
-    format_version = parse_mets_to_db.parse_format_version(pobject)
+    format_version = parse_mets_to_db.get_format_version(
+        info['format_registry_name'], info['format_registry_key'])
 
     ret = {
-        'file_size': size,
-        'checksum': checksum,
-        'checksum_type': checksum_type,
-        'derivation': derivation_uuid,
+        'file_size': info['file_size'],
+        'checksum': info['checksum'],
+        'checksum_type': info['checksum_type'],
+        'derivation': info['derivation'],
         'format_version': format_version,
     }
     logger.info('Archivematica AIP: %s', ret)
@@ -128,7 +200,7 @@ def main(shared_path, file_uuid, file_path, date, event_uuid):
     if file_.transfer and not file_.sip:
         if file_.transfer.type == 'Archivematica AIP':
             info = get_file_info_from_mets(shared_path, file_)
-            kw.update(fileSize=info['file_size'], checksum=info['checksum'], checksumType=info['checksum_type'], add_event=False)
+            kw.update(fileSize=info.get('file_size'), checksum=info.get('checksum'), checksumType=info.get('checksum_type'), add_event=False)
             if info.get('derivation'):
                 insertIntoDerivations(
                     sourceFileUUID=file_uuid,
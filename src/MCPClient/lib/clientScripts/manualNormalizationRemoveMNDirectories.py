@@ -32,6 +32,7 @@ from main.models import File
 # archivematicaCommon
 from custom_handlers import get_script_logger
 import databaseFunctions
+import fileOperations
 
 logger = get_script_logger("archivematica.mcp.client.manualNormalizationRemoveMNDirectories")
 
@@ -65,6 +66,11 @@ if os.path.isdir(manual_normalization_dir):
                              sip_id=sipUUID)
         databaseFunctions.fileWasRemoved(f.uuid)
 
+    # And the index built from it
+    normalization_index = os.path.join(SIPDirectory, fileOperations.MANUAL_NORMALIZATION_INDEX)
+    if os.path.isfile(normalization_index):
+        os.remove(normalization_index)
+
     # Recursively delete empty manual normalization dir
     try:
         errorCount += recursivelyRemoveEmptyDirectories(manual_normalization_dir)
@@ -83,31 +83,23 @@ def check_manual_normalization(opts):
 
     # If normalization.csv provided, check there for mapping from original
     # to access/preservation file
-    normalization_csv = os.path.join(opts.sip_path, "objects", "manualNormalization", "normalization.csv")
     # Get original name of target file, to handle sanitized names
     file_ = File.objects.get(uuid=opts.file_uuid)
     bname = file_.originallocation.replace('%transferDirectory%objects/', '', 1).replace('%SIPDirectory%objects/', '', 1)
-    if os.path.isfile(normalization_csv):
+    try:
+        # The CSV is read into an index once per SIP, not for every file
+        index = fileOperations.getManualNormalizationIndex(opts.sip_path)
+    except csv.Error as e:
+        print(e, file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return None
+    if index is not None:
         found = False
-        # use universal newline mode to support unusual newlines, like \r
-        with open(normalization_csv, 'rbU') as csv_file:
-            reader = csv.reader(csv_file)
-            # Search the file for an original filename that matches the one provided
-            try:
-                for row in reader:
-                    if not row:
-                        continue
-                    if "#" in row[0]: # ignore comments
-                        continue
-                    original, access_file, preservation_file = row
-                    if original == bname:
-                        print('Filename', bname, 'matches entry in normalization.csv', original)
-                        found = True
-                        break
-            except csv.Error:
-                print("Error reading", normalization_csv, " on line", reader.line_num, file=sys.stderr)
-                traceback.print_exc(file=sys.stderr)
-                return None
+        normalized_files = index.normalizedFiles(bname)
+        if normalized_files is not None:
+            access_file, preservation_file = normalized_files
+            print('Filename', bname, 'matches entry in normalization.csv')
+            found = True
 
         # If we didn't find a match, let it fall through to the usual method
         if found:
@@ -6,7 +6,6 @@ import datetime
 from lxml import etree
 import sys
 import os
-import uuid
 
 import django
 django.setup()
@@ -16,96 +15,154 @@ from fpr import models as fpr_models
 
 # archivematicaCommon
 import namespaces as ns
-import fileOperations
 import databaseFunctions
 
 MD_TYPE_SIP_ID = "3e48343d-e2d2-4956-aaa3-b54d26eb9761"
 
 
-def parse_format_version(element):
+def get_format_version(registry_name, registry_key):
     """
-    Parses the FPR FormatVersion for the file.
+    Looks up the FPR FormatVersion with `registry_key` in `registry_name`.
 
-    Element can be the amdSec, or a PREMIS:OBJECT
-
-    :param element: lxml Element that contains premis:format.
+    :param registry_name: Value of premis:formatRegistryName.
+    :param registry_key: Value of premis:formatRegistryKey.
     :return: FormatVersion object or None
     """
     format_version = None
     try:
         # Looks for PRONOM ID first
-        if element.findtext('.//premis:formatRegistryName', namespaces=ns.NSMAP) == 'PRONOM':
-            puid = element.findtext('.//premis:formatRegistryKey', namespaces=ns.NSMAP)
-            print('PUID', puid)
-            format_version = fpr_models.FormatVersion.active.get(pronom_id=puid)
-        elif element.findtext('.//premis:formatRegistryName', namespaces=ns.NSMAP) == 'Archivematica Format Policy Registry':
-            key = element.findtext('.//premis:formatRegistryKey', namespaces=ns.NSMAP)
-            print('FPR key', key)
-            format_version = fpr_models.IDRule.active.get(command_output=key).format
+        if registry_name == 'PRONOM':
+            print('PUID', registry_key)
+            format_version = fpr_models.FormatVersion.active.get(pronom_id=registry_key)
+        elif registry_name == 'Archivematica Format Policy Registry':
+            print('FPR key', registry_key)
+            format_version = fpr_models.IDRule.active.get(command_output=registry_key).format
     except fpr_models.FormatVersion.DoesNotExist:
         pass
     return format_version
 
 
+def parse_format_version(element):
+    """
+    Parses the FPR FormatVersion for the file.
+
+    Element can be the amdSec, or a PREMIS:OBJECT
+
+    :param element: lxml Element that contains premis:format.
+    :return: FormatVersion object or None
+    """
+    return get_format_version(
+        element.findtext('.//premis:formatRegistryName', namespaces=ns.NSMAP),
+        element.findtext('.//premis:formatRegistryKey', namespaces=ns.NSMAP))
+
+
+def current_techmd(amdsec):
+    """
+    Returns the current PREMIS:OBJECT techMD of an amdSec, or None.
+
+    Reingested AIPs mark the techMDs they replace as superseded.
+    """
+    techmds = amdsec.xpath('mets:techMD[not(@STATUS="superseded")][mets:mdWrap/@MDTYPE="PREMIS:OBJECT"]', namespaces=ns.NSMAP)
+    if not techmds:
+        return None
+    return techmds[0]
+
+
+def parse_techmd(techmd):
+    """
+    Parses the file information in a PREMIS:OBJECT techMD.
+
+    The format is returned as its registry name and key, see
+    get_format_version to look it up in the FPR.
+
+    :param techmd: lxml Element of the techMD.
+    :return: Dict of file information, with the values found or None.
+    """
+    info = {
+        'uuid': techmd.findtext('.//premis:objectIdentifierValue', namespaces=ns.NSMAP),
+        'original_path': techmd.findtext('.//premis:originalName', namespaces=ns.NSMAP),
+        'checksum': techmd.findtext('.//premis:messageDigest', namespaces=ns.NSMAP),
+        'checksumtype': techmd.findtext('.//premis:messageDigestAlgorithm', namespaces=ns.NSMAP),
+        'size': techmd.findtext('.//premis:size', namespaces=ns.NSMAP),
+        'mediainfo_size': techmd.findtext('.//premis:objectCharacteristicsExtension/Mediainfo/File/track[@type="General"]/File_size', namespaces=ns.NSMAP),
+        'format_registry_name': techmd.findtext('.//premis:formatRegistryName', namespaces=ns.NSMAP),
+        'format_registry_key': techmd.findtext('.//premis:formatRegistryKey', namespaces=ns.NSMAP),
+        'derivation': None,
+        'derivation_event': None,
+    }
+    rel = techmd.findtext('.//premis:relationshipSubType', namespaces=ns.NSMAP)
+    if rel == 'is source of':
+        info['derivation'] = techmd.findtext('.//premis:relatedObjectIdentifierValue', namespaces=ns.NSMAP)
+        info['derivation_event'] = techmd.findtext('.//premis:relatedEventIdentifierValue', namespaces=ns.NSMAP)
+    return info
+
+
+def iter_file_info(mets_path):
+    """
+    Parses the file information of every amdSec in a METS file.
+
+    The METS file is parsed incrementally, and each amdSec is discarded once
+    parsed, so large METS files don't have to fit in memory.
+
+    :param mets_path: Path to the METS file.
+    :return: Iterator of the dicts returned by parse_techmd.
+    """
+    for _, amdsec in etree.iterparse(mets_path, tag=ns.metsBNS + 'amdSec'):
+        techmd = current_techmd(amdsec)
+        if techmd is not None:
+            yield parse_techmd(techmd)
+        amdsec.clear()
+        while amdsec.getprevious() is not None:
+            del amdsec.getparent()[0]
+
+
 def parse_files(root):
     filesec = root.find('.//mets:fileSec', namespaces=ns.NSMAP)
     files = []
 
+    techmds = {amdsec.get('ID'): current_techmd(amdsec) for amdsec in root.xpath('mets:amdSec', namespaces=ns.NSMAP)}
+
     for fe in filesec.findall('.//mets:file', namespaces=ns.NSMAP):
         filegrpuse = fe.getparent().get('USE')
         print('filegrpuse', filegrpuse)
 
         amdid = fe.get('ADMID')
         print('amdid', amdid)
-        current_techmd = root.xpath('mets:amdSec[@ID="' + amdid + '"]/mets:techMD[not(@STATUS="superseded")]', namespaces=ns.NSMAP)[0]
+        info = parse_techmd(techmds[amdid])
 
-        file_uuid = current_techmd.findtext('.//premis:objectIdentifierValue', namespaces=ns.NSMAP)
+        file_uuid = info['uuid']
         print('file_uuid', file_uuid)
 
-        original_path = current_techmd.findtext('.//premis:originalName', namespaces=ns.NSMAP)
-        original_path = original_path.replace('%transferDirectory%', '%SIPDirectory%')
+        original_path = info['original_path'].replace('%transferDirectory%', '%SIPDirectory%')
         print('original_path', original_path)
 
         current_path = fe.find('mets:FLocat', namespaces=ns.NSMAP).get(ns.xlinkBNS+'href')
         current_path = '%SIPDirectory%' + current_path
         print('current_path', current_path)
 
-        checksum = current_techmd.findtext('.//premis:messageDigest', namespaces=ns.NSMAP)
-        print('checksum', checksum)
-
-        checksumtype = current_techmd.findtext('.//premis:messageDigestAlgorithm', namespaces=ns.NSMAP)
-        print('checksumtype', checksumtype)
-
-        size = current_techmd.findtext('.//premis:size', namespaces=ns.NSMAP)
-        print('size', size)
+        print('checksum', info['checksum'])
+        print('checksumtype', info['checksumtype'])
+        print('size', info['size'])
 
         # FormatVersion
-        format_version = parse_format_version(current_techmd)
+        format_version = get_format_version(info['format_registry_name'], info['format_registry_key'])
         print('format_version', format_version)
 
         # Derivation
-        derivation = derivation_event = None
-        event = current_techmd.findtext('.//premis:relatedEventIdentifierValue', namespaces=ns.NSMAP)
-        print('derivation event', event)
-        related_uuid = current_techmd.findtext('.//premis:relatedObjectIdentifierValue', namespaces=ns.NSMAP)
-        print('related_uuid', related_uuid)
-        rel = current_techmd.findtext('.//premis:relationshipSubType', namespaces=ns.NSMAP)
-        print('relationship', rel)
-        if rel == 'is source of':
-            derivation = related_uuid
-            derivation_event = event
+        print('derivation', info['derivation'])
+        print('derivation event', info['derivation_event'])
 
         file_info = {
             'uuid': file_uuid,
             'original_path': original_path,
             'current_path': current_path,
             'use': filegrpuse,
-            'checksum': checksum,
-            'checksumtype': checksumtype,
-            'size': size,
+            'checksum': info['checksum'],
+            'checksumtype': info['checksumtype'],
+            'size': info['size'],
             'format_version': format_version,
-            'derivation': derivation,
-            'derivation_event': derivation_event,
+            'derivation': info['derivation'],
+            'derivation_event': info['derivation_event'],
         }
 
         files.append(file_info)
@@ -122,44 +179,55 @@ def update_files(sip_uuid, files):
     :param files: List of dicts containing file info.
     """
     now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-    # Add information to the DB
+    # Add files & reingest events
+    databaseFunctions.bulkInsertIntoFiles(
+        {
+            'fileUUID': file_info['uuid'],
+            'filePath': file_info['original_path'],
+            'enteredSystem': now,
+            'sipUUID': sip_uuid,
+            'use': file_info['use'],
+        } for file_info in files
+    )
+    agents = databaseFunctions.getAMAgentsForUnit(sipUUID=sip_uuid)
+    databaseFunctions.bulkInsertIntoEvents(
+        {
+            'fileUUID': file_info['uuid'],
+            'eventType': "reingestion",
+            'eventDateTime': now,
+            'agents': agents,
+        } for file_info in files
+    )
+
+    # Update other file info
+    # This doesn't use updateSizeAndChecksum because it also updates currentlocation
     for file_info in files:
-        # Add file & reingest event
-        event_id = str(uuid.uuid4())
-        fileOperations.addFileToSIP(
-            filePathRelativeToSIP=file_info['original_path'],
-            fileUUID=file_info['uuid'],
-            sipUUID=sip_uuid,
-            taskUUID=event_id,
-            date=now,
-            sourceType="reingestion",
-            use=file_info['use'],
-        )
-        # Update other file info
-        # This doesn't use updateSizeAndChecksum because it also updates currentlocation
         models.File.objects.filter(uuid=file_info['uuid']).update(
             checksum=file_info['checksum'],
             checksumtype=file_info['checksumtype'],
             size=file_info['size'],
             currentlocation=file_info['current_path']
         )
-        if file_info['format_version']:
-            # Add Format ID
-            models.FileFormatVersion.objects.create(
+    # Add Format IDs
+    models.FileFormatVersion.objects.bulk_create(
+        [
+            models.FileFormatVersion(
                 file_uuid_id=file_info['uuid'],
                 format_version=file_info['format_version']
-            )
+            ) for file_info in files if file_info['format_version']
+        ],
+        batch_size=databaseFunctions.BULK_BATCH_SIZE
+    )
 
     # Derivation info
-    # Has to be separate loop, as derived file may not be in DB otherwise
+    # Inserted after all the files, as derived file may not be in DB otherwise
     # May not need to be parsed, if Derivation info can be roundtripped in METS Reader/Writer
-    for file_info in files:
-        if file_info['derivation'] is None:
-            continue
-        databaseFunctions.insertIntoDerivations(
-            sourceFileUUID=file_info['uuid'],
-            derivedFileUUID=file_info['derivation'],
-        )
+    databaseFunctions.bulkInsertIntoDerivations(
+        {
+            'sourceFileUUID': file_info['uuid'],
+            'derivedFileUUID': file_info['derivation'],
+        } for file_info in files if file_info['derivation'] is not None
+    )
 
 def parse_dc(sip_uuid, root):
     """
@@ -33,13 +33,54 @@ from main.models import File
 
 # archivematicaCommon
 from custom_handlers import get_script_logger
-from fileOperations import updateFileLocation
+from databaseFunctions import bulkInsertIntoEvents
 from archivematicaFunctions import unicodeToStr
+from fileOperations import updateFileLocations
 import sanitizeNames
 
 logger = logging.getLogger()
 
 
+def build_sanitization_trie(sanitizations, root):
+    """
+    Returns a prefix trie of the renames made below `root`, from the
+    sanitizations returned by sanitizeNames.sanitizeRecursively.
+
+    sanitizeRecursively renames a directory before listing it, so each of
+    its keys is the path of a name before it was sanitized, inside
+    directories whose names have already been sanitized. Each node of the
+    trie is a (renames, children) tuple for a directory: renames maps the
+    names in it to their sanitized names, and children maps the sanitized
+    names of its subdirectories to their nodes.
+    """
+    root = os.path.join(os.path.abspath(root), '')
+    trie = ({}, {})
+    for oldpath, newpath in sanitizations.items():
+        if not oldpath.startswith(root):
+            continue
+        names = oldpath[len(root):].split(os.sep)
+        node = trie
+        for name in names[:-1]:
+            node = node[1].setdefault(name, ({}, {}))
+        node[0][names[-1]] = os.path.basename(newpath)
+    return trie
+
+
+def sanitize_path(trie, path):
+    """
+    Returns the sanitized version of `path`, relative to the root of `trie`,
+    looking up each of its names once.
+    """
+    names = path.split(os.sep)
+    node = trie
+    for i, name in enumerate(names):
+        names[i] = node[0].get(name, name)
+        node = node[1].get(names[i])
+        if node is None:
+            break
+    return os.sep.join(names)
+
+
 def sanitize_object_names(objectsDirectory, sipUUID, date, groupType, groupSQL, sipPath):
     """Sanitize object names in a Transfer/SIP."""
     relativeReplacement = objectsDirectory.replace(sipPath, groupType, 1)  # "%SIPDirectory%objects/"
@@ -51,58 +92,51 @@ def sanitize_object_names(objectsDirectory, sipUUID, date, groupType, groupSQL,
 
     eventDetail = 'program="sanitizeNames"; version="' + sanitizeNames.VERSION + '"'
 
+    if groupType not in ("%SIPDirectory%", "%transferDirectory%"):
+        print("bad group type", groupType, file=sys.stderr)
+        sys.exit(3)
+
     # Update files in DB
     kwargs = {
         groupSQL: sipUUID,
         "removedtime__isnull": True,
     }
-    for f in File.objects.filter(**kwargs):
+    trie = build_sanitization_trie(sanitizations, objectsDirectory)
+    objectsPrefix = os.path.join(objectsDirectory, '')
+    locations = {}
+    events = []
+    for fileUUID, currentlocation in File.objects.filter(**kwargs).values_list('uuid', 'currentlocation').iterator():
         # Check all files to see if any parent directory had a sanitization event
         current_location = unicodeToStr(
-            unicodedata.normalize('NFC', f.currentlocation)).replace(
+            unicodedata.normalize('NFC', currentlocation)).replace(
                 groupType, sipPath)
-        sanitized_location = unicodeToStr(current_location)
         logger.info('Checking %s', current_location)
 
-        # Check parent directories
-        # Since directory keys are a mix of sanitized and unsanitized, this is a little complicated
-        # Directories keys are in the form sanitized/sanitized/unsanitized
-        # When a match is found (eg 'unsanitized' -> 'sanitized') reset the search
-        # This will find 'sanitized/unsanitized2' -> 'sanitized/sanitized2' on the next pass
-        # TODO This should be checked for a more efficient solution
-        dirpath = sanitized_location
-        while objectsDirectory in dirpath:  # Stay within unit
-            if dirpath in sanitizations:  # Make replacement
-                sanitized_location = sanitized_location.replace(dirpath, sanitizations[dirpath])
-                dirpath = sanitized_location  # Reset search
-            else:  # Check next level up
-                dirpath = os.path.dirname(dirpath)
+        sanitized_location = current_location
+        if current_location.startswith(objectsPrefix):  # Stay within unit
+            sanitized_location = objectsPrefix + sanitize_path(trie, current_location[len(objectsPrefix):])
 
         if current_location != sanitized_location:
             oldfile = current_location.replace(objectsDirectory, relativeReplacement, 1)
             newfile = sanitized_location.replace(objectsDirectory, relativeReplacement, 1)
-            kwargs = {
-                'src': oldfile,
-                'dst': newfile,
+            logger.info('Sanitized name: %s -> %s', oldfile, newfile)
+            print('Sanitized name:', oldfile, " -> ", newfile)
+            locations[fileUUID] = newfile
+            events.append({
+                'fileUUID': fileUUID,
                 'eventType': 'name cleanup',
                 'eventDateTime': date,
                 'eventDetail': "prohibited characters removed:" + eventDetail,
-                'fileUUID': None,
-            }
-            if groupType == "%SIPDirectory%":
-                kwargs['sipUUID'] = sipUUID
-            elif groupType == "%transferDirectory%":
-                kwargs['transferUUID'] = sipUUID
-            else:
-                print("bad group type", groupType, file=sys.stderr)
-                sys.exit(3)
-            logger.info('Sanitized name: %s -> %s', oldfile, newfile)
-            print('Sanitized name:', oldfile, " -> ", newfile)
-            updateFileLocation(**kwargs)
+                'eventOutcome': "",
+                'eventOutcomeDetailNote': "Original name=\"%s\"; cleaned up name=\"%s\"" % (oldfile, newfile),
+            })
         else:
             logger.info('No sanitization for %s', current_location)
             print('No sanitization found for', current_location)
 
+    updateFileLocations(locations)
+    bulkInsertIntoEvents(events)
+
 
 if __name__ == '__main__':
     logger = get_script_logger("archivematica.mcp.client.sanitizeObjectNames")
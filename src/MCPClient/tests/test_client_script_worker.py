@@ -0,0 +1,55 @@
+import os
+import sys
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+
+from clientScriptWorker import runScript
+
+SCRIPT = """
+from __future__ import print_function
+import subprocess
+import sys
+
+import helper
+
+print('args', sys.argv[1:])
+print(helper.calls, file=sys.stderr)
+helper.calls.append(1)
+subprocess.call(['echo', 'from a child process'])
+if __name__ == '__main__':
+    sys.exit(int(sys.argv[1]))
+"""
+
+
+def _write_scripts(tmpdir):
+    tmpdir.join('helper.py').write('calls = []\n')
+    script = tmpdir.join('script.py')
+    script.write(SCRIPT)
+    return str(script)
+
+
+def test_run_script_captures_exit_code_and_output(tmpdir):
+    script = _write_scripts(tmpdir)
+    exit_code, stdout, stderr = runScript([script, '3'], {})
+    assert exit_code == 3
+    assert "args ['3']" in stdout
+    assert 'from a child process' in stdout
+    assert '[]' in stderr
+
+
+def test_run_script_starts_each_run_with_fresh_client_script_modules(tmpdir):
+    script = _write_scripts(tmpdir)
+    cache = {}
+    runScript([script, '0'], cache)
+    exit_code, _, stderr = runScript([script, '0'], cache)
+    assert exit_code == 0
+    assert stderr.strip() == '[]'
+
+
+def test_run_script_reports_uncaught_exceptions(tmpdir):
+    script = tmpdir.join('broken.py')
+    script.write("raise ValueError('broken script')\n")
+    exit_code, _, stderr = runScript([str(script)], {})
+    assert exit_code == 1
+    assert 'ValueError: broken script' in stderr
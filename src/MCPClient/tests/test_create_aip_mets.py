@@ -1,8 +1,11 @@
 # -*- coding: utf8
 import collections
 import csv
+import itertools
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 from django.test import TestCase
@@ -492,6 +495,50 @@ class TestCreateDigiprovMD(TestCase):
         assert ret[8].find('.//{info:lc/xmlns/premis-v2}agentName').text == 'username="kmindelan", first_name="Keladry", last_name="Mindelan"'
         assert ret[8].find('.//{info:lc/xmlns/premis-v2}agentType').text == 'Archivematica user'
 
+    def test_creates_events_from_unit_metadata(self):
+        """
+        It should create the same Events and Agents from UnitMetadata
+        It should not query the database once UnitMetadata is loaded
+        """
+        file_uuid = 'ae8d4290-fe52-4954-b72a-0f591bee2e2f'
+        expected = archivematicaCreateMETS2.createDigiprovMD(file_uuid)
+        metadata = archivematicaCreateMETS2.UnitMetadata('sip_id', '4060ee97-9c3f-4822-afaf-ebdf838284c3')
+        archivematicaCreateMETS2.UNIT_METADATA = metadata
+        try:
+            with self.assertNumQueries(0):
+                ret = archivematicaCreateMETS2.createDigiprovMD(file_uuid)
+        finally:
+            archivematicaCreateMETS2.UNIT_METADATA = None
+        assert len(ret) == len(expected) == 9
+        for elem, expected_elem in zip(ret, expected):
+            assert etree.tostring(elem[0]) == etree.tostring(expected_elem[0])
+
+class TestCharacterization(TestCase):
+    """ Test creating objectCharacteristicsExtensions from FPCommandOutput. """
+
+    fixture_files = ['sip.json', 'files.json', 'fpr-reingest.json', 'reingest-characterization.json']
+    fixtures = [os.path.join(THIS_DIR, 'fixtures', p) for p in fixture_files]
+
+    def test_unit_metadata_characterization_is_released(self):
+        """
+        It should create the same objectCharacteristicsExtension from UnitMetadata
+        It should not keep a file's characterization output once it is written
+        """
+        file_uuid = 'ae8d4290-fe52-4954-b72a-0f591bee2e2f'
+        expected = archivematicaCreateMETS2.create_premis_object_characteristics_extensions(file_uuid)
+        metadata = archivematicaCreateMETS2.UnitMetadata('sip_id', '4060ee97-9c3f-4822-afaf-ebdf838284c3')
+        assert len(metadata.characterization[file_uuid]) == 2
+        archivematicaCreateMETS2.UNIT_METADATA = metadata
+        try:
+            with self.assertNumQueries(0):
+                ret = archivematicaCreateMETS2.create_premis_object_characteristics_extensions(file_uuid)
+        finally:
+            archivematicaCreateMETS2.UNIT_METADATA = None
+        assert len(ret[0]) == 2
+        assert etree.tostring(ret[0]) == etree.tostring(expected[0])
+        assert not metadata.characterization
+
+
 class TestRights(TestCase):
     """ Test archivematicaCreateMETSRights creating rightsMD. """
 
@@ -529,3 +576,75 @@ class TestRights(TestCase):
         assert rightsgranted[3].text == 'Attribution required'
         assert len(rightsgranted[3].attrib) == 0
         assert len(rightsgranted[3]) == 0
+
+    def test_unit_metadata_rights(self):
+        """It should load the unit's RightsStatements with everything needed to create them."""
+        sip_uuid = '2941f14c-bd57-4f4a-a514-a3bf6ac5adf0'
+        metadata = archivematicaCreateMETS2.UnitMetadata('sip_id', sip_uuid)
+        with self.assertNumQueries(0):
+            statements = metadata.rightsStatements([(sip_uuid, archivematicaCreateMETS2.SIPMetadataAppliesToType)])
+            elems = [archivematicaCreateMETSRights.createRightsStatement(s, 'file-uuid') for s in statements]
+        assert len(elems) == 5
+        expected = RightsStatement.objects.filter(metadataappliestoidentifier=sip_uuid)
+        assert [s.id for s in statements] == [s.id for s in expected]
+
+
+class TestWriteMETS(unittest.TestCase):
+    """ Test writing the METS a section at a time. """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _amdsec(self, i):
+        amdsec = etree.Element('{http://www.loc.gov/METS/}amdSec', ID='amdSec_%d' % i)
+        techmd = etree.SubElement(amdsec, '{http://www.loc.gov/METS/}techMD')
+        obj = etree.SubElement(techmd, '{info:lc/xmlns/premis-v2}object', nsmap={'premis': NSMAP['premis']})
+        etree.SubElement(obj, '{info:lc/xmlns/premis-v2}originalName').text = u'%d-dé & <ja>.txt' % i
+        return amdsec
+
+    def test_spooled_sections(self):
+        """
+        It should return the sections appended, in order
+        It should use the namespace prefixes of the METS
+        It should not allow appending after the sections have been read
+        """
+        spool = archivematicaCreateMETS2.SpooledSections('{http://www.loc.gov/METS/}amdSec', {'mets': NSMAP['mets']})
+        for i in range(3):
+            spool.append(self._amdsec(i))
+        assert len(spool) == 3
+        ret = [(e.prefix, e.get('ID'), e.findtext('.//premis:originalName', namespaces=NSMAP)) for e in spool]
+        assert ret == [('mets', 'amdSec_%d' % i, u'%d-dé & <ja>.txt' % i) for i in range(3)]
+        with self.assertRaises(ValueError):
+            spool.append(self._amdsec(3))
+
+    def test_write_mets_incrementally(self):
+        """
+        It should write the same METS as writing the whole tree
+        It should write a validator form only if asked to
+        """
+        nsmap = {'mets': NSMAP['mets'], 'xsi': 'http://www.w3.org/2001/XMLSchema-instance'}
+        attrib = {'{http://www.w3.org/2001/XMLSchema-instance}schemaLocation': 'http://www.loc.gov/METS/ http://www.loc.gov/standards/mets/version18/mets.xsd'}
+        spool = archivematicaCreateMETS2.SpooledSections('{http://www.loc.gov/METS/}amdSec', nsmap)
+        for i in range(3):
+            spool.append(self._amdsec(i))
+        header = [etree.Element('{http://www.loc.gov/METS/}metsHdr', CREATEDATE='2016-01-01T00:00:00')]
+        footer = [etree.Element('{http://www.loc.gov/METS/}fileSec')]
+
+        incremental = os.path.join(self.tmpdir, 'incremental.xml')
+        archivematicaCreateMETS2.write_mets_incrementally(incremental, '{http://www.loc.gov/METS/}mets', attrib, nsmap, itertools.chain(header, spool, footer))
+        archivematicaCreateMETS2.write_validator_html(incremental)
+
+        root = etree.Element('{http://www.loc.gov/METS/}mets', attrib=attrib, nsmap=nsmap)
+        root.extend(header + [self._amdsec(i) for i in range(3)] + footer)
+        whole = os.path.join(self.tmpdir, 'whole.xml')
+        archivematicaCreateMETS2.write_mets(etree.ElementTree(root), whole, validator_html=False)
+
+        parser = etree.XMLParser(remove_blank_text=True)
+        assert etree.tostring(etree.parse(incremental, parser), method='c14n') == etree.tostring(etree.parse(whole, parser), method='c14n')
+        assert os.path.isfile(incremental + '.validatorTester.html')
+        assert not os.path.exists(whole + '.validatorTester.html')
+        with open(incremental + '.validatorTester.html') as f:
+            assert '&amp;lt;ja&amp;gt;.txt' in f.read()
@@ -467,6 +467,22 @@ class TestParseFiles(TestCase):
         assert pres['derivation_event'] == self.PRES_INFO['derivation_event']
 
 
+    def test_iter_file_info(self):
+        """
+        It should parse the current techMD of each amdSec, in order.
+        """
+        files = list(parse_mets_to_db.iter_file_info(os.path.join(THIS_DIR, 'fixtures', 'mets_superseded_techmd.xml')))
+        assert [f['uuid'] for f in files] == [self.PRES_INFO['uuid'], self.ORIG_INFO['uuid'], self.METS_INFO['uuid']]
+        orig = files[1]
+        assert orig['checksum'] == self.ORIG_INFO['checksum']
+        assert orig['checksumtype'] == self.ORIG_INFO['checksumtype']
+        assert orig['size'] == self.ORIG_INFO['size']
+        assert orig['derivation'] == self.ORIG_INFO['derivation']
+        assert orig['derivation_event'] == self.ORIG_INFO['derivation_event']
+        format_version = parse_mets_to_db.get_format_version(orig['format_registry_name'], orig['format_registry_key'])
+        assert format_version == self.ORIG_INFO['format_version']
+
+
     def test_insert_file_info(self):
         """ It should insert file info into the DB. """
         files = [self.METS_INFO, self.PRES_INFO, self.ORIG_INFO]
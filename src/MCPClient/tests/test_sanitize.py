@@ -74,3 +74,22 @@ class TestSanitize(TestCase):
         finally:
             # Delete files
             shutil.rmtree(transfer_path)
+
+    def test_sanitize_path(self):
+        """
+        It should find the sanitized path of a file from its original path,
+        whether the file or any of its parent directories were renamed.
+        """
+        sanitizations = {
+            '/unit/objects/a dir': '/unit/objects/a_dir',
+            '/unit/objects/a_dir/sub dir': '/unit/objects/a_dir/sub_dir',
+            '/unit/objects/a_dir/sub_dir/file 1.txt': '/unit/objects/a_dir/sub_dir/file_1.txt',
+            '/unit/objects/other dir/file.txt': '/unit/objects/other dir/file_1.txt',
+            '/elsewhere/file 2.txt': '/elsewhere/file_2.txt',
+        }
+        trie = sanitizeObjectNames.build_sanitization_trie(sanitizations, '/unit/objects/')
+        assert sanitizeObjectNames.sanitize_path(trie, 'a dir/sub dir/file 1.txt') == 'a_dir/sub_dir/file_1.txt'
+        assert sanitizeObjectNames.sanitize_path(trie, 'a dir/sub dir/file2.txt') == 'a_dir/sub_dir/file2.txt'
+        assert sanitizeObjectNames.sanitize_path(trie, 'a dir/file 1.txt') == 'a_dir/file 1.txt'
+        assert sanitizeObjectNames.sanitize_path(trie, 'other dir/file.txt') == 'other dir/file_1.txt'
+        assert sanitizeObjectNames.sanitize_path(trie, 'file 2.txt') == 'file 2.txt'
@@ -0,0 +1,71 @@
+# -*- coding: utf8
+import os
+import shutil
+import sys
+import tempfile
+
+from django.test import TestCase
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib/clientScripts')))
+import archivematicaUpdateSizeAndChecksum
+import parse_mets_to_db
+
+from main import models
+
+
+class TestMETSFileInfo(TestCase):
+    """Test looking up file information in the METS of an AIP transfer."""
+
+    fixture_files = ['formats.json']
+    fixtures = [os.path.join(THIS_DIR, 'fixtures', p) for p in fixture_files]
+
+    transfer_uuid = 'e95ab50f-9c84-45d5-a3ca-1b0b3f58d9b6'
+    file_uuid = 'ae8d4290-fe52-4954-b72a-0f591bee2e2f'
+
+    def setUp(self):
+        self.shared_path = tempfile.mkdtemp() + os.sep
+        metadata = os.path.join(self.shared_path, 'currentlyProcessing', 'aip', 'metadata')
+        os.makedirs(metadata)
+        self.mets_file = os.path.join(metadata, 'METS.' + self.transfer_uuid + '.xml')
+        shutil.copy(os.path.join(THIS_DIR, 'fixtures', 'mets_no_metadata.xml'), self.mets_file)
+        self.transfer = models.Transfer.objects.create(
+            uuid=self.transfer_uuid,
+            currentlocation='%sharedPath%currentlyProcessing/aip/',
+            type='Archivematica AIP')
+        self.iter_file_info = parse_mets_to_db.iter_file_info
+        self.parsed = []
+        parse_mets_to_db.iter_file_info = self.fake_iter_file_info
+
+    def tearDown(self):
+        parse_mets_to_db.iter_file_info = self.iter_file_info
+        shutil.rmtree(self.shared_path)
+
+    def fake_iter_file_info(self, mets_path):
+        self.parsed.append(mets_path)
+        return self.iter_file_info(mets_path)
+
+    def get_file_info(self, file_uuid):
+        file_ = models.File(uuid=file_uuid, transfer=self.transfer)
+        return archivematicaUpdateSizeAndChecksum.get_file_info_from_mets(self.shared_path, file_)
+
+    def test_parses_mets_once(self):
+        info = self.get_file_info(self.file_uuid)
+        assert info['checksum'] == 'd2bed92b73c7090bb30a0b30016882e7069c437488e1513e9deaacbe29d38d92'
+        assert info['checksum_type'] == 'sha256'
+        assert info['derivation'] == '8140ebe5-295c-490b-a34a-83955b7c844e'
+        assert info['format_version'].uuid == '01fac958-274d-41ef-978f-d9cf711b3c4a'
+        info = self.get_file_info('590bd882-7521-498c-8f89-0958218f779d')
+        assert info['checksum_type'] == 'md5'
+        assert info['derivation'] is None
+        assert self.get_file_info('00000000-0000-0000-0000-000000000000') == {}
+        assert self.parsed == [self.mets_file]
+        # The table is kept with the transfer
+        assert sorted(os.listdir(os.path.dirname(self.mets_file))) == ['METS.' + self.transfer_uuid + '.xml', 'mets-file-info.sqlite']
+
+    def test_reparses_changed_mets(self):
+        self.get_file_info(self.file_uuid)
+        with open(self.mets_file, 'a') as f:
+            f.write('\n')
+        self.get_file_info(self.file_uuid)
+        assert self.parsed == [self.mets_file, self.mets_file]
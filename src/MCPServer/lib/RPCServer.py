@@ -29,7 +29,9 @@ from socket import gethostname
 import sys
 import time
 
+from eventLog import EVENT_LOG
 from linkTaskManagerChoice import choicesAvailableForUnits
+import workflow
 
 
 LOGGER = logging.getLogger("archivematica.mcp.server.rpcserver")
@@ -74,6 +76,22 @@ def gearmanGetJobsAwaitingApproval(gearman_worker, gearman_job):
         LOGGER.exception('Error getting jobs awaiting approval')
         raise
 
+def gearmanGetEvents(gearman_worker, gearman_job):
+    try:
+        data = cPickle.loads(gearman_job.data)
+        return cPickle.dumps(EVENT_LOG.since(data.get("since"), data.get("log")))
+    except Exception:
+        LOGGER.exception('Error getting events')
+        raise
+
+def gearmanReloadWorkflow(gearman_worker, gearman_job):
+    try:
+        workflow.invalidate()
+        return cPickle.dumps(True)
+    except Exception:
+        LOGGER.exception('Error reloading workflow')
+        raise
+
 
 def startRPCServer():
     gm_worker = gearman.GearmanWorker([archivematicaMCP.config.get('MCPServer', 'GearmanServerWorker')])
@@ -81,6 +99,8 @@ def startRPCServer():
     gm_worker.set_client_id(hostID)
     gm_worker.register_task("approveJob", gearmanApproveJob)
     gm_worker.register_task("getJobsAwaitingApproval", gearmanGetJobsAwaitingApproval)
+    gm_worker.register_task("reloadWorkflow", gearmanReloadWorkflow)
+    gm_worker.register_task("getEvents", gearmanGetEvents)
     failMaxSleep = 30
     failSleep = 1
     failSleepIncrementor = 2
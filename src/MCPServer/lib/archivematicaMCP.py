@@ -55,7 +55,10 @@ from django.db.models import Q
 # This project, alphabetical by import source
 import watchDirectory
 import RPCServer
+from scheduler import PRIORITY_UNIT, SCHEDULER
 from utils import log_exceptions
+import taskStandard
+import workflow
 
 from jobChain import jobChain
 from unitSIP import unitSIP
@@ -68,10 +71,7 @@ from django_mysqlpool import auto_close_db
 import databaseFunctions
 from archivematicaFunctions import unicodeToStr
 
-from main.models import Job, SIP, Task, WatchedDirectory
-
-global countOfCreateUnitAndJobChainThreaded
-countOfCreateUnitAndJobChainThreaded = 0
+from main.models import Job, SIP, Task, UnitStatus, WatchedDirectory
 
 config = ConfigParser.SafeConfigParser()
 config.read("/etc/archivematica/MCPServer/serverConfig.conf")
@@ -80,11 +80,12 @@ config.read("/etc/archivematica/MCPServer/serverConfig.conf")
 dbWaitSleep = 2
 
 
+# Size of the scheduler's worker pool
 limitTaskThreads = config.getint('Protocol', "limitTaskThreads")
-limitTaskThreadsSleep = config.getfloat('Protocol', "limitTaskThreadsSleep")
-limitGearmanConnectionsSemaphore = threading.Semaphore(value=config.getint('Protocol', "limitGearmanConnections"))
-reservedAsTaskProcessingThreads = config.getint('Protocol', "reservedAsTaskProcessingThreads")
-stopSignalReceived = False #Tracks whether a sigkill has been received or not
+# Number of per-file tasks sent to the MCPClient as one gearman job; 1 disables batching
+taskBatchSize = 1
+if config.has_option('Protocol', "taskBatchSize"):
+    taskBatchSize = max(1, config.getint('Protocol', "taskBatchSize"))
 
 def isUUID(uuid):
     """Return boolean of whether it's string representation of a UUID v4"""
@@ -155,7 +156,7 @@ def findOrCreateSipInDB(path, waitSleep=dbWaitSleep, unit_type='SIP'):
 
 @log_exceptions
 @auto_close_db
-def createUnitAndJobChain(path, config, terminate=False):
+def createUnitAndJobChain(path, config):
     path = unicodeToStr(path)
     if os.path.isdir(path):
             path = path + "/"
@@ -181,26 +182,10 @@ def createUnitAndJobChain(path, config, terminate=False):
         return
     jobChain(unit, config[1])
 
-    if terminate:
-        exit(0)
-
-def createUnitAndJobChainThreaded(path, config, terminate=True):
-    global countOfCreateUnitAndJobChainThreaded
-    try:
-        logger.debug('Watching path %s', path)
-        t = threading.Thread(target=createUnitAndJobChain, args=(path, config), kwargs={"terminate":terminate})
-        t.daemon = True
-        countOfCreateUnitAndJobChainThreaded += 1
-        while(limitTaskThreads <= threading.activeCount() + reservedAsTaskProcessingThreads ):
-            if stopSignalReceived:
-                logger.info('Signal was received; stopping createUnitAndJobChainThreaded(path, config)')
-                exit(0)
-            logger.debug('Active thread count: %s', threading.activeCount())
-            time.sleep(.5)
-        countOfCreateUnitAndJobChainThreaded -= 1
-        t.start()
-    except Exception:
-        logger.exception('Error creating threads to watch directories')
+def createUnitAndJobChainThreaded(path, config):
+    """Queue the creation of a unit and its job chain on the scheduler."""
+    logger.debug('Watching path %s', path)
+    SCHEDULER.submit(createUnitAndJobChain, args=(path, config), priority=PRIORITY_UNIT)
 
 def watchDirectories():
     """Start watching the watched directories defined in the WatchedDirectories table in the database."""
@@ -209,6 +194,12 @@ def watchDirectories():
 
     watched_directories = WatchedDirectory.objects.all()
 
+    # A single inotify notifier serves every watched directory it can;
+    # the rest fall back to polling every `interval` seconds
+    notifier = None
+    if not config.has_option('MCPServer', "watchDirectoriesUseInotify") or config.getboolean('MCPServer', "watchDirectoriesUseInotify"):
+        notifier = watchDirectory.inotifyNotifier.create()
+
     for watched_directory in watched_directories:
         directory = watched_directory.watched_directory_path.replace("%watchDirectoryPath%", watched_dir_path, 1)
 
@@ -222,9 +213,7 @@ def watchDirectories():
                 continue
             item = item.decode("utf-8")
             path = os.path.join(unicode(directory), item)
-            while(limitTaskThreads <= threading.activeCount() + reservedAsTaskProcessingThreads ):
-                time.sleep(1)
-            createUnitAndJobChainThreaded(path, row, terminate=False)
+            createUnitAndJobChainThreaded(path, row)
         actOnFiles=True
         if watched_directory.only_act_on_directories:
             actOnFiles=False
@@ -234,13 +223,14 @@ def watchDirectories():
             callBackFunctionAdded=createUnitAndJobChainThreaded,
             alertOnFiles=actOnFiles,
             interval=interval,
+            notifier=notifier,
         )
 
 def signal_handler(signalReceived, frame):
     """Used to handle the stop/kill command signals (SIGKILL)"""
     logger.info('Recieved signal %s in frame %s', signalReceived, frame)
-    global stopSignalReceived
-    stopSignalReceived = True
+    # Don't start any more work while exiting
+    SCHEDULER.stop(wait=False)
     threads = threading.enumerate()
     for thread in threads:
         logger.warning('Not stopping %s %s', type(thread), thread)
@@ -253,11 +243,10 @@ def signal_handler(signalReceived, frame):
 @auto_close_db
 def debugMonitor():
     """Periodically prints out status of MCP, including whether the database lock is locked, thread count, etc."""
-    global countOfCreateUnitAndJobChainThreaded
     while True:
         logger.debug('Debug monitor: datetime: %s', databaseFunctions.getUTCDate())
         logger.debug('Debug monitor: thread count: %s', threading.activeCount())
-        logger.debug('Debug monitor: created job chain threaded: %s', countOfCreateUnitAndJobChainThreaded)
+        logger.debug('Debug monitor: scheduled work pending: %s', SCHEDULER.pending())
         time.sleep(3600)
 
 @log_exceptions
@@ -270,6 +259,9 @@ def flushOutputs():
 
 def cleanupOldDbEntriesOnNewRun():
     Job.objects.filter(currentstep='Awaiting decision').delete()
+    # Their status came from the jobs just deleted
+    for unitUUID, unitType in UnitStatus.objects.filter(status=UnitStatus.USER_INPUT).values_list('unit_uuid', 'unit_type'):
+        databaseFunctions.refreshUnitStatus(unitUUID, unitType)
     Job.objects.filter(currentstep='Executing command(s)').update(currentstep='Failed')
     Task.objects.filter(exitcode=None).update(exitcode=-1, stderror="MCP shut down while processing.")
 
@@ -341,6 +333,9 @@ if __name__ == '__main__':
     t.daemon = True
     t.start()
     cleanupOldDbEntriesOnNewRun()
+    workflow.get()
+    taskStandard.taskClient()
+    SCHEDULER.start(limitTaskThreads)
     watchDirectories()
 
     # This is blocking the main thread with the worker loop
@@ -0,0 +1,119 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2013 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPServer
+
+import collections
+import logging
+import threading
+import time
+import uuid
+
+LOGGER = logging.getLogger('archivematica.mcp.server')
+
+# Event types
+JOB_CREATED = 'job-created'
+JOB_COMPLETED = 'job-completed'
+JOB_UPDATED = 'job-updated'
+AWAITING_DECISION = 'awaiting-decision'
+
+
+class EventLog(object):
+    """
+    In-memory log of the most recent job events, for the dashboard to follow
+    without polling the database.
+
+    Each event gets the next sequence number; subscribers ask for the events
+    after the last sequence number they have seen (see since()). Only the last
+    `size` events are kept, and sequence numbers start over when MCPServer
+    restarts, which is why each log also has a random ID.
+    """
+
+    def __init__(self, size=1000):
+        self.id = str(uuid.uuid4())
+        self.events = collections.deque(maxlen=size)
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def publish(self, eventType, **details):
+        """Append an event of `eventType`, with `details`, to the log."""
+        with self.lock:
+            self.sequence += 1
+            event = dict(details, type=eventType, sequence=self.sequence, time=time.time())
+            self.events.append(event)
+        LOGGER.debug('Event %(sequence)d: %(type)s', event)
+        return event
+
+    def since(self, sequence=None, logID=None):
+        """
+        Returns the events after `sequence`, as a dict with:
+
+        * log: the ID of this log
+        * sequence: the sequence number of the last event
+        * events: the events, oldest first
+        * complete: False if events were missed, either because `logID` is
+          not this log's (MCPServer restarted) or because they were dropped
+          from the log; the subscriber should reload the state then.
+        """
+        with self.lock:
+            events = list(self.events)
+            lastSequence = self.sequence
+        complete = sequence is not None and logID == self.id
+        if complete:
+            firstKept = events[0]['sequence'] if events else lastSequence + 1
+            complete = sequence >= firstKept - 1
+            events = [event for event in events if event['sequence'] > sequence]
+        return {
+            'log': self.id,
+            'sequence': lastSequence,
+            'events': events if complete else [],
+            'complete': complete,
+        }
+
+
+def publishJobEvent(eventType, jobChainLink, **details):
+    """Publish an event about the job of `jobChainLink` to EVENT_LOG."""
+    # Same unit UUID and type as logJobCreatedSQL records for the job
+    unit = jobChainLink.unit
+    unitUUID = unit.UUID
+    if unit.owningUnit is not None:
+        unitUUID = unit.owningUnit.UUID
+    return EVENT_LOG.publish(
+        eventType,
+        jobUUID=jobChainLink.UUID,
+        unitUUID=unitUUID,
+        unitType=unit.__class__.__name__,
+        microserviceGroup=str(jobChainLink.microserviceGroup),
+        description=jobChainLink.description,
+        **details)
+
+
+def publishJobStep(jobChainLink, currentStep):
+    """Publish the change of a job's current step to `currentStep`."""
+    if currentStep == 'Awaiting decision':
+        eventType = AWAITING_DECISION
+    elif currentStep.startswith('Waiting till'):
+        eventType = JOB_UPDATED
+    else:
+        eventType = JOB_COMPLETED
+    return publishJobEvent(eventType, jobChainLink, currentStep=currentStep)
+
+
+EVENT_LOG = EventLog()
@@ -25,12 +25,13 @@ import logging
 import sys
 
 from jobChainLink import jobChainLink
+import workflow
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from dicts import ReplacementDict
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import MicroServiceChain, UnitVariable
+from main.models import UnitVariable
 
 #Holds:
 #-UNIT
@@ -70,7 +71,7 @@ class jobChain:
         self.linkSplitCount = 1
         self.subJobOf = subJobOf
 
-        chain = MicroServiceChain.objects.get(id=str(chainPK))
+        chain = workflow.get().chain(chainPK)
         LOGGER.debug('Chain: %s', chain)
         self.startingChainLink = chain.startinglink_id
         self.description = chain.description
@@ -24,7 +24,9 @@ import logging
 import sys
 import uuid
 
+from eventLog import JOB_CREATED, publishJobEvent, publishJobStep
 from utils import log_exceptions
+import workflow
 from linkTaskManagerDirectories import linkTaskManagerDirectories
 from linkTaskManagerFiles import linkTaskManagerFiles
 from linkTaskManagerChoice import linkTaskManagerChoice
@@ -38,10 +40,10 @@ from linkTaskManagerUnitVariableLinkPull import linkTaskManagerUnitVariableLinkP
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from django_mysqlpool import auto_close_db
-from databaseFunctions import logJobCreatedSQL, getUTCDate
+from databaseFunctions import logJobCreatedSQL, getUTCDate, updateUnitStatus
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import Job, MicroServiceChainLink, MicroServiceChainLinkExitCode, TaskType
+from main.models import Job, TaskType
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
@@ -70,22 +72,20 @@ class jobChainLink:
 
         # Depending on the path that led to this, jobChainLinkPK may
         # either be a UUID or a MicroServiceChainLink instance
-        if isinstance(jobChainLinkPK, basestring):
-            try:
-                link = MicroServiceChainLink.objects.get(id=str(jobChainLinkPK))
-            # This will sometimes return no values
-            except MicroServiceChainLink.DoesNotExist:
-                return
-        else:
-            link = jobChainLinkPK
+        if not isinstance(jobChainLinkPK, basestring):
+            jobChainLinkPK = jobChainLinkPK.id
+        link = workflow.get().link(jobChainLinkPK)
+        # This will sometimes return no values
+        if link is None:
+            return
 
         self.pk = link.id
 
         self.currentTask = link.currenttask_id
         self.defaultNextChainLink = link.defaultnextchainlink_id
-        taskType = link.currenttask.tasktype_id
-        taskTypePKReference = link.currenttask.tasktypepkreference
-        self.description = link.currenttask.description
+        taskType = link.tasktype_id
+        taskTypePKReference = link.tasktypepkreference
+        self.description = link.description
         self.reloadFileList = link.reloadfilelist
         self.defaultExitMessage = link.defaultexitmessage
         self.microserviceGroup = link.microservicegroup
@@ -94,6 +94,7 @@ class jobChainLink:
         self.unit.reload()
 
         logJobCreatedSQL(self)
+        publishJobEvent(JOB_CREATED, self)
 
         if self.createTasks(taskType, taskTypePKReference) == None:
             self.getNextChainLinkPK(None)
@@ -128,23 +129,24 @@ class jobChainLink:
 
     def getNextChainLinkPK(self, exitCode):
         if exitCode is not None:
-            try:
-                return MicroServiceChainLinkExitCode.objects.get(microservicechainlink_id=str(self.pk), exitcode=str(exitCode)).nextmicroservicechainlink_id
-            except (MicroServiceChainLinkExitCode.DoesNotExist, MicroServiceChainLinkExitCode.MultipleObjectsReturned):
+            configured = workflow.get().exitCode(self.pk, exitCode)
+            if configured is None:
                 return self.defaultNextChainLink
+            return configured.nextmicroservicechainlink_id
 
     @log_exceptions
     @auto_close_db
     def setExitMessage(self, message):
         Job.objects.filter(jobuuid=self.UUID).update(currentstep=str(message))
+        updateUnitStatus(self, str(message))
+        publishJobStep(self, str(message))
 
     def updateExitMessage(self, exitCode):
         message = self.defaultExitMessage
         if exitCode is not None:
-            try:
-                message = MicroServiceChainLinkExitCode.objects.get(microservicechainlink_id=str(self.pk), exitcode=str(exitCode)).exitmessage
-            except MicroServiceChainLinkExitCode.DoesNotExist:
-                pass
+            configured = workflow.get().exitCode(self.pk, exitCode)
+            if configured is not None:
+                message = configured.exitmessage
         if message is not None:
             self.setExitMessage(message)
         else:
@@ -33,6 +33,7 @@ from linkTaskManager import LinkTaskManager
 from executeOrRunSubProcess import executeOrRun
 import jobChain
 from utils import log_exceptions
+import workflow
 import archivematicaMCP
 global choicesAvailableForUnits
 choicesAvailableForUnits = {}
@@ -43,7 +44,7 @@ from django_mysqlpool import auto_close_db
 from archivematicaFunctions import unicodeToStr
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import MicroServiceChainChoice, UserProfile
+from main.models import UserProfile
 
 waitingOnTimer="waitingOnTimer"
 
@@ -57,9 +58,8 @@ class linkTaskManagerChoice(LinkTaskManager):
         self.delayTimerLock = threading.Lock()
         self.delayTimer = None
 
-        choices = MicroServiceChainChoice.objects.filter(choiceavailableatlink_id=str(jobChainLink.pk))
-        for choice in choices:
-            self.choices.append((choice.chainavailable_id, choice.chainavailable.description))
+        for choice in workflow.get().chainChoicesAt(jobChainLink.pk):
+            self.choices.append((choice.chainavailable_id, choice.description))
 
         preConfiguredChain = self.checkForPreconfiguredXML()
         if preConfiguredChain != None:
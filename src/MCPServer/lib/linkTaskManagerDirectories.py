@@ -22,24 +22,23 @@
 # @author Joseph Perry <joseph@artefactual.com>
 
 from linkTaskManager import LinkTaskManager
+from scheduler import SCHEDULER
 from taskStandard import taskStandard
+import workflow
 import os
 import sys
-import threading
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import archivematicaFunctions
 import databaseFunctions
 from dicts import ReplacementDict
-sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import StandardTaskConfig
 
 
 class linkTaskManagerDirectories(LinkTaskManager):
     def __init__(self, jobChainLink, pk, unit):
         super(linkTaskManagerDirectories, self).__init__(jobChainLink, pk, unit)
         self.tasks = []
-        stc = StandardTaskConfig.objects.get(id=str(pk))
+        stc = workflow.get().standardTask(pk)
         filterSubDir = stc.filter_subdir
         self.requiresOutputLock = stc.requires_output_lock
         standardOutputFile = stc.stdout_file
@@ -71,9 +70,7 @@ class linkTaskManagerDirectories(LinkTaskManager):
 
         self.task = taskStandard(self, execute, arguments, standardOutputFile, standardErrorFile, UUID=self.UUID)
         databaseFunctions.logTaskCreatedSQL(self, commandReplacementDic, self.UUID, arguments)
-        t = threading.Thread(target=self.task.performTask)
-        t.daemon = True
-        t.start()
+        SCHEDULER.submit(self.task.performTask)
 
     def taskCompletedCallBackFunction(self, task):
         databaseFunctions.logTaskCompletedSQL(task)
@@ -25,19 +25,20 @@ import ast
 import logging
 import os
 import threading
-import time
 import sys
 import uuid
 
 import archivematicaMCP
 from linkTaskManager import LinkTaskManager
-from taskStandard import taskStandard
+from scheduler import SCHEDULER
+from taskStandard import taskBatch, taskStandard
+import workflow
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import archivematicaFunctions
 import databaseFunctions
-from dicts import ReplacementDict
+from dicts import ReplacementDict, ReplacementTemplate
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import StandardTaskConfig, UnitVariable
+from main.models import UnitVariable
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
@@ -49,7 +50,7 @@ class linkTaskManagerFiles(LinkTaskManager):
         self.exitCode = 0
         self.clearToNextLink = False
 
-        stc = StandardTaskConfig.objects.get(id=str(pk))
+        stc = workflow.get().standardTask(pk)
         # These three may be concatenated/compared with other strings,
         # so they need to be bytestrings here
         filterFileEnd = str(stc.filter_file_end) if stc.filter_file_end else ''
@@ -86,7 +87,7 @@ class linkTaskManagerFiles(LinkTaskManager):
         # Escape all values for shell
         for key, value in SIPReplacementDic.items():
             SIPReplacementDic[key] = archivematicaFunctions.escapeForCommand(value)
-        self.tasksLock.acquire()
+        fileUnits = []
         for file, fileUnit in unit.fileList.items():
             if filterFileEnd:
                 if not file.endswith(filterFileEnd):
@@ -97,48 +98,102 @@ class linkTaskManagerFiles(LinkTaskManager):
             if filterSubDir:
                 if not file.startswith(unit.pathString + filterSubDir):
                     continue
+            fileUnits.append(fileUnit)
+
+        # The passVar replacement values are the same for every file, so they
+        # are applied once, and the result parsed once to be filled in for each file
+        arguments = self.arguments
+        standardOutputFile = self.standardOutputFile
+        standardErrorFile = self.standardErrorFile
+        if self.jobChainLink.passVar is not None:
+            if isinstance(self.jobChainLink.passVar, list):
+                for passVar in self.jobChainLink.passVar:
+                    if isinstance(passVar, ReplacementDict):
+                        arguments, standardOutputFile, standardErrorFile = passVar.replace(arguments, standardOutputFile, standardErrorFile)
+            elif isinstance(self.jobChainLink.passVar, ReplacementDict):
+                arguments, standardOutputFile, standardErrorFile = self.jobChainLink.passVar.replace(arguments, standardOutputFile, standardErrorFile)
+        template = ReplacementTemplate(arguments, standardOutputFile, standardErrorFile)
+        unitValues = dict((key, SIPReplacementDic[key]) for key in template.keys if key in SIPReplacementDic)
+        # Only the file values that are used are escaped: those in the
+        # template, and %relativeLocation%, which is logged with the task
+        escapedKeys = template.keys | set(['%relativeLocation%'])
+
+        # Only batch when there are more files than can be processed at once,
+        # so small units are still spread across all available clients
+        batchSize = min(archivematicaMCP.taskBatchSize, len(fileUnits) // archivematicaMCP.limitTaskThreads)
+        batch = []
 
-            standardOutputFile = self.standardOutputFile
-            standardErrorFile = self.standardErrorFile
-            execute = self.execute
-            arguments = self.arguments
-
-            # Apply passvar replacement values
-            if self.jobChainLink.passVar is not None:
-                if isinstance(self.jobChainLink.passVar, list):
-                    for passVar in self.jobChainLink.passVar:
-                        if isinstance(passVar, ReplacementDict):
-                            arguments, standardOutputFile, standardErrorFile = passVar.replace(arguments, standardOutputFile, standardErrorFile)
-                elif isinstance(self.jobChainLink.passVar, ReplacementDict):
-                    arguments, standardOutputFile, standardErrorFile = self.jobChainLink.passVar.replace(arguments, standardOutputFile, standardErrorFile)
-
-            # Apply file replacement values
-            commandReplacementDic = fileUnit.getReplacementDic()
-            for key, value in commandReplacementDic.items():
-                # Escape values for shell
-                commandReplacementDic[key] = archivematicaFunctions.escapeForCommand(value)
-            arguments, standardOutputFile, standardErrorFile = commandReplacementDic.replace(arguments, standardOutputFile, standardErrorFile)
-
-            # Apply unit (SIP/Transfer) replacement values
-            arguments, standardOutputFile, standardErrorFile = SIPReplacementDic.replace(arguments, standardOutputFile, standardErrorFile)
+        self.tasksLock.acquire()
+        for commandReplacementDic in self._fileReplacementDics(unit, fileUnits):
+            for key in escapedKeys:
+                if key in commandReplacementDic:
+                    commandReplacementDic[key] = archivematicaFunctions.escapeForCommand(commandReplacementDic[key])
+
+            # File replacement values take precedence over the unit's, and
+            # unit (SIP/Transfer) variables in them are replaced too
+            values = dict(unitValues)
+            for key in template.keys:
+                if key in commandReplacementDic:
+                    value = commandReplacementDic[key]
+                    if isinstance(value, basestring) and '%' in value:
+                        value = SIPReplacementDic.replace(value)[0]
+                    values[key] = value
+            arguments, standardOutputFile, standardErrorFile = template.replace(values)
 
             UUID = str(uuid.uuid4())
-            task = taskStandard(self, execute, arguments, standardOutputFile, standardErrorFile, outputLock=outputLock, UUID=UUID)
+            task = taskStandard(self, self.execute, arguments, standardOutputFile, standardErrorFile, outputLock=outputLock, UUID=UUID)
             self.tasks[UUID] = task
-            databaseFunctions.logTaskCreatedSQL(self, commandReplacementDic, UUID, arguments)
-            t = threading.Thread(target=task.performTask)
-            t.daemon = True
-            while(archivematicaMCP.limitTaskThreads <= threading.activeCount()):
-                self.tasksLock.release()
-                time.sleep(archivematicaMCP.limitTaskThreadsSleep)
-                self.tasksLock.acquire()
-            t.start()
+            if batchSize > 1:
+                batch.append((commandReplacementDic, task))
+                if len(batch) >= batchSize:
+                    self.performBatch(batch)
+                    batch = []
+            else:
+                databaseFunctions.logTaskCreatedSQL(self, commandReplacementDic, UUID, arguments)
+                SCHEDULER.submit(task.performTask)
+
+        if batch:
+            self.performBatch(batch)
 
         self.clearToNextLink = True
         self.tasksLock.release()
         if self.tasks == {}:
             self.jobChainLink.linkProcessingComplete(self.exitCode)
 
+    def _fileReplacementDics(self, unit, fileUnits):
+        """
+        Yields the ReplacementDict of each of fileUnits. The dicts of the
+        files in the database are built from a single query, for only those
+        files if there are few of them, or else for all of the unit's files.
+        """
+        pending = {}
+        for fileUnit in fileUnits:
+            if fileUnit.UUID == "None":
+                yield fileUnit.getReplacementDic()
+            else:
+                pending[fileUnit.UUID] = fileUnit
+        if pending:
+            fileUUIDs = None
+            if len(pending) <= databaseFunctions.BULK_BATCH_SIZE:
+                fileUUIDs = list(pending)
+            for fileUUID, commandReplacementDic in unit.getFileReplacementDics(fileUUIDs):
+                if pending.pop(fileUUID, None) is not None:
+                    yield commandReplacementDic
+                    if not pending:
+                        break
+        # Left for files whose UUID was not found
+        for fileUnit in pending.itervalues():
+            yield fileUnit.getReplacementDic()
+
+    def performBatch(self, batch):
+        """Log a chunk of tasks with one bulk insert and submit them as a single gearman job.
+
+        :param list batch: (commandReplacementDic, taskStandard) tuples.
+        """
+        databaseFunctions.logTasksCreatedSQL(self, [(commandReplacementDic, task.UUID, task.arguments) for commandReplacementDic, task in batch])
+        tasks = taskBatch(self, self.execute, [task for _, task in batch])
+        SCHEDULER.submit(tasks.performTask)
+
     def taskCompletedCallBackFunction(self, task):
         self.exitCode = max(self.exitCode, abs(task.results["exitCode"]))
         databaseFunctions.logTaskCompletedSQL(task)
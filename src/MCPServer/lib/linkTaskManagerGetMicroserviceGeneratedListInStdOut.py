@@ -25,17 +25,16 @@
 import logging
 import os
 import sys
-import threading
 
 # This project,  alphabetical by import source
 from linkTaskManager import LinkTaskManager
+from scheduler import SCHEDULER
 from taskStandard import taskStandard
+import workflow
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import archivematicaFunctions
 import databaseFunctions
 from dicts import ChoicesDict, ReplacementDict
-sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import StandardTaskConfig
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
@@ -43,7 +42,7 @@ class linkTaskManagerGetMicroserviceGeneratedListInStdOut(LinkTaskManager):
     def __init__(self, jobChainLink, pk, unit):
         super(linkTaskManagerGetMicroserviceGeneratedListInStdOut, self).__init__(jobChainLink, pk, unit)
         self.tasks = []
-        stc = StandardTaskConfig.objects.get(id=str(pk))
+        stc = workflow.get().standardTask(pk)
         filterSubDir = stc.filter_subdir
         self.requiresOutputLock = stc.requires_output_lock
         standardOutputFile = stc.stdout_file
@@ -75,9 +74,7 @@ class linkTaskManagerGetMicroserviceGeneratedListInStdOut(LinkTaskManager):
 
         self.task = taskStandard(self, execute, arguments, standardOutputFile, standardErrorFile, UUID=self.UUID)
         databaseFunctions.logTaskCreatedSQL(self, commandReplacementDic, self.UUID, arguments)
-        t = threading.Thread(target=self.task.performTask)
-        t.daemon = True
-        t.start()
+        SCHEDULER.submit(self.task.performTask)
 
     def taskCompletedCallBackFunction(self, task):
         databaseFunctions.logTaskCompletedSQL(task)
@@ -34,11 +34,12 @@ import archivematicaMCP
 from linkTaskManagerChoice import choicesAvailableForUnits
 from linkTaskManagerChoice import choicesAvailableForUnitsLock
 from linkTaskManagerChoice import waitingOnTimer
+import workflow
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from dicts import ReplacementDict
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import MicroServiceChoiceReplacementDic, UserProfile
+from main.models import UserProfile
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
@@ -47,7 +48,7 @@ class linkTaskManagerReplacementDicFromChoice(LinkTaskManager):
         super(linkTaskManagerReplacementDicFromChoice, self).__init__(jobChainLink, pk, unit)
 
         self.choices = []
-        dicts = MicroServiceChoiceReplacementDic.objects.filter(choiceavailableatlink=str(jobChainLink.pk))
+        dicts = workflow.get().replacementDicChoicesAt(jobChainLink.pk)
         for i, dic in enumerate(dicts):
             self.choices.append((i, dic.description, dic.replacementdic))
 
@@ -82,7 +83,11 @@ class linkTaskManagerReplacementDicFromChoice(LinkTaskManager):
                 for preconfiguredChoice in root.findall(".//preconfiguredChoice"):
                     if preconfiguredChoice.find("appliesTo").text == self.jobChainLink.pk:
                         desiredChoice = preconfiguredChoice.find("goToChain").text
-                        dic = MicroServiceChoiceReplacementDic.objects.get(id=desiredChoice, choiceavailableatlink=self.jobChainLink.pk)
+                        dic = next((d for d in workflow.get().replacementDicChoicesAt(self.jobChainLink.pk) if d.id == desiredChoice), None)
+                        if dic is None:
+                            LOGGER.warning('Preconfigured choice %s in %s is not offered at link %s; awaiting a decision instead',
+                                           desiredChoice, xmlFilePath, self.jobChainLink.pk)
+                            break
                         ret = dic.replacementdic
                         try:
                             #<delay unitAtime="yes">30</delay>
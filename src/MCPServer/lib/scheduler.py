@@ -0,0 +1,103 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2013 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPServer
+
+import itertools
+import logging
+import Queue
+import threading
+
+LOGGER = logging.getLogger('archivematica.mcp.server')
+
+# Lower values run first. Tasks belonging to jobs that are already running
+# take precedence over starting new units, so work in progress drains before
+# more is picked up from the watched directories.
+PRIORITY_TASK = 0
+PRIORITY_UNIT = 10
+# Stopping a worker goes ahead of any queued work
+PRIORITY_STOP = -1
+
+
+class Scheduler(object):
+    """
+    Runs MCPServer work on a fixed pool of worker threads.
+
+    Work is queued with submit() and picked up by the first idle worker in
+    priority order (FIFO within the same priority). An optional callback is
+    called with the return value once the work has completed.
+    """
+
+    def __init__(self):
+        self.queue = Queue.PriorityQueue()
+        self.threads = []
+        self.lock = threading.Lock()
+        # Tie-breaker so that items of equal priority keep submission order
+        # and the queue never has to compare the callables themselves
+        self.counter = itertools.count()
+
+    def start(self, workers):
+        """Start worker threads until there are `workers` of them."""
+        with self.lock:
+            while len(self.threads) < workers:
+                t = threading.Thread(target=self.work, name='MCPServerWorker-%d' % (len(self.threads) + 1))
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+        LOGGER.info('Scheduler started with %d workers', len(self.threads))
+
+    def submit(self, fn, args=(), kwargs=None, priority=PRIORITY_TASK, callback=None):
+        """Queue fn(*args, **kwargs) to be run by a worker."""
+        self.queue.put((priority, next(self.counter), fn, args, kwargs or {}, callback))
+
+    def stop(self, wait=True):
+        """Stop the workers once they finish what they are running; queued work is left in the queue."""
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for _ in threads:
+            self.queue.put((PRIORITY_STOP, next(self.counter), None, (), {}, None))
+        if wait:
+            for t in threads:
+                t.join()
+        LOGGER.info('Scheduler stopped %d workers', len(threads))
+
+    def pending(self):
+        """Approximate number of queued items not yet picked up by a worker."""
+        return self.queue.qsize()
+
+    def work(self):
+        while True:
+            _, _, fn, args, kwargs, callback = self.queue.get()
+            if fn is None:
+                self.queue.task_done()
+                return
+            try:
+                result = fn(*args, **kwargs)
+                if callback is not None:
+                    callback(result)
+            # Some of the code run here still calls exit() on error; that
+            # must not take the worker down with it
+            except (Exception, SystemExit):
+                LOGGER.exception('Error running %s', fn)
+            finally:
+                self.queue.task_done()
+
+
+SCHEDULER = Scheduler()
@@ -21,15 +21,14 @@
 # @subpackage MCPServer
 # @author Joseph Perry <joseph@artefactual.com>
 
-import cPickle
-import gearman
 import logging
 import os
 import sys
-import time
+import threading
 import uuid
 
 import archivematicaMCP
+from scheduler import SCHEDULER
 from utils import log_exceptions
 
 from django.utils import timezone
@@ -37,9 +36,43 @@ from django.utils import timezone
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 from django_mysqlpool import auto_close_db
 from fileOperations import writeToFile
+import taskTransport
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
+_taskClient = None
+_taskClientLock = threading.Lock()
+
+def taskClient():
+    """
+    Returns the task client MCPClients are sent tasks with, creating it on first use.
+
+    Completed tasks are handed to the scheduler, so their results are
+    processed by its workers rather than by the transport's threads.
+    """
+    global _taskClient
+    with _taskClientLock:
+        if _taskClient is None:
+            config = archivematicaMCP.config
+            transport = 'gearman'
+            if config.has_option('Protocol', "taskTransport"):
+                transport = config.get('Protocol', "taskTransport")
+            if transport == 'local':
+                address = config.get('Protocol', "localTaskQueueAddress")
+                authkey = config.get('Protocol', "localTaskQueueAuthkey")
+            else:
+                address = config.get('MCPServer', "MCPArchivematicaServer")
+                authkey = None
+            connections = 1
+            if config.has_option('Protocol', "taskTransportConnections"):
+                connections = config.getint('Protocol', "taskTransportConnections")
+            _taskClient = taskTransport.createTaskClient(transport, address, authkey,
+                connections=connections,
+                maxPending=config.getint('Protocol', "limitGearmanConnections"),
+                dispatch=SCHEDULER.submit)
+            LOGGER.info('Using the %s task transport', transport)
+        return _taskClient
+
 # ~Class Task~
 #Tasks are what are assigned to clients.
 #They have a zero-many(tasks) TO one(job) relationship
@@ -47,7 +80,7 @@ LOGGER = logging.getLogger('archivematica.mcp.server')
 #They use a "replacement dictionary" to define variables for this task.
 #Variables used for the task are defined in the Job's configuration/module (The xml file)
 class taskStandard():
-    """A task to hand to gearman"""
+    """A task to hand to an MCPClient"""
 
     def __init__(self, linkTaskManager, execute, arguments, standardOutputFile, standardErrorFile, outputLock=None, UUID=None):
         if UUID == None:
@@ -63,54 +96,23 @@ class taskStandard():
     @log_exceptions
     @auto_close_db
     def performTask(self):
-        from archivematicaMCP import limitGearmanConnectionsSemaphore
-        limitGearmanConnectionsSemaphore.acquire()
-        gm_client = gearman.GearmanClient([archivematicaMCP.config.get('MCPServer', "MCPArchivematicaServer")])
         data = {"createdDate" : timezone.now().isoformat(' ')}
         data["arguments"] = self.arguments
         LOGGER.info('Executing %s %s', self.execute, data)
-        completed_job_request = None
-        failMaxSleep = 60
-        failSleepInitial = 1
-        failSleep = failSleepInitial
-        failSleepIncrementor = 2
-        while completed_job_request == None:
-            try:
-                completed_job_request = gm_client.submit_job(self.execute.lower(), cPickle.dumps(data), self.UUID)
-            except gearman.errors.ServerUnavailable:
-                completed_job_request = None
-                time.sleep(failSleep)
-                if failSleep == failSleepInitial:
-                    LOGGER.exception('Error submitting job. Retrying.')
-                if failSleep < failMaxSleep:
-                    failSleep += failSleepIncrementor
-        limitGearmanConnectionsSemaphore.release()
-        self.check_request_status(completed_job_request)
-        gm_client.shutdown()
-        LOGGER.debug('Finished performing task %s', self.UUID)
-
-    def check_request_status(self, job_request):
-        if job_request.complete:
-            self.results = cPickle.loads(job_request.result)
-            LOGGER.debug('Task %s finished! Result %s - %s', job_request.job.unique, job_request.state, self.results)
+        taskClient().submit(self.execute, data, self.UUID, self.check_request_status)
+        LOGGER.debug('Submitted task %s', self.UUID)
+
+    @log_exceptions
+    @auto_close_db
+    def check_request_status(self, task_result):
+        if task_result.error is None:
+            self.results = task_result.result
+            LOGGER.debug('Task %s finished! Result %s', task_result.unique, self.results)
             self.writeOutputs()
-            self.linkTaskManager.taskCompletedCallBackFunction(self)
-        elif job_request.timed_out:
-            LOGGER.error('Task %s timed out!', job_request.unique)
-            self.results['exitCode'] = -1
-            self.results["stdError"] = "Task %s timed out!" % job_request.unique
-            self.linkTaskManager.taskCompletedCallBackFunction(self)
-
-        elif job_request.state == gearman.client.JOB_UNKNOWN:
-            LOGGER.error('Task %s connection failed!', job_request.unique)
-            self.results["stdError"] = "Task %s connection failed!" % job_request.unique
-            self.results['exitCode'] = -1
-            self.linkTaskManager.taskCompletedCallBackFunction(self)
         else:
-            LOGGER.error('Task %s failed!', job_request.unique)
-            self.results["stdError"] = "Task %s failed!" % job_request.unique
-            self.results['exitCode'] = -1
-            self.linkTaskManager.taskCompletedCallBackFunction(self)
+            LOGGER.error('Task %s %s', task_result.unique, task_result.error)
+            self.results = {"exitCode": -1, "stdOut": "", "stdError": "Task %s %s" % (task_result.unique, task_result.error)}
+        self.linkTaskManager.taskCompletedCallBackFunction(self)
 
     def outputFileIsWritable(self, fileName):
         """
@@ -170,3 +172,58 @@ class taskStandard():
         if  self.results['exitCode']:
             return self.results['exitCode']
         return stdoutStatus + stderrStatus
+
+
+class taskBatch():
+    """A group of taskStandard instances handed to an MCPClient as a single job.
+
+    The MCPClient runs every task in the batch and returns the results keyed by
+    task UUID; they are split back out and reported to the owning
+    linkTaskManager one task at a time, exactly as if each task had been
+    submitted on its own.
+    """
+
+    def __init__(self, linkTaskManager, execute, tasks, UUID=None):
+        if UUID == None:
+            UUID = uuid.uuid4().__str__()
+        self.UUID = UUID
+        self.linkTaskManager = linkTaskManager
+        self.execute = execute.encode("utf-8")
+        self.tasks = tasks
+
+    @log_exceptions
+    @auto_close_db
+    def performTask(self):
+        data = {"createdDate": timezone.now().isoformat(' ')}
+        data["tasks"] = dict((task.UUID, {"arguments": task.arguments}) for task in self.tasks)
+        LOGGER.info('Executing %s as batch %s of %d tasks', self.execute, self.UUID, len(self.tasks))
+        taskClient().submit(self.execute, data, self.UUID, self.check_request_status)
+        LOGGER.debug('Submitted batch %s', self.UUID)
+
+    @log_exceptions
+    @auto_close_db
+    def check_request_status(self, task_result):
+        exitCode = -1
+        if task_result.error is None:
+            # Without "tasks" the MCPClient failed before running any of them,
+            # and returned a single task's result for the whole batch
+            results = task_result.result.get("tasks", {})
+            LOGGER.debug('Batch %s finished!', task_result.unique)
+            if "tasks" in task_result.result:
+                stdError = "No result returned for this task by batch %s" % self.UUID
+            else:
+                exitCode = task_result.result.get("exitCode", exitCode)
+                stdError = "Batch %s failed: %s" % (self.UUID, task_result.result.get("stdError", ""))
+                LOGGER.error(stdError)
+        else:
+            stdError = "Batch %s %s" % (task_result.unique, task_result.error)
+            LOGGER.error(stdError)
+            results = {}
+
+        for task in self.tasks:
+            if task.UUID in results:
+                task.results = results[task.UUID]
+                task.writeOutputs()
+            else:
+                task.results = {"exitCode": exitCode, "stdOut": "", "stdError": stdError}
+            self.linkTaskManager.taskCompletedCallBackFunction(task)
@@ -24,17 +24,23 @@
 import logging
 import os
 import sys
+import time
 
 import archivematicaFunctions
 
 import archivematicaMCP
 from unitFile import unitFile
 
+sys.path.append("/usr/lib/archivematica/archivematicaCommon")
+from dicts import ReplacementDict
 sys.path.append("/usr/share/archivematica/dashboard")
 from main.models import File, UnitVariable
 
 LOGGER = logging.getLogger('archivematica.mcp.server')
 
+# Seconds; the coarsest mtime granularity of the filesystems units live on
+DIRECTORY_MTIME_RESOLUTION = 2
+
 class unit:
     """A class to inherit from, to over-ride methods, defininging a processing object at the Job level"""
     def __init__(self, currentPath, UUID):
@@ -43,36 +49,99 @@ class unit:
 
     def reloadFileList(self):
         """Match files to their UUID's via their location and the File table's currentLocation"""
-        self.fileList = {}
         # currentPath must be a string to return all filenames as bytestrings,
         # and to safely concatenate with other bytestrings
         currentPath = os.path.join(self.currentPath.replace("%sharedPath%", archivematicaMCP.config.get('MCPServer', "sharedDirectory"), 1), "").encode('utf-8')
+        # The scan state is kept between reloads so that only directories
+        # modified since the last one are listed again; it is discarded if the
+        # unit has moved.
+        if getattr(self, '_scannedPath', None) != currentPath:
+            self._scannedPath = currentPath
+            self._directories = {}
+            self.fileList = {}
         try:
-            for directory, subDirectories, files in os.walk(currentPath):
-                directory = directory.replace(currentPath, self.pathString, 1)
-                for file_ in files:
-                    if self.pathString != directory:
-                        filePath = os.path.join(directory, file_)
-                    else:
-                        filePath = directory + file_
-                    self.fileList[filePath] = unitFile(filePath, owningUnit=self)
-
-            if self.unitType == "Transfer":
-                files = File.objects.filter(transfer_id=self.UUID)
-            else:
-                files = File.objects.filter(sip_id=self.UUID)
-            for f in files:
-                currentlocation = archivematicaFunctions.unicodeToStr(f.currentlocation)
-                if currentlocation in self.fileList:
-                    self.fileList[currentlocation].UUID = f.uuid
-                    self.fileList[currentlocation].fileGrpUse = f.filegrpuse
+            fileList = {}
+            directories = {}
+            self._scanDirectory(currentPath, "", time.time(), directories, fileList)
+            self._directories = directories
+            self.fileList = fileList
+
+            locations = {}
+            for uuid, currentlocation, filegrpuse in self._files().values_list('uuid', 'currentlocation', 'filegrpuse'):
+                currentlocation = archivematicaFunctions.unicodeToStr(currentlocation)
+                if currentlocation in fileList:
+                    locations[currentlocation] = (uuid, filegrpuse)
                 else:
                     LOGGER.warning('%s %s has file (%s) %s in the database, but file does not exist in the file system',
-                        self.unitType, self.UUID, f.uuid, f.currentlocation)
+                        self.unitType, self.UUID, uuid, currentlocation)
+            # unitFiles are kept across reloads, so ones whose row has gone are
+            # reset to what a new unitFile would have
+            for filePath, fileUnit in fileList.iteritems():
+                fileUnit.UUID, fileUnit.fileGrpUse = locations.get(filePath, ("None", 'None'))
         except Exception:
             LOGGER.exception('Error reloading file list for %s', currentPath)
             exit(1)
 
+    def _files(self):
+        """Returns a queryset of the Files of this unit in the database."""
+        if self.unitType == "Transfer":
+            return File.objects.filter(transfer_id=self.UUID)
+        return File.objects.filter(sip_id=self.UUID)
+
+    def getFileReplacementDics(self, fileUUIDs=None):
+        """
+        Returns an iterator of (file UUID, ReplacementDict) pairs for the files
+        of this unit in the database, or only those in fileUUIDs if given; the
+        same dicts as the getReplacementDic of their unitFiles, but fetched
+        with a single query.
+        """
+        files = self._files()
+        if fileUUIDs is not None:
+            files = files.filter(uuid__in=fileUUIDs)
+        return ReplacementDict.frommodels(files.iterator())
+
+    def _scanDirectory(self, root, relativePath, scanTime, directories, fileList):
+        """
+        Add the files below root/relativePath to fileList, as os.walk would find them.
+
+        Directories whose mtime is unchanged since the previous scan are not
+        listed again; their entries are taken from self._directories. One
+        modified within DIRECTORY_MTIME_RESOLUTION of being scanned is listed
+        again next time, as it may have changed again without its mtime doing so.
+        """
+        path = os.path.join(root, relativePath)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        entry = self._directories.get(relativePath)
+        if entry is None or entry[0] != mtime or mtime >= entry[1] - DIRECTORY_MTIME_RESOLUTION:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                return
+            fileNames = []
+            subDirectories = []
+            for name in names:
+                if os.path.isdir(os.path.join(path, name)):
+                    # Like os.walk, symlinked directories are not followed
+                    if not os.path.islink(os.path.join(path, name)):
+                        subDirectories.append(name)
+                else:
+                    fileNames.append(name)
+            entry = (mtime, scanTime, fileNames, subDirectories)
+        directories[relativePath] = entry
+        _, _, fileNames, subDirectories = entry
+
+        for name in fileNames:
+            filePath = self.pathString + os.path.join(relativePath, name)
+            fileUnit = self.fileList.get(filePath)
+            if fileUnit is None:
+                fileUnit = unitFile(filePath, owningUnit=self)
+            fileList[filePath] = fileUnit
+        for name in subDirectories:
+            self._scanDirectory(root, os.path.join(relativePath, name), scanTime, directories, fileList)
+
     def getMagicLink(self):
         return
 
@@ -21,8 +21,12 @@
 # @subpackage MCPServer
 # @author Joseph Perry <joseph@artefactual.com>
 # @thanks to http://timgolden.me.uk/python/win32_how_do_i/watch_directory_for_changes.html
+import ctypes
+import ctypes.util
+import errno
 import logging
 import os
+import struct
 import time
 import threading
 import sys
@@ -45,7 +49,8 @@ class archivematicaWatchDirectory:
                  alertOnDirectories=True, 
                  alertOnFiles=True, 
                  interval=1, 
-                 threaded=True):
+                 threaded=True,
+                 notifier=None):
         self.run = False
         self.variablesAdded = variablesAdded
         self.callBackFunctionAdded = callBackFunctionAdded 
@@ -59,20 +64,30 @@ class archivematicaWatchDirectory:
         if not os.path.isdir(directory):
             os.makedirs(directory, mode=770)
         
-        if threaded:
-            t = threading.Thread(target=self.start)
-            t.daemon = True
-            t.start()
+        if notifier is not None and notifier.supports(directory) and notifier.add(self):
+            LOGGER.info('Watching directory %s with inotify (Files: %s)', self.directory, self.alertOnFiles)
+        elif threaded:
+            self.startThread()
         else:
             self.start()
 
+    def startThread(self, before=None):
+        t = threading.Thread(target=self.start, args=(before,))
+        t.daemon = True
+        t.start()
+
     @log_exceptions
     @auto_close_db
-    def start(self):
-        """Based on polling example: http://timgolden.me.uk/python/win32_how_do_i/watch_directory_for_changes.html"""
+    def start(self, before=None):
+        """Based on polling example: http://timgolden.me.uk/python/win32_how_do_i/watch_directory_for_changes.html
+
+        before is the list of entries already reported, if any; by default it's the current contents of the directory.
+        """
         self.run = True
         LOGGER.info('Watching directory %s (Files: %s)', self.directory, self.alertOnFiles)
-        before = dict ([(f, None) for f in os.listdir (self.directory)])
+        if before is None:
+            before = os.listdir (self.directory)
+        before = dict ([(f, None) for f in before])
         while self.run:
             time.sleep (self.interval)
             after = dict ([(f, None) for f in os.listdir (self.directory)])
@@ -102,3 +117,150 @@ class archivematicaWatchDirectory:
     
     def stop(self):
         self.run = False
+
+
+# Network filesystems don't report changes made by other hosts (e.g.
+# MCPClients on other machines) through inotify, so those are always polled
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'ceph', 'glusterfs', 'fuse.glusterfs', 'fuse.sshfs', '9p', 'lustre', 'gpfs')
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def filesystemType(path):
+    """Return the type of the filesystem path is stored on, according to /proc/mounts."""
+    path = os.path.realpath(path)
+    fstype, mountPoint = None, ''
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                mount = fields[1].decode('string_escape')
+                if (path == mount or path.startswith(mount.rstrip('/') + '/')) and len(mount) >= len(mountPoint):
+                    fstype, mountPoint = fields[2], mount
+    except (IOError, IndexError):
+        pass
+    return fstype
+
+
+class inotifyNotifier:
+    """Watches any number of directories for added and removed entries on a single thread using inotify.
+
+    Each watched directory is an archivematicaWatchDirectory; the notifier
+    calls its event() method the same way its own polling loop would.
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.inotify_add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create():
+        """Return a started notifier, or None if inotify isn't available on this system."""
+        try:
+            notifier = inotifyNotifier()
+        except (OSError, AttributeError, TypeError):
+            LOGGER.warning('inotify is not available; polling watched directories', exc_info=True)
+            return None
+        t = threading.Thread(target=notifier.start)
+        t.daemon = True
+        t.start()
+        return notifier
+
+    def supports(self, directory):
+        fstype = filesystemType(unicodeToStr(directory))
+        if fstype in NETWORK_FILESYSTEMS:
+            LOGGER.info('%s is on a %s filesystem; polling it instead of using inotify', directory, fstype)
+            return False
+        return True
+
+    def add(self, watch):
+        """Start watching watch.directory. Returns False if it can't be watched with inotify."""
+        directory = unicodeToStr(watch.directory)
+        # The snapshot is taken before the watch exists, so that nothing
+        # created in between is taken as already reported; anything that
+        # changed before the watch caught it is reported by the rescan below.
+        before = set(os.listdir(directory))
+        with self.lock:
+            wd = self.inotify_add_watch(self.fd, directory, IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM)
+            if wd < 0:
+                LOGGER.warning('Unable to watch %s with inotify: %s', directory, os.strerror(ctypes.get_errno()))
+                return False
+            self.watches[wd] = watch
+            self.entries[wd] = before
+        after = set(os.listdir(directory))
+        self.changed(wd, added=after - before, removed=before - after)
+        return True
+
+    @log_exceptions
+    @auto_close_db
+    def start(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    LOGGER.warning('inotify event queue overflowed; rescanning watched directories')
+                    self.rescan()
+                elif mask & IN_IGNORED:
+                    self.lost(wd)
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self.changed(wd, added=[name])
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.changed(wd, removed=[name])
+
+    def lost(self, wd):
+        """The kernel dropped watch wd (e.g. its directory was moved or unmounted); poll the directory from now on."""
+        with self.lock:
+            watch = self.watches.pop(wd, None)
+            entries = self.entries.pop(wd, None)
+        if watch is None:
+            return
+        LOGGER.warning('inotify stopped watching %s; polling it instead', watch.directory)
+        watch.startThread(before=entries)
+
+    def rescan(self):
+        for wd, watch in self.watches.items():
+            after = set(os.listdir(unicodeToStr(watch.directory)))
+            before = self.entries.get(wd, set())
+            self.changed(wd, added=after - before, removed=before - after)
+
+    def changed(self, wd, added=(), removed=()):
+        with self.lock:
+            watch = self.watches.get(wd)
+            if watch is None:
+                return
+            entries = self.entries[wd]
+            added = [i for i in added if i not in entries]
+            removed = [i for i in removed if i in entries]
+            entries.update(added)
+            entries.difference_update(removed)
+        directory = unicodeToStr(watch.directory)
+        if added:
+            LOGGER.debug('Added %s', added)
+            for i in added:
+                watch.event(os.path.join(directory, i), watch.variablesAdded, watch.callBackFunctionAdded)
+        if removed:
+            LOGGER.debug('Removed %s', removed)
+            for i in removed:
+                watch.event(os.path.join(directory, i), watch.variablesRemoved, watch.callBackFunctionRemoved)
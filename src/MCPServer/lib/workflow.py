@@ -0,0 +1,154 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2013 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage MCPServer
+
+#~DOC~
+#
+# In-memory copy of the workflow definition: chains, chain links and their
+# task configs, exit codes, and the choices offered at each link.
+#
+# Every link a unit runs through used to look these rows up again; they only
+# change when the dashboard edits a config or a migration runs, so they are
+# loaded once with a few queries and shared by all worker threads. Loaded
+# workflows are never modified; invalidate() makes the next get() load a new
+# one, which is what the reloadWorkflow RPC call does.
+
+import collections
+import logging
+import sys
+import threading
+
+sys.path.append("/usr/share/archivematica/dashboard")
+from main.models import (MicroServiceChain, MicroServiceChainChoice,
+    MicroServiceChainLink, MicroServiceChainLinkExitCode,
+    MicroServiceChoiceReplacementDic, StandardTaskConfig)
+
+LOGGER = logging.getLogger('archivematica.mcp.server')
+
+Chain = collections.namedtuple('Chain', 'id startinglink_id description')
+Link = collections.namedtuple('Link', 'id currenttask_id tasktype_id tasktypepkreference description defaultnextchainlink_id reloadfilelist defaultexitmessage microservicegroup')
+ExitCode = collections.namedtuple('ExitCode', 'nextmicroservicechainlink_id exitmessage')
+ChainChoice = collections.namedtuple('ChainChoice', 'chainavailable_id description')
+ReplacementDicChoice = collections.namedtuple('ReplacementDicChoice', 'id description replacementdic')
+StandardTask = collections.namedtuple('StandardTask', 'id execute arguments filter_subdir filter_file_start filter_file_end requires_output_lock stdout_file stderr_file')
+
+
+class Workflow(object):
+    """Immutable snapshot of the workflow tables."""
+
+    def __init__(self):
+        self.chains = {}
+        for row in MicroServiceChain.objects.values_list('id', 'startinglink', 'description'):
+            chain = Chain(*row)
+            self.chains[chain.id] = chain
+
+        self.links = {}
+        for row in MicroServiceChainLink.objects.values_list('id', 'currenttask', 'currenttask__tasktype',
+                'currenttask__tasktypepkreference', 'currenttask__description', 'defaultnextchainlink',
+                'reloadfilelist', 'defaultexitmessage', 'microservicegroup'):
+            link = Link(*row)
+            self.links[link.id] = link
+
+        # A list per (link, exit code), as duplicates are ignored in favour of
+        # the link's defaults, the same as when they were queried with get()
+        self.exitCodes = collections.defaultdict(list)
+        for link_id, exitcode, next_link_id, message in MicroServiceChainLinkExitCode.objects.values_list(
+                'microservicechainlink', 'exitcode', 'nextmicroservicechainlink', 'exitmessage'):
+            self.exitCodes[(link_id, exitcode)].append(ExitCode(next_link_id, message))
+        self.exitCodes = dict(self.exitCodes)
+
+        self.chainChoices = collections.defaultdict(list)
+        for link_id, chain_id, description in MicroServiceChainChoice.objects.values_list(
+                'choiceavailableatlink', 'chainavailable', 'chainavailable__description'):
+            self.chainChoices[link_id].append(ChainChoice(chain_id, description))
+        self.chainChoices = dict(self.chainChoices)
+
+        self.replacementDicChoices = collections.defaultdict(list)
+        for link_id, dic_id, description, replacementdic in MicroServiceChoiceReplacementDic.objects.values_list(
+                'choiceavailableatlink', 'id', 'description', 'replacementdic'):
+            self.replacementDicChoices[link_id].append(ReplacementDicChoice(dic_id, description, replacementdic))
+        self.replacementDicChoices = dict(self.replacementDicChoices)
+
+        self.standardTasks = {}
+        for row in StandardTaskConfig.objects.values_list(*StandardTask._fields):
+            task = StandardTask(*row)
+            self.standardTasks[task.id] = task
+
+        LOGGER.info('Loaded workflow: %d chains, %d links, %d standard tasks',
+                    len(self.chains), len(self.links), len(self.standardTasks))
+
+    def chain(self, pk):
+        """Returns the Chain with this pk; raises KeyError if there isn't one."""
+        return self.chains[str(pk)]
+
+    def link(self, pk):
+        """Returns the Link with this pk, or None if there isn't one."""
+        return self.links.get(str(pk))
+
+    def exitCode(self, link_pk, exitCode):
+        """Returns the ExitCode configured for the link, or None if there is not exactly one."""
+        try:
+            exitCodes = self.exitCodes.get((str(link_pk), int(exitCode)), ())
+        except ValueError:
+            return None
+        if len(exitCodes) == 1:
+            return exitCodes[0]
+        return None
+
+    def chainChoicesAt(self, link_pk):
+        """Returns a list of the ChainChoices offered at the link."""
+        return list(self.chainChoices.get(str(link_pk), ()))
+
+    def replacementDicChoicesAt(self, link_pk):
+        """Returns a list of the ReplacementDicChoices offered at the link."""
+        return list(self.replacementDicChoices.get(str(link_pk), ()))
+
+    def standardTask(self, pk):
+        """Returns the StandardTask with this pk; raises KeyError if there isn't one."""
+        return self.standardTasks[str(pk)]
+
+
+_workflow = None
+_lock = threading.Lock()
+
+
+def get():
+    """Returns the current Workflow, loading it if needed."""
+    workflow = _workflow
+    if workflow is None:
+        with _lock:
+            workflow = _workflow
+            if workflow is None:
+                workflow = _load()
+    return workflow
+
+
+def _load():
+    global _workflow
+    _workflow = Workflow()
+    return _workflow
+
+
+def invalidate():
+    """Discards the current Workflow; the next get() loads the tables again."""
+    global _workflow
+    LOGGER.info('Workflow invalidated')
+    _workflow = None
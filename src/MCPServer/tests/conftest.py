@@ -0,0 +1,17 @@
+import ConfigParser
+import os
+import sys
+import types
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(THIS_DIR, '../lib')))
+
+# archivematicaMCP sets up Django and reads the installed serverConfig.conf
+# when it is imported, so the modules under test get this stand-in for it.
+config = ConfigParser.SafeConfigParser()
+config.read(os.path.join(THIS_DIR, '../etc/serverConfig.conf'))
+archivematicaMCP = types.ModuleType('archivematicaMCP')
+archivematicaMCP.config = config
+archivematicaMCP.limitTaskThreads = config.getint('Protocol', 'limitTaskThreads')
+archivematicaMCP.taskBatchSize = config.getint('Protocol', 'taskBatchSize')
+sys.modules.setdefault('archivematicaMCP', archivematicaMCP)
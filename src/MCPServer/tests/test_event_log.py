@@ -0,0 +1,54 @@
+from eventLog import EventLog, JOB_COMPLETED, JOB_CREATED
+
+
+def _log(events, size=1000):
+    log = EventLog(size=size)
+    for i in range(events):
+        log.publish(JOB_CREATED, jobUUID='job-%d' % i)
+    return log
+
+
+def test_since_returns_the_following_events():
+    log = _log(5)
+    response = log.since(2, log.id)
+    assert response['complete'] is True
+    assert response['log'] == log.id
+    assert response['sequence'] == 5
+    assert [event['sequence'] for event in response['events']] == [3, 4, 5]
+    assert response['events'][0]['jobUUID'] == 'job-2'
+    assert response['events'][0]['type'] == JOB_CREATED
+
+    assert log.since(5, log.id) == {'log': log.id, 'sequence': 5, 'events': [], 'complete': True}
+    log.publish(JOB_COMPLETED, jobUUID='job-4')
+    assert [event['type'] for event in log.since(5, log.id)['events']] == [JOB_COMPLETED]
+
+
+def test_since_an_empty_log():
+    log = EventLog()
+    assert log.since(0, log.id) == {'log': log.id, 'sequence': 0, 'events': [], 'complete': True}
+
+
+def test_since_without_a_position():
+    log = _log(3)
+    assert log.since() == {'log': log.id, 'sequence': 3, 'events': [], 'complete': False}
+    assert log.since(None, log.id)['complete'] is False
+    assert log.since(1, None)['complete'] is False
+
+
+def test_since_another_log():
+    # MCPServer restarted: its new log starts over at 1
+    previous, log = _log(10), _log(3)
+    response = log.since(1, previous.id)
+    assert response['complete'] is False
+    assert response['events'] == []
+    assert response['sequence'] == 3
+
+
+def test_since_dropped_events():
+    log = _log(10, size=4)
+    # Events 1 to 6 were dropped; 6 is the last one the subscriber may have seen
+    assert [event['sequence'] for event in log.since(6, log.id)['events']] == [7, 8, 9, 10]
+    response = log.since(5, log.id)
+    assert response['complete'] is False
+    assert response['events'] == []
+    assert response['sequence'] == 10
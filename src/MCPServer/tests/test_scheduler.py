@@ -0,0 +1,85 @@
+import sys
+import threading
+
+from scheduler import PRIORITY_TASK, PRIORITY_UNIT, Scheduler
+
+
+def _run(scheduler, workers=1):
+    """Run everything queued on scheduler, then stop its workers."""
+    scheduler.start(workers)
+    scheduler.queue.join()
+    scheduler.stop()
+
+
+def test_tasks_run_before_units():
+    scheduler, ran = Scheduler(), []
+    scheduler.submit(ran.append, args=('unit 1',), priority=PRIORITY_UNIT)
+    scheduler.submit(ran.append, args=('task 1',))
+    scheduler.submit(ran.append, args=('unit 2',), priority=PRIORITY_UNIT)
+    scheduler.submit(ran.append, args=('task 2',), priority=PRIORITY_TASK)
+    _run(scheduler)
+    assert ran == ['task 1', 'task 2', 'unit 1', 'unit 2']
+
+
+def test_same_priority_runs_in_submission_order():
+    scheduler, ran = Scheduler(), []
+    for i in range(20):
+        scheduler.submit(ran.append, args=(i,), priority=PRIORITY_UNIT)
+    _run(scheduler)
+    assert ran == range(20)
+
+
+def test_callback_gets_the_result():
+    scheduler, results = Scheduler(), []
+    scheduler.submit(lambda a, b=0: a + b, args=(1,), kwargs={'b': 2}, callback=results.append)
+    _run(scheduler)
+    assert results == [3]
+
+
+def test_worker_survives_errors_and_exit():
+    scheduler, ran = Scheduler(), []
+
+    def fail():
+        raise ValueError('failed')
+    scheduler.submit(sys.exit, args=(1,), callback=ran.append)
+    scheduler.submit(fail, callback=ran.append)
+    scheduler.submit(ran.append, args=('after',))
+    scheduler.start(1)
+    worker, = scheduler.threads
+    scheduler.queue.join()
+
+    assert ran == ['after']
+    assert worker.is_alive()
+    scheduler.stop()
+    assert not worker.is_alive()
+
+
+def test_stop_lets_running_work_finish_and_leaves_queued_work():
+    scheduler, ran = Scheduler(), []
+    started, release = threading.Event(), threading.Event()
+
+    def running():
+        started.set()
+        release.wait()
+        ran.append('running')
+    scheduler.submit(running)
+    scheduler.start(1)
+    worker, = scheduler.threads
+    assert started.wait(5)
+    scheduler.submit(ran.append, args=('queued',))
+
+    scheduler.stop(wait=False)
+    assert scheduler.threads == []
+    release.set()
+    worker.join(5)
+    assert not worker.is_alive()
+    assert ran == ['running']
+    assert scheduler.pending() == 1
+
+
+def test_stop_waits_for_every_worker():
+    scheduler = Scheduler()
+    scheduler.start(3)
+    workers = list(scheduler.threads)
+    scheduler.stop()
+    assert not any(worker.is_alive() for worker in workers)
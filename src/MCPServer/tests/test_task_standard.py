@@ -0,0 +1,59 @@
+from taskStandard import taskBatch, taskStandard
+from taskTransport import TaskResult
+
+
+class LinkTaskManager(object):
+    def __init__(self):
+        self.completed = []
+
+    def taskCompletedCallBackFunction(self, task):
+        self.completed.append(task)
+
+
+def _batch(tmpdir, count=3):
+    manager = LinkTaskManager()
+    tasks = [
+        taskStandard(manager, 'execute', 'file-%d' % i,
+                     str(tmpdir.join('stdout-%d' % i)), str(tmpdir.join('stderr-%d' % i)))
+        for i in range(count)]
+    return manager, taskBatch(manager, 'execute', tasks)
+
+
+def test_batch_results_are_split_back_to_their_tasks(tmpdir):
+    manager, batch = _batch(tmpdir)
+    first, second, third = batch.tasks
+    batch.check_request_status(TaskResult(batch.UUID, {'tasks': {
+        first.UUID: {'exitCode': 0, 'stdOut': 'out 0', 'stdError': ''},
+        second.UUID: {'exitCode': 1, 'stdOut': '', 'stdError': 'error 1'},
+    }}, None))
+
+    assert manager.completed == batch.tasks
+    assert first.results == {'exitCode': 0, 'stdOut': 'out 0', 'stdError': ''}
+    assert tmpdir.join('stdout-0').read() == 'out 0'
+    assert second.results['exitCode'] == 1
+    assert tmpdir.join('stderr-1').read() == 'error 1'
+    # The MCPClient returned nothing for it
+    assert third.results['exitCode'] == -1
+    assert batch.UUID in third.results['stdError']
+    assert not tmpdir.join('stdout-2').check()
+
+
+def test_batch_that_failed_before_running_its_tasks(tmpdir):
+    manager, batch = _batch(tmpdir)
+    batch.check_request_status(TaskResult(batch.UUID, {
+        'exitCode': -1, 'stdOut': '', 'stdError': 'Traceback: unable to run the batch'}, None))
+
+    assert manager.completed == batch.tasks
+    for task in batch.tasks:
+        assert task.results['exitCode'] == -1
+        assert 'unable to run the batch' in task.results['stdError']
+
+
+def test_batch_that_was_not_run(tmpdir):
+    manager, batch = _batch(tmpdir)
+    batch.check_request_status(TaskResult(batch.UUID, None, 'failed!'))
+
+    assert manager.completed == batch.tasks
+    for task in batch.tasks:
+        assert task.results['exitCode'] == -1
+        assert 'failed!' in task.results['stdError']
@@ -0,0 +1,159 @@
+import os
+
+import pytest
+
+import unit
+from unit import DIRECTORY_MTIME_RESOLUTION
+
+# Every directory is last modified at this time unless a test says otherwise
+MTIME = 1000000000
+
+
+class Unit(unit.unit):
+    pathString = "%SIPDirectory%"
+    unitType = "SIP"
+
+    def __init__(self, currentPath):
+        unit.unit.__init__(self, currentPath, 'unit-uuid')
+        self._directories = {}
+        self.fileList = {}
+
+    def scan(self, scanTime):
+        """Scan the unit the way reloadFileList does; returns the paths found."""
+        directories, fileList = {}, {}
+        self._scanDirectory(os.path.join(self.currentPath, ''), '', scanTime, directories, fileList)
+        self._directories, self.fileList = directories, fileList
+        return sorted(fileList)
+
+
+def _touch(*directories, **kwargs):
+    mtime = kwargs.get('mtime', MTIME)
+    for directory in directories:
+        os.utime(str(directory), (mtime, mtime))
+
+
+@pytest.fixture
+def listed(monkeypatch):
+    """The directories os.listdir was called on."""
+    listed = []
+    listdir = os.listdir
+
+    def recording_listdir(path):
+        listed.append(path.rstrip('/'))
+        return listdir(path)
+    monkeypatch.setattr(os, 'listdir', recording_listdir)
+    return listed
+
+
+@pytest.fixture
+def sip(tmpdir):
+    tmpdir.join('objects', 'a.txt').write('', ensure=True)
+    tmpdir.join('objects', 'sub', 'b.txt').write('', ensure=True)
+    tmpdir.join('logs').ensure(dir=True)
+    tmpdir.join('METS.xml').write('')
+    _touch(tmpdir.join('objects', 'sub'), tmpdir.join('objects'), tmpdir.join('logs'), tmpdir)
+    return tmpdir
+
+
+def test_scan_finds_every_file(sip):
+    sip.join('objects', 'linked').mksymlinkto(sip.join('objects', 'sub'))
+    assert Unit(str(sip)).scan(MTIME + 100) == [
+        '%SIPDirectory%METS.xml',
+        '%SIPDirectory%objects/a.txt',
+        '%SIPDirectory%objects/sub/b.txt',
+    ]
+
+
+def test_rescan_lists_only_modified_directories(sip, listed):
+    u = Unit(str(sip))
+    u.scan(MTIME + 100)
+    fileUnit = u.fileList['%SIPDirectory%objects/a.txt']
+    del listed[:]
+
+    assert u.scan(MTIME + 200) == [
+        '%SIPDirectory%METS.xml',
+        '%SIPDirectory%objects/a.txt',
+        '%SIPDirectory%objects/sub/b.txt',
+    ]
+    assert listed == []
+    # The unitFiles are kept
+    assert u.fileList['%SIPDirectory%objects/a.txt'] is fileUnit
+
+
+def test_rescan_finds_added_and_removed_files(sip, listed):
+    u = Unit(str(sip))
+    u.scan(MTIME + 100)
+    del listed[:]
+
+    sip.join('objects', 'sub', 'c.txt').write('')
+    _touch(sip.join('objects', 'sub'), mtime=MTIME + 150)
+    sip.join('METS.xml').remove()
+    sip.join('logs', 'fileFormatIdentification.log').write('')
+    _touch(sip, sip.join('logs'), mtime=MTIME + 160)
+
+    assert u.scan(MTIME + 200) == [
+        '%SIPDirectory%logs/fileFormatIdentification.log',
+        '%SIPDirectory%objects/a.txt',
+        '%SIPDirectory%objects/sub/b.txt',
+        '%SIPDirectory%objects/sub/c.txt',
+    ]
+    assert sorted(listed) == sorted([str(sip), str(sip.join('logs')), str(sip.join('objects', 'sub'))])
+
+
+def test_rescan_finds_removed_directories(sip):
+    u = Unit(str(sip))
+    u.scan(MTIME + 100)
+
+    sip.join('objects', 'sub').remove()
+    _touch(sip.join('objects'), mtime=MTIME + 150)
+    assert u.scan(MTIME + 200) == [
+        '%SIPDirectory%METS.xml',
+        '%SIPDirectory%objects/a.txt',
+    ]
+    assert 'objects/sub' not in u._directories
+
+
+def test_rescan_finds_directories_moved_into_place(sip):
+    u = Unit(str(sip))
+    u.scan(MTIME + 100)
+
+    # A directory moved in keeps its own mtime, older than the last scan
+    sip.join('replacement', 'd.txt').write('', ensure=True)
+    _touch(sip.join('replacement'), mtime=MTIME - 100)
+    sip.join('objects', 'sub').remove()
+    sip.join('replacement').move(sip.join('objects', 'sub'))
+    _touch(sip, sip.join('objects'), mtime=MTIME + 150)
+    assert u.scan(MTIME + 200) == [
+        '%SIPDirectory%METS.xml',
+        '%SIPDirectory%objects/a.txt',
+        '%SIPDirectory%objects/sub/d.txt',
+    ]
+
+
+def test_directory_modified_within_the_resolution_is_listed_again(sip, listed):
+    u = Unit(str(sip))
+    # objects was modified as it was scanned, so its mtime may not change
+    # when it is modified again
+    _touch(sip.join('objects'), mtime=MTIME + 99)
+    u.scan(MTIME + 99 + DIRECTORY_MTIME_RESOLUTION)
+    del listed[:]
+
+    sip.join('objects', 'late.txt').write('')
+    _touch(sip.join('objects'), mtime=MTIME + 99)
+    assert '%SIPDirectory%objects/late.txt' in u.scan(MTIME + 200)
+    assert listed == [str(sip.join('objects'))]
+
+    # By then its mtime was old enough to be trusted
+    del listed[:]
+    u.scan(MTIME + 300)
+    assert listed == []
+
+
+def test_directory_modified_before_the_resolution_is_not_listed_again(sip, listed):
+    u = Unit(str(sip))
+    _touch(sip.join('objects'), mtime=MTIME + 99)
+    u.scan(MTIME + 100 + DIRECTORY_MTIME_RESOLUTION)
+    del listed[:]
+
+    u.scan(MTIME + 200)
+    assert listed == []
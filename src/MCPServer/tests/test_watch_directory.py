@@ -0,0 +1,86 @@
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+
+import pytest
+
+import watchDirectory
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Callback(object):
+    def __init__(self):
+        self.paths = []
+        self.lock = threading.Lock()
+
+    def __call__(self, path, variables):
+        with self.lock:
+            self.paths.append(path)
+
+
+@pytest.fixture
+def notifier():
+    notifier = watchDirectory.inotifyNotifier.create()
+    if notifier is None:
+        pytest.skip('inotify is not available')
+    return notifier
+
+
+def test_entries_created_while_the_watch_is_added_are_reported(tmpdir, notifier):
+    directory = str(tmpdir)
+    tmpdir.join('existing').write('')
+    add_watch = notifier.inotify_add_watch
+
+    def inotify_add_watch(fd, path, mask):
+        # One entry before the watch exists, one once it does
+        tmpdir.join('before-watch').write('')
+        wd = add_watch(fd, path, mask)
+        tmpdir.join('after-watch').write('')
+        return wd
+    notifier.inotify_add_watch = inotify_add_watch
+
+    added = Callback()
+    watchDirectory.archivematicaWatchDirectory(directory, callBackFunctionAdded=added, notifier=notifier)
+    expected = [os.path.join(directory, name) for name in ('after-watch', 'before-watch')]
+    assert _wait_for(lambda: sorted(added.paths) == expected)
+    # The inotify event for after-watch isn't reported a second time
+    tmpdir.join('later').write('')
+    assert _wait_for(lambda: len(added.paths) == 3)
+    assert sorted(added.paths) == sorted(expected + [os.path.join(directory, 'later')])
+
+
+def test_lost_watch_falls_back_to_polling(tmpdir, notifier):
+    directory = str(tmpdir)
+    added = Callback()
+    watch = watchDirectory.archivematicaWatchDirectory(
+        directory, callBackFunctionAdded=added, interval=0.01, notifier=notifier)
+    tmpdir.join('seen').write('')
+    assert _wait_for(lambda: added.paths == [os.path.join(directory, 'seen')])
+    assert not watch.run
+
+    # Removing the watch makes the kernel send IN_IGNORED, as it does when
+    # the directory goes away or is unmounted
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    wd, = notifier.watches.keys()
+    assert libc.inotify_rm_watch(notifier.fd, wd) == 0
+    try:
+        assert _wait_for(lambda: watch.run)
+        assert notifier.watches == {}
+        tmpdir.join('polled').write('')
+        assert _wait_for(lambda: len(added.paths) == 2)
+        # What inotify already reported isn't reported again
+        assert added.paths == [os.path.join(directory, 'seen'), os.path.join(directory, 'polled')]
+    finally:
+        watch.stop()
+        # Let the polling thread see it before the interpreter exits
+        time.sleep(watch.interval * 10)
@@ -0,0 +1,58 @@
+from django.test import TestCase
+
+from main import models
+
+import workflow
+
+TASK_TYPE = '9c84b047-9a6d-463f-9836-eafa49743b84'
+TASK_CONFIG = '1c2550f1-3fc0-45d8-8bc4-4c06d720283b'
+STANDARD_TASK = '0f0c1f33-29f2-49ae-b413-3e043da5df61'
+LINK = 'f09847c2-ee51-429a-9478-a860477f6b8d'
+NEXT_LINK = '3e25bda6-5314-4bb4-aa1e-90900dce887d'
+CHAIN = 'cae1b8bc-d9d0-4e2b-b2e0-0c0f1b1d1c4e'
+DIC = 'c691548f-0131-4bd5-864c-364b1f7feb7f'
+
+
+class TestWorkflow(TestCase):
+
+    def setUp(self):
+        workflow.invalidate()
+        models.TaskType.objects.create(id=TASK_TYPE, description='one instance')
+        models.StandardTaskConfig.objects.create(id=STANDARD_TASK, execute='echo_v0.0', arguments='"%SIPUUID%"')
+        models.TaskConfig.objects.create(id=TASK_CONFIG, tasktype_id=TASK_TYPE, tasktypepkreference=STANDARD_TASK, description='Echo')
+        for link in (NEXT_LINK, LINK):
+            models.MicroServiceChainLink.objects.create(id=link, currenttask_id=TASK_CONFIG, microservicegroup='Test')
+        models.MicroServiceChainLinkExitCode.objects.create(microservicechainlink_id=LINK, exitcode=0, nextmicroservicechainlink_id=NEXT_LINK)
+        # Duplicate exit codes are ignored
+        for _ in range(2):
+            models.MicroServiceChainLinkExitCode.objects.create(microservicechainlink_id=LINK, exitcode=1)
+        models.MicroServiceChain.objects.create(id=CHAIN, startinglink_id=LINK, description='Test chain')
+        models.MicroServiceChoiceReplacementDic.objects.create(
+            id=DIC, choiceavailableatlink_id=LINK, description='Yes', replacementdic='{"%Choice%": "yes"}')
+
+    def tearDown(self):
+        workflow.invalidate()
+
+    def test_lookups(self):
+        wf = workflow.get()
+        assert wf.chain(CHAIN).startinglink_id == LINK
+        assert wf.link(LINK).currenttask_id == TASK_CONFIG
+        assert wf.link(LINK).tasktypepkreference == STANDARD_TASK
+        assert wf.link('no-such-link') is None
+        assert wf.standardTask(STANDARD_TASK).execute == 'echo_v0.0'
+        assert wf.exitCode(LINK, '0').nextmicroservicechainlink_id == NEXT_LINK
+        assert wf.exitCode(LINK, 1) is None
+        assert wf.exitCode(LINK, 'failed') is None
+        assert wf.replacementDicChoicesAt(LINK) == [workflow.ReplacementDicChoice(DIC, 'Yes', '{"%Choice%": "yes"}')]
+        assert wf.chainChoicesAt(LINK) == []
+
+    def test_loaded_once_until_invalidated(self):
+        wf = workflow.get()
+        models.MicroServiceChain.objects.filter(id=CHAIN).update(description='Renamed')
+        with self.assertNumQueries(0):
+            assert workflow.get() is wf
+        assert workflow.get().chain(CHAIN).description == 'Test chain'
+
+        workflow.invalidate()
+        assert workflow.get() is not wf
+        assert workflow.get().chain(CHAIN).description == 'Renamed'
@@ -31,12 +31,15 @@ import uuid
 from archivematicaFunctions import strToUnicode
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from django.db.models import Q
+from django.db.models import Case, Q, Value, When
 from django.utils import timezone
-from main.models import Agent, Derivation, Event, File, FileID, FPCommandOutput, Job, SIP, Task, Transfer, UnitVariable
+from main.models import Agent, Derivation, Event, File, FileID, FPCommandOutput, Job, SIP, Task, Transfer, UnitStatus, UnitVariable
 
 LOGGER = logging.getLogger('archivematica.common')
 
+# Maximum number of rows written by each INSERT of the bulk functions below
+BULK_BATCH_SIZE = 1000
+
 def getUTCDate():
     """Returns a timezone-aware representation of the current datetime in UTC."""
     return timezone.now()
@@ -64,6 +67,18 @@ def insertIntoFiles(fileUUID, filePath, enteredSystem=None, transferUUID="", sip
 
     :returns: None
     """
+    _build_file(fileUUID, filePath, enteredSystem, transferUUID, sipUUID, use).save(force_insert=True)
+
+def bulkInsertIntoFiles(files):
+    """
+    Creates new entries in the Files table using a single bulk insert.
+
+    :param files: An iterable of dicts, each holding the keyword arguments for one call of insertIntoFiles.
+    """
+    File.objects.bulk_create([_build_file(**f) for f in files], batch_size=BULK_BATCH_SIZE)
+
+def _build_file(fileUUID, filePath, enteredSystem=None, transferUUID="", sipUUID="", use="original"):
+    """Returns an unsaved File instance; see insertIntoFiles for the arguments."""
     if enteredSystem is None:
         enteredSystem = getUTCDate()
 
@@ -84,7 +99,7 @@ def insertIntoFiles(fileUUID, filePath, enteredSystem=None, transferUUID="", sip
         print("transferUUID:", transferUUID, file=sys.stderr)
         raise Exception("not supported yet - both SIP and transfer UUID's defined (or neither defined)", sipUUID + "-" + transferUUID)
 
-    File.objects.create(**kwargs)
+    return File(**kwargs)
 
 def getAMAgentsForFile(fileUUID):
     """
@@ -97,33 +112,72 @@ def getAMAgentsForFile(fileUUID):
 
     :returns: A list of Agent IDs
     """
-    agents = []
-
     try:
         f = File.objects.get(uuid=fileUUID)
     except File.DoesNotExist:
         LOGGER.warning('File with UUID %s does not exist in database; unable to fetch Agents', fileUUID)
         return []
 
+    return getAMAgentsForUnit(sipUUID=f.sip_id, transferUUID=f.transfer_id)
+
+def getAMAgentsForUnit(sipUUID=None, transferUUID=None, amAgents=None):
+    """
+    Fetches the IDs for the Archivematica agents associated with the files of a SIP and/or transfer.
+
+    The current user's agent is taken from the "activeAgent" UnitVariable of the SIP, or failing that of the transfer, as in getAMAgentsForFile.
+
+    :param list amAgents: The IDs of the agents representing Archivematica, if already known.
+    :returns: A list of Agent IDs
+    """
+    agents = []
+
     # Fetch Agent for the User
-    if f.sip:
+    if sipUUID:
         try:
-            var = UnitVariable.objects.get(unittype='SIP', unituuid=f.sip_id,
+            var = UnitVariable.objects.get(unittype='SIP', unituuid=sipUUID,
                                            variable='activeAgent')
             agents.append(int(var.variablevalue))
         except UnitVariable.DoesNotExist:
             pass
-    if f.transfer and not agents: # agent hasn't been found yet
+    if transferUUID and not agents: # agent hasn't been found yet
         try:
             var = UnitVariable.objects.get(unittype='Transfer',
-                                           unituuid=f.transfer_id,
+                                           unituuid=transferUUID,
                                            variable='activeAgent')
             agents.append(int(var.variablevalue))
         except UnitVariable.DoesNotExist:
             pass
     # Fetch other Archivematica Agents
-    am_agents = Agent.objects.filter(Q(identifiertype='repository code') | Q(identifiertype='preservation system')).values_list('pk', flat=True)
-    agents.extend(am_agents)
+    if amAgents is None:
+        amAgents = _getArchivematicaAgents()
+    agents.extend(amAgents)
+    return agents
+
+def _getArchivematicaAgents():
+    return list(Agent.objects.filter(Q(identifiertype='repository code') | Q(identifiertype='preservation system')).values_list('pk', flat=True))
+
+def getAMAgentsForFiles(fileUUIDs):
+    """
+    Fetches the IDs for the Archivematica agents associated with each of the given files, as getAMAgentsForFile does.
+    The agents are looked up once for each SIP or transfer the files belong to.
+
+    :returns: A dict of file UUID to list of Agent IDs. Files which do not exist in the database are left out.
+    """
+    fileUUIDs = list(set(fileUUIDs))
+    units = {}
+    for i in range(0, len(fileUUIDs), BULK_BATCH_SIZE):
+        files = File.objects.filter(uuid__in=fileUUIDs[i:i + BULK_BATCH_SIZE]).values_list('uuid', 'sip_id', 'transfer_id')
+        units.update((fileUUID, (sipUUID, transferUUID)) for fileUUID, sipUUID, transferUUID in files)
+
+    amAgents = _getArchivematicaAgents()
+    unitAgents = {}
+    agents = {}
+    for fileUUID, unit in units.items():
+        if unit not in unitAgents:
+            unitAgents[unit] = getAMAgentsForUnit(*unit, amAgents=amAgents)
+        agents[fileUUID] = unitAgents[unit]
+    for fileUUID in set(fileUUIDs) - set(units):
+        LOGGER.warning('File with UUID %s does not exist in database; unable to fetch Agents', fileUUID)
     return agents
 
 def insertIntoEvents(fileUUID, eventIdentifierUUID="", eventType="", eventDateTime=None, eventDetail="", eventOutcome="", eventOutcomeDetailNote="", agents=None):
@@ -139,16 +193,74 @@ def insertIntoEvents(fileUUID, eventIdentifierUUID="", eventType="", eventDateTi
     :param str eventOutcomeDetailNote: Can be blank. Will be used in the eventOutcomeDetailNote element in the AIP METS.
     :param list agents: List of Agent IDs to associate with this. If None provided, automatically fetches Agents representing Archivematica.
     """
-    if eventDateTime is None:
-        eventDateTime = getUTCDate()
-
     # Assume the Agent is Archivematica & the current user
     if not agents:
         agents = getAMAgentsForFile(fileUUID)
+
+    event = _build_event(fileUUID, eventIdentifierUUID, eventType, eventDateTime, eventDetail, eventOutcome, eventOutcomeDetailNote)
+    event.save(force_insert=True)
+    # Splat agents list into multiple arguments
+    event.agents.add(*agents)
+
+def bulkUpdate(model, field, values, **updates):
+    """
+    Sets `field` of several rows of `model` to a value of their own, using one UPDATE for each BULK_BATCH_SIZE rows.
+
+    :param model: The model class of the rows.
+    :param field: The name of the field to set.
+    :param values: A dict of {primary key: new value of the field}.
+    :param updates: Other fields to set to the same value on all of the rows.
+    """
+    outputField = model._meta.get_field(field)
+    pks = list(values)
+    for i in range(0, len(pks), BULK_BATCH_SIZE):
+        batch = pks[i:i + BULK_BATCH_SIZE]
+        updates[field] = Case(*[When(pk=pk, then=Value(values[pk])) for pk in batch], output_field=outputField)
+        model.objects.filter(pk__in=batch).update(**updates)
+
+def bulkInsertIntoEvents(events):
+    """
+    Creates new entries in the Events table, and their links to agents, using one bulk insert for each.
+
+    :param events: An iterable of dicts, each holding the keyword arguments for one call of insertIntoEvents.
+        Events without agents are linked to the Archivematica agents of their file's unit, which are looked up once per unit.
+    """
+    events = [dict(e) for e in events]
+    for e in events:
+        if not e.get('eventIdentifierUUID'):
+            e['eventIdentifierUUID'] = str(uuid.uuid4())
+
+    fileAgents = getAMAgentsForFiles(e['fileUUID'] for e in events if not e.get('agents'))
+    for e in events:
+        if not e.get('agents'):
+            e['agents'] = fileAgents.get(e['fileUUID'], [])
+
+    Event.objects.bulk_create([
+        _build_event(**dict((k, v) for k, v in e.items() if k != 'agents'))
+        for e in events
+    ], batch_size=BULK_BATCH_SIZE)
+
+    # bulk_create does not set the primary keys of the new events, which the
+    # agent links need
+    eventIDs = [e['eventIdentifierUUID'] for e in events]
+    pks = {}
+    for i in range(0, len(eventIDs), BULK_BATCH_SIZE):
+        pks.update(Event.objects.filter(event_id__in=eventIDs[i:i + BULK_BATCH_SIZE]).values_list('event_id', 'pk'))
+    EventAgent = Event.agents.through
+    EventAgent.objects.bulk_create([
+        EventAgent(event_id=pks[e['eventIdentifierUUID']], agent_id=agent)
+        for e in events
+        for agent in set(e['agents'])
+    ], batch_size=BULK_BATCH_SIZE)
+
+def _build_event(fileUUID, eventIdentifierUUID="", eventType="", eventDateTime=None, eventDetail="", eventOutcome="", eventOutcomeDetailNote=""):
+    """Returns an unsaved Event instance; see insertIntoEvents for the arguments."""
+    if eventDateTime is None:
+        eventDateTime = getUTCDate()
     if not eventIdentifierUUID:
         eventIdentifierUUID = str(uuid.uuid4())
 
-    event = Event.objects.create(
+    return Event(
         event_id=eventIdentifierUUID,
         file_uuid_id=fileUUID,
         event_type=eventType,
@@ -157,8 +269,6 @@ def insertIntoEvents(fileUUID, eventIdentifierUUID="", eventType="", eventDateTi
         event_outcome=eventOutcome,
         event_outcome_detail=eventOutcomeDetailNote
     )
-    # Splat agents list into multiple arguments
-    event.agents.add(*agents)
 
 def insertIntoDerivations(sourceFileUUID, derivedFileUUID, relatedEventUUID=None):
     """
@@ -168,14 +278,26 @@ def insertIntoDerivations(sourceFileUUID, derivedFileUUID, relatedEventUUID=None
     :param str derivedFileUUID: The UUID of the derived file.
     :param str relatedEventUUID: The UUID for an event describing the creation of the derived file. Can be blank.
     """
+    _build_derivation(sourceFileUUID, derivedFileUUID, relatedEventUUID).save(force_insert=True)
+
+def bulkInsertIntoDerivations(derivations):
+    """
+    Creates new entries in the Derivations table using a single bulk insert.
+
+    :param derivations: An iterable of dicts, each holding the keyword arguments for one call of insertIntoDerivations.
+    """
+    Derivation.objects.bulk_create([_build_derivation(**d) for d in derivations], batch_size=BULK_BATCH_SIZE)
+
+def _build_derivation(sourceFileUUID, derivedFileUUID, relatedEventUUID=None):
+    """Returns an unsaved Derivation instance; see insertIntoDerivations for the arguments."""
     if not sourceFileUUID:
         raise ValueError("sourceFileUUID must be specified")
     if not derivedFileUUID:
         raise ValueError("derivedFileUUID must be specified")
 
-    Derivation.objects.create(source_file_id=sourceFileUUID,
-                              derived_file_id=derivedFileUUID,
-                              event_id=relatedEventUUID)
+    return Derivation(source_file_id=sourceFileUUID,
+                      derived_file_id=derivedFileUUID,
+                      event_id=relatedEventUUID)
 
 def insertIntoFPCommandOutput(fileUUID="", fitsXMLString="", ruleUUID=""):
     """
@@ -203,20 +325,35 @@ def logTaskCreatedSQL(taskManager, commandReplacementDic, taskUUID, arguments):
     :param str taskUUID: The UUID to be used for this Task in the database.
     :param str arguments: The arguments to be passed to the command when it is executed, as a string. Can contain replacement variables; see ReplacementDict for supported values.
     """
-    jobUUID = taskManager.jobChainLink.UUID
+    _build_task(taskManager, commandReplacementDic, taskUUID, arguments, getUTCDate()).save(force_insert=True)
+
+def logTasksCreatedSQL(taskManager, tasks):
+    """
+    Creates new entries in the Tasks table for several tasks of the same job using a single bulk insert.
+
+    :param MCPServer.linkTaskManager taskManager: A linkTaskManager subclass instance.
+    :param tasks: An iterable of (commandReplacementDic, taskUUID, arguments) tuples. See logTaskCreatedSQL for the meaning of each value.
+    """
+    createdTime = getUTCDate()
+    Task.objects.bulk_create([
+        _build_task(taskManager, commandReplacementDic, taskUUID, arguments, createdTime)
+        for commandReplacementDic, taskUUID, arguments in tasks
+    ])
+
+def _build_task(taskManager, commandReplacementDic, taskUUID, arguments, createdTime):
+    """Returns an unsaved Task instance for the given task manager and replacement dict."""
     fileUUID = ""
     if "%fileUUID%" in commandReplacementDic:
         fileUUID = commandReplacementDic["%fileUUID%"]
-    taskexec = taskManager.execute
     fileName = os.path.basename(os.path.abspath(commandReplacementDic["%relativeLocation%"]))
 
-    Task.objects.create(taskuuid=taskUUID,
-                        job_id=jobUUID,
-                        fileuuid=fileUUID,
-                        filename=fileName,
-                        execution=taskexec,
-                        arguments=arguments,
-                        createdtime=getUTCDate())
+    return Task(taskuuid=taskUUID,
+                job_id=taskManager.jobChainLink.UUID,
+                fileuuid=fileUUID,
+                filename=fileName,
+                execution=taskManager.execute,
+                arguments=arguments,
+                createdtime=createdTime)
 
 def logTaskCompletedSQL(task):
     """
@@ -267,9 +404,101 @@ def logJobCreatedSQL(job):
                        createdtimedec=decDate,
                        microservicechainlink_id=str(job.pk),
                        subjobof=str(job.subJobOf))
+    updateUnitStatus(job, "Executing command(s)", newJob=True)
 
     # TODO -un hardcode executing exeCommand
 
+# Job types after which a transfer is complete
+SIP_CREATED_JOB_TYPE = 'Create SIP from transfer objects'
+BACKLOG_JOB_TYPE = 'Move transfer to backlog'
+# Job type after which a SIP is complete (done storing the AIP)
+AIP_STORED_JOB_TYPE = 'Remove the processing directory'
+
+def _setUnitStatus(unitStatus, jobType, microserviceGroup, currentStep):
+    """
+    Sets the status of a UnitStatus from the unit's current job, and the
+    SIP UUID of a transfer whose SIP has been created.
+    """
+    if unitStatus.sip_uuid == '':
+        unitStatus.sip_uuid = File.objects.filter(transfer_id=unitStatus.unit_uuid, sip__isnull=False) \
+            .values_list('sip', flat=True).first() or ''
+
+    unitStatus.microservice = jobType
+    if currentStep == 'Awaiting decision':
+        unitStatus.status = UnitStatus.USER_INPUT
+    elif 'failed' in microserviceGroup.lower():
+        unitStatus.status = UnitStatus.FAILED
+    elif 'reject' in microserviceGroup.lower():
+        unitStatus.status = UnitStatus.REJECTED
+    elif jobType == AIP_STORED_JOB_TYPE or unitStatus.sip_uuid is not None:
+        unitStatus.status = UnitStatus.COMPLETE
+    else:
+        unitStatus.status = UnitStatus.PROCESSING
+
+def updateUnitStatus(job, currentStep, newJob=False):
+    """
+    Updates the UnitStatus of a job's unit after the job's current step
+    changed to currentStep, or, if newJob is True, after the job was created.
+
+    The status is only changed by the unit's latest job.
+
+    :param jobChainLink job: A jobChainLink instance.
+    :param str currentStep: The new current step of the job.
+    :param bool newJob: Whether the job was just created.
+    """
+    unitUUID = job.unit.UUID
+    if job.unit.owningUnit is not None:
+        unitUUID = job.unit.owningUnit.UUID
+    unitType = job.unit.__class__.__name__
+    try:
+        unitStatus = UnitStatus.objects.get(unit_uuid=unitUUID, unit_type=unitType)
+    except UnitStatus.DoesNotExist:
+        unitStatus = UnitStatus(unit_uuid=unitUUID, unit_type=unitType)
+    if newJob:
+        unitStatus.job_uuid = job.UUID
+        # Whether a transfer is complete depends on all of its jobs
+        if job.description == SIP_CREATED_JOB_TYPE and unitStatus.sip_uuid in (None, 'BACKLOG'):
+            unitStatus.sip_uuid = ''
+        elif job.description == BACKLOG_JOB_TYPE and unitStatus.sip_uuid is None:
+            unitStatus.sip_uuid = 'BACKLOG'
+    elif unitStatus.job_uuid != str(job.UUID):
+        return
+    _setUnitStatus(unitStatus, job.description, str(job.microserviceGroup), currentStep)
+    unitStatus.updated = getUTCDate()
+    unitStatus.save()
+
+def refreshUnitStatus(unitUUID, unitType):
+    """
+    Works out the status of a unit from all of its jobs, and saves it as its
+    UnitStatus. Used for units whose status MCPServer has not kept up to date.
+
+    :param str unitUUID: UUID of the SIP or Transfer.
+    :param str unitType: unitSIP or unitTransfer.
+    :return: The UnitStatus, or None if the unit has no jobs.
+    """
+    job = Job.objects.filter(sipuuid=unitUUID, unittype=unitType).order_by('-createdtime', '-createdtimedec').first()
+    if job is None:
+        UnitStatus.objects.filter(unit_uuid=unitUUID, unit_type=unitType).delete()
+        return None
+    try:
+        unitStatus = UnitStatus.objects.get(unit_uuid=unitUUID, unit_type=unitType)
+    except UnitStatus.DoesNotExist:
+        unitStatus = UnitStatus(unit_uuid=unitUUID, unit_type=unitType)
+    unitStatus.job_uuid = job.jobuuid
+    completedJobTypes = set(Job.objects.filter(sipuuid=unitUUID, jobtype__in=(SIP_CREATED_JOB_TYPE, BACKLOG_JOB_TYPE))
+                            .values_list('jobtype', flat=True).distinct())
+    if SIP_CREATED_JOB_TYPE in completedJobTypes:
+        if not unitStatus.sip_uuid or unitStatus.sip_uuid == 'BACKLOG':
+            unitStatus.sip_uuid = ''
+    elif BACKLOG_JOB_TYPE in completedJobTypes:
+        unitStatus.sip_uuid = 'BACKLOG'
+    else:
+        unitStatus.sip_uuid = None
+    _setUnitStatus(unitStatus, job.jobtype, job.microservicegroup, job.currentstep)
+    unitStatus.updated = getUTCDate()
+    unitStatus.save()
+    return unitStatus
+
 def fileWasRemoved(fileUUID, utcDate=None, eventDetail = "", eventOutcomeDetailNote = "", eventOutcome=""):
     """
     Logs the removal of a file from the database.
@@ -300,6 +529,28 @@ def fileWasRemoved(fileUUID, utcDate=None, eventDetail = "", eventOutcomeDetailN
     f.currentlocation = None
     f.save()
 
+def filesWereRemoved(fileUUIDs, utcDate=None, eventDetail="", eventOutcomeDetailNote="", eventOutcome=""):
+    """
+    Logs the removal of several files from the database, as fileWasRemoved does, using bulk queries.
+
+    :param fileUUIDs: An iterable of file UUIDs. See fileWasRemoved for the other arguments.
+    """
+    if utcDate is None:
+        utcDate = getUTCDate()
+    fileUUIDs = list(fileUUIDs)
+
+    bulkInsertIntoEvents({
+        'fileUUID': fileUUID,
+        'eventType': "file removed",
+        'eventDateTime': utcDate,
+        'eventDetail': eventDetail,
+        'eventOutcome': eventOutcome,
+        'eventOutcomeDetailNote': eventOutcomeDetailNote,
+    } for fileUUID in fileUUIDs)
+
+    for i in range(0, len(fileUUIDs), BULK_BATCH_SIZE):
+        File.objects.filter(uuid__in=fileUUIDs[i:i + BULK_BATCH_SIZE]).update(removedtime=utcDate, currentlocation=None)
+
 def createSIP(path, UUID=None, sip_type='SIP'):
     """
     Create a new SIP object for a SIP at the given path.
@@ -167,6 +167,32 @@ class ReplacementDict(dict):
 
         return rd
 
+    @staticmethod
+    def frommodels(files, type_='file', expand_path=True):
+        """
+        Generates a (file UUID, ReplacementDict) pair for each of many File
+        instances, as frommodel(type_=type_, file_=file_) would create for
+        each of them.
+
+        Each SIP and Transfer the files belong to is only fetched from the
+        database once, so this takes a constant number of queries however
+        many files there are, instead of two per file.
+        """
+        sips = {}
+        transfers = {}
+        for file_ in files:
+            if file_.sip_id is not None:
+                if file_.sip_id in sips:
+                    file_.sip = sips[file_.sip_id]
+                else:
+                    sips[file_.sip_id] = file_.sip
+            if file_.transfer_id is not None:
+                if file_.transfer_id in transfers:
+                    file_.transfer = transfers[file_.transfer_id]
+                else:
+                    transfers[file_.transfer_id] = file_.transfer
+            yield file_.uuid, ReplacementDict.frommodel(type_=type_, file_=file_, expand_path=expand_path)
+
     def replace(self, *strings):
         """
         Iterates over a set of strings. Any keys in self found within
@@ -219,6 +245,49 @@ class ReplacementDict(dict):
         return args
 
 
+class ReplacementTemplate(object):
+    """
+    A set of strings containing replacement variables, parsed once so they
+    can be filled in many times, e.g. once for each file of a unit.
+
+    >>> template = ReplacementTemplate('%fileUUID%: %SIPName%', None)
+    >>> template.replace({'%fileUUID%': 'abc', '%SIPName%': 'foo'})
+    ['abc: foo', None]
+    """
+    VARIABLE = re.compile(r'(%\w+%)')
+
+    def __init__(self, *strings):
+        # Each string is split into a list alternating between literal text
+        # and variable names
+        self.templates = []
+        self.keys = set()
+        for string in strings:
+            if string is None:
+                self.templates.append(None)
+                continue
+            parts = self.VARIABLE.split(unicodeToStr(string))
+            self.keys.update(parts[1::2])
+            self.templates.append(parts)
+
+    def replace(self, values):
+        """
+        Fills in the strings with the values of the variables in the dict
+        `values`, in a single pass over each string. Variables that aren't in
+        `values` are left as they are. As with ReplacementDict.replace, the
+        strings are returned as a list of bytestrings.
+        """
+        ret = []
+        for parts in self.templates:
+            if parts is not None:
+                parts = list(parts)
+                for i in xrange(1, len(parts), 2):
+                    if parts[i] in values:
+                        parts[i] = unicodeToStr(values[parts[i]])
+                parts = ''.join(parts)
+            ret.append(parts)
+        return ret
+
+
 class ChoicesDict(ReplacementDict):
     @staticmethod
     def fromstring(s):
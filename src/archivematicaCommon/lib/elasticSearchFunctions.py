@@ -26,6 +26,7 @@ from __future__ import absolute_import
 from __future__ import division
 import ConfigParser
 import datetime
+import itertools
 import json
 import logging
 import os
@@ -40,17 +41,20 @@ from main.models import File, Transfer
 
 # archivematicaCommon
 from archivematicaFunctions import get_dashboard_uuid
+from externals import xmltodict
 import namespaces as ns
 import version
 
-from externals import xmltodict
-
 from elasticsearch import Elasticsearch, ImproperlyConfigured
 
 
 logger = logging.getLogger('archivematica.common')
 
 MAX_QUERY_SIZE = 50000  # TODO Check that this is a reasonable number
+# Hits fetched per request, and how long ES keeps the search context between
+# requests, when iterating over all the results of a search
+SCROLL_SIZE = 1000
+SCROLL_TIMEOUT = '2m'
 MATCH_ALL_QUERY = {
     "query": {
         "match_all": {}
@@ -104,10 +108,24 @@ class TooManyResultsError(ElasticsearchError):
     pass
 
 
+class BulkIndexError(ElasticsearchError):
+    """ Raised by bulk_index once all documents have been tried.
+
+    `errors` is a list of (document, error) tuples for the documents that
+    could not be indexed. """
+    def __init__(self, message, errors):
+        super(BulkIndexError, self).__init__(message)
+        self.errors = errors
+
+
 _es_hosts = None
 _es_client = None
 DEFAULT_TIMEOUT = 10
 
+# Limits on the size of a single bulk request
+BULK_CHUNK_SIZE = 500
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
 
 def setup(hosts, timeout=DEFAULT_TIMEOUT):
     """
@@ -190,8 +208,6 @@ def remove_tool_output_from_mets(doc):
     for parent in toolNodes:
         parent.clear()
 
-    print("Removed FITS output from METS.")
-
 
 def wait_for_cluster_yellow_status(client, wait_between_tries=10, max_tries=10):
     health = {}
@@ -223,13 +239,13 @@ def create_indexes_if_needed(client):
         raise ElasticsearchError('The AIP index mapping is incorrect. The "aips" index should be re-created.')
 
 
-def search_all_results(client, body, index=None, doc_type=None, **query_params):
+def iter_search_results(client, body, index=None, doc_type=None, size=SCROLL_SIZE, **query_params):
     """
-    Performs client.search with the size set to MAX_QUERY_SIZE.
+    Generator over all the hits of a search, fetched `size` at a time using
+    the scroll API, so that memory use doesn't grow with the number of hits.
 
-    By default search_raw returns only 10 results.  Since we usually want all
-    results, this is a wrapper that fetches MAX_QUERY_SIZE results and logs a
-    warning if more results were available.
+    By default client.search returns only 10 results; use this whenever all
+    of them are needed.
     """
     if isinstance(index, list):
         index = ','.join(index)
@@ -241,12 +257,27 @@ def search_all_results(client, body, index=None, doc_type=None, **query_params):
         body=body,
         index=index,
         doc_type=doc_type,
-        size=MAX_QUERY_SIZE,
+        size=size,
+        scroll=SCROLL_TIMEOUT,
         **query_params)
-
-    if results['hits']['total'] > MAX_QUERY_SIZE:
-        logger.warning('Number of items in backlog (%s) exceeds maximum amount fetched (%s)', results['hits']['total'], MAX_QUERY_SIZE)
-    return results
+    scroll_id = results.get('_scroll_id')
+    try:
+        while True:
+            hits = results['hits']['hits']
+            for hit in hits:
+                yield hit
+            # A short page is the last one, no need to ask for another
+            if len(hits) < size or scroll_id is None:
+                break
+            results = client.scroll(scroll_id=scroll_id, scroll=SCROLL_TIMEOUT)
+            scroll_id = results.get('_scroll_id')
+    finally:
+        # Also run when the caller stops iterating early
+        if scroll_id is not None:
+            try:
+                client.clear_scroll(scroll_id=scroll_id)
+            except Exception:
+                logger.warning('Unable to clear scroll %s', scroll_id, exc_info=True)
 
 
 def get_type_mapping(client, index, type):
@@ -409,6 +440,7 @@ def index_aip(client, uuid, name, filePath, pathToMETS, size=None, aips_in_aic=N
 
     # TODO add a conditional to toggle this
     remove_tool_output_from_mets(tree)
+    print("Removed FITS output from METS.")
 
     root = tree.getroot()
     # Extract AIC identifier, other specially-indexed information
@@ -422,8 +454,7 @@ def index_aip(client, uuid, name, filePath, pathToMETS, size=None, aips_in_aic=N
         is_part_of = dublincore.findtext('dcterms:isPartOf', namespaces=ns.NSMAP)
 
     # convert METS XML to dict
-    xml = ElementTree.tostring(root)
-    mets_data = rename_dict_keys_with_child_dicts(normalize_dict_values(xmltodict.parse(xml)))
+    mets_data = rename_dict_keys_with_child_dicts(normalize_dict_values(_element_to_dict(root)))
 
     aipData = {
         'uuid': uuid,
@@ -460,6 +491,104 @@ def try_to_index(client, data, index, doc_type, wait_between_tries=10, max_tries
     raise
 
 
+def _chunk_documents(client, documents, index, doc_type, chunk_size, max_chunk_bytes):
+    """
+    Serialize documents into the action/source line pairs of the bulk API,
+    grouped in lists of at most chunk_size documents or max_chunk_bytes bytes.
+    """
+    serializer = client.transport.serializer
+    action = serializer.dumps({'index': {'_index': index, '_type': doc_type}})
+    chunk = []
+    size = 0
+    for document in documents:
+        lines = action + '\n' + serializer.dumps(document) + '\n'
+        if chunk and (len(chunk) == chunk_size or size + len(lines) > max_chunk_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append((document, lines))
+        size += len(lines)
+    if chunk:
+        yield chunk
+
+
+def _send_bulk_chunk(client, chunk):
+    """
+    Send one bulk request, returning (retry, failed): the items of chunk that
+    failed with an error worth retrying (the cluster was busy or unavailable)
+    and (document, error) tuples for the items that failed permanently.
+    """
+    try:
+        response = client.bulk(body=''.join(lines for _, lines in chunk))
+    except Exception as e:
+        print('ERROR: error trying to bulk index.')
+        print(e)
+        return chunk, []
+
+    if not response.get('errors'):
+        return [], []
+    retry = []
+    failed = []
+    for item, result in zip(chunk, response['items']):
+        result = result.values()[0]
+        status = result.get('status', 200)
+        if 'error' not in result and status < 300:
+            continue
+        if status == 429 or status >= 500:
+            retry.append(item)
+        else:
+            failed.append((item[0], result.get('error', status)))
+    return retry, failed
+
+
+def bulk_index(client, documents, index, doc_type, chunk_size=BULK_CHUNK_SIZE,
+               max_chunk_bytes=BULK_MAX_CHUNK_BYTES, wait_between_tries=10, max_tries=10):
+    """
+    Index documents, which may be any iterable of dicts, using the bulk API.
+
+    Documents are sent in chunks of at most `chunk_size` documents or
+    `max_chunk_bytes` bytes, and the cluster health is checked once per chunk.
+    Only the items of a chunk that failed transiently are sent again, up to
+    `max_tries` times.
+
+    :returns: the number of documents indexed.
+    :raises BulkIndexError: after all documents have been tried, if any of
+        them could not be indexed. Each failure is also printed to stderr.
+    """
+    if max_tries < 1:
+        raise ValueError("max_tries must be 1 or greater")
+
+    indexed = 0
+    errors = []
+    for chunk in _chunk_documents(client, documents, index, doc_type, chunk_size, max_chunk_bytes):
+        wait_for_cluster_yellow_status(client)
+        pending = chunk
+        for attempt in xrange(max_tries):
+            if attempt:
+                print('Retrying {} documents.'.format(len(pending)))
+                time.sleep(wait_between_tries)
+            retry, failed = _send_bulk_chunk(client, pending)
+            errors.extend(failed)
+            indexed += len(pending) - len(retry) - len(failed)
+            pending = retry
+            if not pending:
+                break
+        errors.extend((document, 'not indexed after {} tries'.format(max_tries)) for document, _ in pending)
+
+    for document, error in errors:
+        print('Failed to index {}: {}'.format(_describe_document(document), error), file=sys.stderr)
+    if errors:
+        raise BulkIndexError('{} of {} documents could not be indexed'.format(len(errors), indexed + len(errors)), errors)
+    return indexed
+
+
+def _describe_document(document):
+    for key in ('FILEUUID', 'fileuuid', 'uuid'):
+        if document.get(key):
+            return '{} {}'.format(key, document[key])
+    return document.get('filePath') or document.get('relative_path') or 'document'
+
+
 def get_aip_data(client, uuid, fields=None):
     search_params = {
         'body': {
@@ -490,58 +619,73 @@ def index_files(client, index, type_, uuid, pathToArchive, identifiers=[], sipNa
     # Use METS file if indexing an AIP
     metsFilePath = os.path.join(pathToArchive, 'METS.{}.xml'.format(uuid))
 
-    # Index AIP
-    if os.path.isfile(metsFilePath):
-        files_indexed = index_mets_file_metadata(
-            client,
-            uuid,
-            metsFilePath,
-            index,
-            type_,
-            sipName,
-            identifiers=identifiers
-        )
-
-    # Index transfer
-    else:
-        files_indexed = index_transfer_files(
-            client,
-            uuid,
-            pathToArchive,
-            index,
-            type_,
-            status=status
-        )
-
-        index_transfer(client, uuid, files_indexed, status=status)
+    try:
+        # Index AIP
+        if os.path.isfile(metsFilePath):
+            files_indexed = index_mets_file_metadata(
+                client,
+                uuid,
+                metsFilePath,
+                index,
+                type_,
+                sipName,
+                identifiers=identifiers
+            )
+
+        # Index transfer
+        else:
+            files_indexed = index_transfer_files(
+                client,
+                uuid,
+                pathToArchive,
+                index,
+                type_,
+                status=status
+            )
+
+            index_transfer(client, uuid, files_indexed, status=status)
+    except BulkIndexError as e:
+        logger.error('Error indexing %s: %s', uuid, e)
+        print(str(e), file=sys.stderr)
+        return 1
 
     print(type_ + ' UUID: ' + uuid)
     print('Files indexed: ' + str(files_indexed))
     return 0
 
 
-def _extract_transfer_metadata(doc):
-    return [xmltodict.parse(ElementTree.tostring(el))['transfer_metadata']
-            for el in doc.findall("mets:amdSec/mets:sourceMD/mets:mdWrap/mets:xmlData/transfer_metadata", namespaces=ns.NSMAP)]
+def _extract_transfer_metadata(doc, path="mets:amdSec/mets:sourceMD/mets:mdWrap/mets:xmlData/transfer_metadata"):
+    return [_element_to_dict(el)['transfer_metadata']
+            for el in doc.findall(path, namespaces=ns.NSMAP)]
 
 
 def index_mets_file_metadata(client, uuid, metsFilePath, index, type_, sipName, identifiers=[]):
-    # parse XML
-    tree = ElementTree.parse(metsFilePath)
-    root = tree.getroot()
-
-    # TODO add a conditional to toggle this
-    remove_tool_output_from_mets(tree)
-
-    # get SIP-wide dmdSec
-    dmdSec = root.findall("mets:dmdSec/mets:mdWrap/mets:xmlData", namespaces=ns.NSMAP)
+    # The METS file is read twice, one top-level section at a time, so that
+    # large METS files never have to be held in memory. The first pass
+    # collects the SIP-wide metadata and the files to index; the second
+    # indexes each file as its amdSec is read.
     dmdSecData = {}
-    for item in dmdSec:
-        xml = ElementTree.tostring(item)
-        dmdSecData = xmltodict.parse(xml)
+    dublincore = None
+    transfer_metadata = []
+    files = []
+    for section in _iterparse_mets_sections(metsFilePath):
+        if section.tag == ns.metsBNS + 'dmdSec':
+            # get SIP-wide dmdSec
+            for item in section.findall("mets:mdWrap/mets:xmlData", namespaces=ns.NSMAP):
+                dmdSecData = _element_to_dict(item)
+            if dublincore is None:
+                dublincore = section.find('mets:mdWrap/mets:xmlData/dcterms:dublincore', namespaces=ns.NSMAP)
+        elif section.tag == ns.metsBNS + 'amdSec':
+            transfer_metadata.extend(_extract_transfer_metadata(section, path="mets:sourceMD/mets:mdWrap/mets:xmlData/transfer_metadata"))
+        elif section.tag == ns.metsBNS + 'fileSec':
+            # Index all files in a fileGrup with USE='original' or USE='metadata'
+            for use in ('original', 'metadata'):
+                for file_ in section.findall("mets:fileGrp[@USE='{}']/mets:file".format(use), namespaces=ns.NSMAP):
+                    # Get file path from FLocat
+                    filePath = file_.find('mets:FLocat', namespaces=ns.NSMAP).attrib['{http://www.w3.org/1999/xlink}href']
+                    files.append((file_.attrib.get('ADMID', None), file_.attrib['ID'], filePath))
 
     # Extract isPartOf (for AIPs) or identifier (for AICs) from DublinCore
-    dublincore = root.find('mets:dmdSec/mets:mdWrap/mets:xmlData/dcterms:dublincore', namespaces=ns.NSMAP)
     aic_identifier = None
     is_part_of = None
     if dublincore is not None:
@@ -568,60 +712,92 @@ def index_mets_file_metadata(client, uuid, metsFilePath, index, type_, sipName,
         },
         'origin': get_dashboard_uuid(),
         'identifiers': identifiers,
-        'transferMetadata': _extract_transfer_metadata(root),
+        'transferMetadata': transfer_metadata,
     }
 
-    # Index all files in a fileGrup with USE='original' or USE='metadata'
-    original_files = root.findall("mets:fileSec/mets:fileGrp[@USE='original']/mets:file", namespaces=ns.NSMAP)
-    metadata_files = root.findall("mets:fileSec/mets:fileGrp[@USE='metadata']/mets:file", namespaces=ns.NSMAP)
-    files = original_files + metadata_files
+    bulk_index(client, _mets_file_documents(metsFilePath, files, fileData), index, type_)
 
-    # Index AIC METS file if it exists
-    for file_ in files:
-        indexData = fileData.copy() # Deep copy of dict, not of dict contents
+    print("Removed FITS output from METS.")
+    print('Indexed AIP files and corresponding METS XML.')
 
-        # Get file UUID.  If and ADMID exists, look in the amdSec for the UUID,
-        # otherwise parse it out of the file ID.
-        # 'Original' files have ADMIDs, 'Metadata' files don't
-        admID = file_.attrib.get('ADMID', None)
-        if admID is None:
+    return len(files)
+
+
+def _mets_file_documents(metsFilePath, files, fileData):
+    """
+    Yields the document to index for each of `files`, a list of (ADMID, ID,
+    path) tuples, reading the amdSecs from the METS file as they are needed.
+    """
+    filesByAdmID = {}
+    for file_ in files:
+        filesByAdmID.setdefault(file_[0], []).append(file_)
+    # 'Original' files have ADMIDs, 'Metadata' files don't
+    remaining = filesByAdmID.pop(None, [])
+
+    for section in _iterparse_mets_sections(metsFilePath):
+        if section.tag != ns.metsBNS + 'amdSec' or section.get('ID') not in filesByAdmID:
+            continue
+        # The helper looks for the amdSecs of a METS document
+        mets = ElementTree.Element(ns.metsBNS + 'mets')
+        mets.append(section)
+        remove_tool_output_from_mets(ElementTree.ElementTree(mets))
+        # Look in the amdSec for the UUID, and index the amdSec information
+        fileUUID = section.findtext("mets:techMD/mets:mdWrap/mets:xmlData/premis:object/premis:objectIdentifier/premis:objectIdentifierValue", namespaces=ns.NSMAP)
+        amdSec = rename_dict_keys_with_child_dicts(normalize_dict_values(_element_to_dict(section)))
+        for _, _, filePath in filesByAdmID.pop(section.get('ID')):
+            yield _mets_file_document(fileData, fileUUID, amdSec, filePath)
+
+    for admID, fileID, filePath in remaining + [f for missing in filesByAdmID.values() for f in missing]:
+        fileUUID = None
+        if admID is not None:
+            print('No amdSec {} found for file {}'.format(admID, fileID), file=sys.stderr)
+        else:
             # Parse UUID from file ID
-            fileUUID = None
             uuix_regex = r'\w{8}-?\w{4}-?\w{4}-?\w{4}-?\w{12}'
-            uuids = re.findall(uuix_regex, file_.attrib['ID'])
+            uuids = re.findall(uuix_regex, fileID)
             # Multiple UUIDs may be returned - if they are all identical, use that
             # UUID, otherwise use None.
             # To determine all UUIDs are identical, use the size of the set
             if len(set(uuids)) == 1:
                 fileUUID = uuids[0]
-        else:
-            amdSecInfo = root.find("mets:amdSec[@ID='{}']".format(admID), namespaces=ns.NSMAP)
-            fileUUID = amdSecInfo.findtext("mets:techMD/mets:mdWrap/mets:xmlData/premis:object/premis:objectIdentifier/premis:objectIdentifierValue", namespaces=ns.NSMAP)
+        yield _mets_file_document(fileData, fileUUID, {}, filePath)
 
-            # Index amdSec information
-            xml = ElementTree.tostring(amdSecInfo)
-            indexData['METS']['amdSec'] = rename_dict_keys_with_child_dicts(normalize_dict_values(xmltodict.parse(xml)))
 
-        indexData['FILEUUID'] = fileUUID
+def _mets_file_document(fileData, fileUUID, amdSec, filePath):
+    # Shallow copies; only the amdSec differs between files
+    indexData = fileData.copy()
+    indexData['METS'] = fileData['METS'].copy()
+    indexData['METS']['amdSec'] = amdSec
+    indexData['FILEUUID'] = fileUUID
+    indexData['filePath'] = filePath
+    _, fileExtension = os.path.splitext(filePath)
+    if fileExtension:
+        indexData['fileExtension'] = fileExtension[1:].lower()
+    return indexData
 
-        # Get file path from FLocat and extension
-        filePath = file_.find('mets:FLocat', namespaces=ns.NSMAP).attrib['{http://www.w3.org/1999/xlink}href']
-        indexData['filePath'] = filePath
-        _, fileExtension = os.path.splitext(filePath)
-        if fileExtension:
-            indexData['fileExtension'] = fileExtension[1:].lower()
 
-        # index data
-        wait_for_cluster_yellow_status(client)
-        result = try_to_index(client, indexData, index, type_)
-
-        # Reset fileData['METS']['amdSec'], since it is updated in the loop
-        # above. See http://stackoverflow.com/a/3975388 for explanation
-        fileData['METS']['amdSec'] = {}
+def _iterparse_mets_sections(metsFilePath):
+    """
+    Yields each child of the root element of the METS file once it has been
+    parsed, discarding it when the next one is requested.
+    """
+    root = None
+    depth = 0
+    for event, element in ElementTree.iterparse(metsFilePath, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = element
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1:
+                yield element
+                root.clear()
 
-    print('Indexed AIP files and corresponding METS XML.')
 
-    return len(files)
+def _element_to_dict(element):
+    """ Converts an element, and its children, to a dict with xmltodict. """
+    return xmltodict.parse(ElementTree.tostring(element))
 
 
 # To avoid Elasticsearch schema collisions, if a dict value is itself a
@@ -746,7 +922,16 @@ def index_transfer_files(client, uuid, pathToTransfer, index, type_, status=''):
         trailing / but not including objects/
     index, type: index and type in ElasticSearch
     """
-    files_indexed = 0
+    files_indexed = bulk_index(client, _transfer_file_documents(uuid, pathToTransfer, status), index, type_)
+
+    if files_indexed > 0:
+        client.indices.refresh()
+
+    return files_indexed
+
+
+def _transfer_file_documents(uuid, pathToTransfer, status):
+    """ Yields the document to index for each file in the transfer. """
     ingest_date = str(datetime.datetime.today())[0:10]
 
     # Some files should not be indexed
@@ -766,7 +951,7 @@ def index_transfer_files(client, uuid, pathToTransfer, index, type_, status=''):
     # Get dashboard UUID
     dashboard_uuid = get_dashboard_uuid()
 
-    for filepath in list_files_in_dir(pathToTransfer):
+    for filepath in list_files_in_dir(pathToTransfer, []):
         if os.path.isfile(filepath):
             # Get file UUID
             file_uuid = ''
@@ -811,18 +996,10 @@ def index_transfer_files(client, uuid, pathToTransfer, index, type_, status=''):
                   'format'       : formats,
                 }
 
-                wait_for_cluster_yellow_status(client)
-                try_to_index(client, indexData, index, type_)
-
-                files_indexed = files_indexed + 1
+                yield indexData
             else:
                 print('Skipping indexing {}'.format(relative_path))
 
-    if files_indexed > 0:
-        client.indices.refresh()
-
-    return files_indexed
-
 
 def list_files_in_dir(path, filepaths=[]):
     # define entries
@@ -839,8 +1016,7 @@ def list_files_in_dir(path, filepaths=[]):
 
 
 def _document_ids_from_field_query(client, index, doc_types, field, value):
-    document_ids = []
-
+    """ Generator over the IDs of the documents where field = value. """
     # Escape /'s with \\
     searchvalue = value.replace('/', '\\/')
     query = {
@@ -850,16 +1026,13 @@ def _document_ids_from_field_query(client, index, doc_types, field, value):
             }
         }
     }
-    documents = search_all_results(
+    documents = iter_search_results(
         client,
         body=query,
         doc_type=doc_types
     )
-
-    if len(documents['hits']['hits']) > 0:
-        document_ids = [d['_id'] for d in documents['hits']['hits']]
-
-    return document_ids
+    for document in documents:
+        yield document['_id']
 
 
 def document_id_from_field_query(client, index, doc_types, field, value):
@@ -871,13 +1044,14 @@ def document_id_from_field_query(client, index, doc_types, field, value):
             }
         }
     }
-    documents = search_all_results(
+    # Two hits are enough to know there isn't a single one
+    documents = list(itertools.islice(iter_search_results(
         client,
         body=query,
         doc_type=doc_types
-    )
-    if len(documents['hits']['hits']) == 1:
-        document_id = documents['hits']['hits'][0]['_id']
+    ), 2))
+    if len(documents) == 1:
+        document_id = documents[0]['_id']
     return document_id
 
 
@@ -925,7 +1099,7 @@ def set_file_tags(client, uuid, tags):
     :param list tags: A list of zero or more tags.
         Passing an empty list clears the file's tags.
     """
-    document_ids = _document_ids_from_field_query(client, 'transfers', ['transferfile'], 'fileuuid', uuid)
+    document_ids = list(_document_ids_from_field_query(client, 'transfers', ['transferfile'], 'fileuuid', uuid))
 
     count = len(document_ids)
     if count == 0:
@@ -961,15 +1135,15 @@ def get_transfer_file_info(client, field, value):
             }
         }
     }
-    documents = search_all_results(client, body=query, index=indicies)
-    result_count = len(documents['hits']['hits'])
+    documents = list(iter_search_results(client, body=query, index=indicies))
+    result_count = len(documents)
     if result_count == 1:
-        results = documents['hits']['hits'][0]['_source']
+        results = documents[0]['_source']
     elif result_count > 1:
         # Elasticsearch was sometimes ranking results for a different filename above
         # the actual file being queried for; in that case only consider results
         # where the value is an actual precise match.
-        filtered_results = [results for results in documents['hits']['hits']
+        filtered_results = [results for results in documents
                             if results['_source'][field] == value]
 
         result_count = len(filtered_results)
@@ -1009,10 +1183,9 @@ def remove_transfer_files(client, uuid, unit_type=None):
 
     if len(transfers) > 0:
         for transfer in transfers:
-            files = _document_ids_from_field_query(client, 'transfers', ['transferfile'], 'sipuuid', transfer)
-            if len(files) > 0:
-                for f in files:
-                    client.delete('transfers', 'transferfile', f)
+            # The scroll reads a snapshot, so deleting as it goes is safe
+            for f in _document_ids_from_field_query(client, 'transfers', ['transferfile'], 'sipuuid', transfer):
+                client.delete('transfers', 'transferfile', f)
     else:
         if not unit_type:
             unit_type = 'transfer or SIP'
@@ -1105,11 +1278,15 @@ def augment_raw_search_results(raw_results):
     :param raw_results: the raw JSON result from an elastic search query
     :return: JSON result simplified, with document_id set
     """
-    modifiedResults = []
+    return list(augment_search_hits(raw_results['hits']['hits']))
+
 
-    for item in raw_results['hits']['hits']:
+def augment_search_hits(hits):
+    """
+    Generator over the source documents of `hits`, e.g. from
+    iter_search_results, with document_id set.
+    """
+    for item in hits:
         clone = item['_source'].copy()
         clone['document_id'] = item[u'_id']
-        modifiedResults.append(clone)
-
-    return modifiedResults
+        yield clone
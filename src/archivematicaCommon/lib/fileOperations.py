@@ -22,6 +22,7 @@
 
 from __future__ import absolute_import, print_function
 import csv
+import json
 import os
 import uuid
 import sys
@@ -29,7 +30,7 @@ import shutil
 
 from databaseFunctions import insertIntoFiles
 from executeOrRunSubProcess import executeOrRun
-from databaseFunctions import insertIntoEvents
+from databaseFunctions import insertIntoEvents, bulkInsertIntoEvents, bulkUpdate, getAMAgentsForUnit
 import MySQLdb
 from archivematicaFunctions import unicodeToStr, get_setting, get_file_checksum
 
@@ -64,24 +65,42 @@ def updateSizeAndChecksum(fileUUID, filePath, date, eventIdentifierUUID, fileSiz
 def addFileToTransfer(filePathRelativeToSIP, fileUUID, transferUUID, taskUUID, date, sourceType="ingestion", eventDetail="", use="original"):
     #print filePathRelativeToSIP, fileUUID, transferUUID, taskUUID, date, sourceType, eventDetail, use
     insertIntoFiles(fileUUID, filePathRelativeToSIP, date, transferUUID=transferUUID, use=use)
-    insertIntoEvents(fileUUID=fileUUID,
-                     eventType=sourceType,
-                     eventDateTime=date,
-                     eventDetail=eventDetail,
-                     eventOutcome="",
-                     eventOutcomeDetailNote="")
-    addAccessionEvent(fileUUID, transferUUID, date)
+    events = [{
+        'fileUUID': fileUUID,
+        'eventType': sourceType,
+        'eventDateTime': date,
+        'eventDetail': eventDetail,
+        'eventOutcome': "",
+        'eventOutcomeDetailNote': "",
+    }]
+    accessionEvent = _accessionEvent(fileUUID, transferUUID, date)
+    if accessionEvent:
+        events.append(accessionEvent)
+    # Both events have the agents of the transfer the file was added to
+    agents = getAMAgentsForUnit(transferUUID=transferUUID)
+    for event in events:
+        event['agents'] = agents
+    bulkInsertIntoEvents(events)
 
 def addAccessionEvent(fileUUID, transferUUID, date):
+    accessionEvent = _accessionEvent(fileUUID, transferUUID, date)
+    if accessionEvent:
+        insertIntoEvents(**accessionEvent)
+
+def _accessionEvent(fileUUID, transferUUID, date):
+    """Returns the insertIntoEvents arguments for the transfer's accession event, or None if it has no accession number."""
     transfer = Transfer.objects.get(uuid=transferUUID)
     if transfer.accessionid:
         eventOutcomeDetailNote =  "accession#" + MySQLdb.escape_string(transfer.accessionid)
-        insertIntoEvents(fileUUID=fileUUID,
-                         eventType="registration",
-                         eventDateTime=date,
-                         eventDetail="",
-                         eventOutcome="",
-                         eventOutcomeDetailNote=eventOutcomeDetailNote)
+        return {
+            'fileUUID': fileUUID,
+            'eventType': "registration",
+            'eventDateTime': date,
+            'eventDetail': "",
+            'eventOutcome': "",
+            'eventOutcomeDetailNote': eventOutcomeDetailNote,
+        }
+    return None
 
 def addFileToSIP(filePathRelativeToSIP, fileUUID, sipUUID, taskUUID, date, sourceType="ingestion", use="original"):
     insertIntoFiles(fileUUID, filePathRelativeToSIP, date, sipUUID=sipUUID, use=use)
@@ -90,7 +109,8 @@ def addFileToSIP(filePathRelativeToSIP, fileUUID, sipUUID, taskUUID, date, sourc
                      eventDateTime=date,
                      eventDetail="",
                      eventOutcome="",
-                     eventOutcomeDetailNote="")
+                     eventOutcomeDetailNote="",
+                     agents=getAMAgentsForUnit(sipUUID=sipUUID))
 
 #Used to write to file
 #@output - the text to append to the file
@@ -223,6 +243,16 @@ def updateFileLocation(src, dst, eventType="", eventDateTime="", eventDetail="",
     # CREATE THE EVENT
     insertIntoEvents(fileUUID=f.uuid, eventType=eventType, eventDateTime=eventDateTime, eventDetail=eventDetail, eventOutcome="", eventOutcomeDetailNote=eventOutcomeDetailNote)
 
+def updateFileLocations(locations):
+    """
+    Updates the locations of several files in the database, as
+    updateFileLocation does without creating events, with bulkUpdate.
+
+    :param locations: A dict of {file UUID: new current location}.
+    """
+    bulkUpdate(File, 'currentlocation', dict(
+        (fileUUID, unicodeToStr(location)) for fileUUID, location in locations.items()))
+
 def getFileUUIDLike(filePath, unitPath, unitIdentifier, unitIdentifierType, unitPathReplaceWith):
     """Dest needs to be the actual full destination path with filename."""
     srcDB = filePath.replace(unitPath, unitPathReplaceWith)
@@ -239,6 +269,130 @@ def updateFileGrpUsefileGrpUUID(fileUUID, fileGrpUse, fileGrpUUID):
 def updateFileGrpUse(fileUUID, fileGrpUse):
     File.objects.filter(uuid=fileUUID).update(filegrpuse=fileGrpUse)
 
+# Saved in the SIP directory, outside objects/ so it is not part of the AIP
+MANUAL_NORMALIZATION_INDEX = 'manualNormalizationIndex.json'
+
+# Indexes already loaded by this process, by index path
+_manualNormalizationIndexes = {}
+
+
+class ManualNormalizationIndex(object):
+    """
+    The mappings in a SIP's objects/manualNormalization/normalization.csv.
+
+    Each row of the CSV is "original, access, preservation", with paths
+    relative to the objects directory. The first row for a name wins, as it
+    did when the CSV was scanned for every file.
+    """
+
+    def __init__(self, signature, originals, access, preservation):
+        """
+        :param list signature: [mtime, size] of the CSV the index was built from.
+        :param dict originals: original -> [access, preservation]
+        :param dict access: access -> original
+        :param dict preservation: preservation -> original
+        """
+        self.signature = signature
+        self.originals = originals
+        self.access = access
+        self.preservation = preservation
+
+    @staticmethod
+    def csvSignature(csv_path):
+        st = os.stat(csv_path)
+        return [st.st_mtime, st.st_size]
+
+    @classmethod
+    def fromCSV(cls, csv_path):
+        """Builds the index from the CSV; raises csv.Error if it can't be read."""
+        signature = cls.csvSignature(csv_path)
+        originals, access, preservation = {}, {}, {}
+        # use universal newline mode to support unusual newlines, like \r
+        with open(csv_path, 'rbU') as csv_file:
+            reader = csv.reader(csv_file)
+            try:
+                for row in reader:
+                    if not row:
+                        continue
+                    if "#" in row[0]:  # ignore comments
+                        continue
+                    original, access_file, preservation_file = [_indexKey(name) for name in row]
+                    originals.setdefault(original, [access_file, preservation_file])
+                    if access_file:
+                        access.setdefault(access_file, original)
+                    if preservation_file:
+                        preservation.setdefault(preservation_file, original)
+            except (csv.Error, ValueError):
+                raise csv.Error("Error reading {filename} on line {linenum}".format(
+                    filename=csv_path, linenum=reader.line_num))
+        return cls(signature, originals, access, preservation)
+
+    @classmethod
+    def load(cls, index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        return cls(index['signature'], index['originals'], index['access'], index['preservation'])
+
+    def save(self, index_path):
+        """Writes the index atomically, so concurrent readers never see a partial file."""
+        tmp_path = '{}.{}'.format(index_path, uuid.uuid4())
+        with open(tmp_path, 'w') as f:
+            json.dump({'signature': self.signature, 'originals': self.originals,
+                       'access': self.access, 'preservation': self.preservation}, f)
+        os.rename(tmp_path, index_path)
+
+    def normalizedFiles(self, original):
+        """Returns (access, preservation) for an original file, or None if it has no row."""
+        files = self.originals.get(_indexKey(original))
+        if files is None:
+            return None
+        return tuple(unicodeToStr(name) for name in files)
+
+    def originalOf(self, commandClassification, target_file):
+        """Returns the original for an "access" or "preservation" file, or None if it has no row."""
+        names = self.access if commandClassification == "access" else self.preservation
+        original = names.get(_indexKey(target_file))
+        return unicodeToStr(original) if original is not None else None
+
+
+def _indexKey(name):
+    if isinstance(name, str):
+        name = name.decode('utf-8')
+    return name
+
+
+def getManualNormalizationIndex(sip_path):
+    """
+    Returns the ManualNormalizationIndex for a SIP, or None if it has no normalization.csv.
+
+    The index is built the first time it is needed and saved in the SIP
+    directory; it is rebuilt if the CSV changes. Raises csv.Error if the CSV
+    can't be read.
+    """
+    csv_path = os.path.join(sip_path, "objects", "manualNormalization", "normalization.csv")
+    index_path = os.path.join(sip_path, MANUAL_NORMALIZATION_INDEX)
+    try:
+        signature = ManualNormalizationIndex.csvSignature(csv_path)
+    except OSError:
+        _manualNormalizationIndexes.pop(index_path, None)
+        return None
+
+    index = _manualNormalizationIndexes.get(index_path)
+    if index is None or index.signature != signature:
+        try:
+            index = ManualNormalizationIndex.load(index_path)
+        except (IOError, ValueError, KeyError):
+            index = None
+        if index is None or index.signature != signature:
+            index = ManualNormalizationIndex.fromCSV(csv_path)
+            try:
+                index.save(index_path)
+            except (IOError, OSError) as e:
+                print("Unable to save {}: {}".format(index_path, e), file=sys.stderr)
+        _manualNormalizationIndexes[index_path] = index
+    return index
+
+
 def findFileInNormalizatonCSV(csv_path, commandClassification, target_file, sip_uuid):
     """ Returns the original filename or None for a manually normalized file.
 
@@ -249,38 +403,29 @@ def findFileInNormalizatonCSV(csv_path, commandClassification, target_file, sip_
 
     :returns: Path to the origin file for `target_file`. Note this is the path from normalization.csv, so will be the original location.
     """
-    # use universal newline mode to support unusual newlines, like \r
-    with open(csv_path, 'rbU') as csv_file:
-        reader = csv.reader(csv_file)
-        # Search CSV for an access/preservation filename that matches target_file
-        # Get original name of target file, to handle sanitized names
-        try:
-            f = File.objects.get(removedtime__isnull=True,
-                                 currentlocation__endswith=target_file,
-                                 sip_id=sip_uuid)
-        except File.MultipleObjectsReturned:
-            print("More than one result found for {} file ({}) in DB.".format(commandClassification, target_file), file=sys.stderr)
-            sys.exit(2)
-        except File.DoesNotExist:
-            print("{} file ({}) not found in DB.".format(commandClassification, target_file), file=sys.stderr)
-            sys.exit(2)
-        target_file = f.originallocation.replace('%transferDirectory%objects/', '', 1).replace('%SIPDirectory%objects/', '', 1)
-        try:
-            for row in reader:
-                if not row:
-                    continue
-                if "#" in row[0]:  # ignore comments
-                    continue
-                original, access, preservation = row
-                if commandClassification == "access" and access == target_file:
-                    print("Found access file ({0}) for original ({1})".format(access, original))
-                    return original
-                if commandClassification == "preservation" and preservation == target_file:
-                    print("Found preservation file ({0}) for original ({1})".format(preservation, original))
-                    return original
-            else:
-                return None
-        except csv.Error:
-            print("Error reading {filename} on line {linenum}".format(
-                filename=csv_path, linenum=reader.line_num), file=sys.stderr)
-            sys.exit(2)
+    # Get original name of target file, to handle sanitized names
+    try:
+        f = File.objects.get(removedtime__isnull=True,
+                             currentlocation='%SIPDirectory%objects/' + target_file,
+                             sip_id=sip_uuid)
+    except File.MultipleObjectsReturned:
+        print("More than one result found for {} file ({}) in DB.".format(commandClassification, target_file), file=sys.stderr)
+        sys.exit(2)
+    except File.DoesNotExist:
+        print("{} file ({}) not found in DB.".format(commandClassification, target_file), file=sys.stderr)
+        sys.exit(2)
+    target_file = f.originallocation.replace('%transferDirectory%objects/', '', 1).replace('%SIPDirectory%objects/', '', 1)
+
+    # csv_path is objects/manualNormalization/normalization.csv in the SIP
+    sip_path = os.path.dirname(os.path.dirname(os.path.dirname(csv_path)))
+    try:
+        index = getManualNormalizationIndex(sip_path)
+    except csv.Error as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    if index is None:
+        return None
+    original = index.originalOf(commandClassification, target_file)
+    if original is not None:
+        print("Found {0} file ({1}) for original ({2})".format(commandClassification, target_file, original))
+    return original
@@ -1,18 +1,35 @@
 from __future__ import absolute_import
 import base64
+import copy
 import logging
 import os
 import platform
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
+from requests.packages.urllib3.util.retry import Retry
 import slumber
 import urllib
 
+from django.conf import settings as django_settings
+
 # archivematicaCommon
 from archivematicaFunctions import get_setting
 
 LOGGER = logging.getLogger("archivematica.common")
 
+# Defaults for the settings in django.conf.settings that tune the client
+# Seconds to wait for the storage service to connect or send data
+DEFAULT_TIMEOUT = 86400
+# Times to retry idempotent requests that fail to connect
+DEFAULT_RETRIES = 3
+# Seconds to reuse the storage service settings, pipeline and locations for
+DEFAULT_CACHE_TTL = 60
+# Bytes read at a time when downloading files
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class ResourceNotFound(Exception):
     pass
@@ -37,9 +54,84 @@ class TastypieApikeyAuth(AuthBase):
         return r
 
 
+class _TTLCache(object):
+    """ Values that are looked up again once they are older than a TTL. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def get(self, key, lookup, cache_if=lambda value: True):
+        """
+        Return the value for key, calling lookup() for it if there is none
+        or it has expired. The value is only kept if cache_if(value).
+        """
+        now = time.time()
+        with self.lock:
+            expires, value = self.values.get(key, (0, None))
+        if expires > now:
+            return value
+        value = lookup()
+        if cache_if(value):
+            ttl = getattr(django_settings, 'STORAGE_SERVICE_CLIENT_CACHE_TTL', DEFAULT_CACHE_TTL)
+            with self.lock:
+                self.values[key] = (now + ttl, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+_settings_cache = _TTLCache()
+_pipeline_cache = _TTLCache()
+_location_cache = _TTLCache()
+
+_client_lock = threading.Lock()
+_client = {}
+
+
+def clear_cache():
+    """ Forget the cached settings, pipeline and locations, e.g. after the settings change. """
+    for cache in (_settings_cache, _pipeline_cache, _location_cache):
+        cache.clear()
+
+
+def _get_setting(name, default=None):
+    """ get_setting, cached for STORAGE_SERVICE_CLIENT_CACHE_TTL seconds. """
+    return _settings_cache.get((name, default), lambda: get_setting(name, default))
+
+
+class _TimeoutHTTPAdapter(HTTPAdapter):
+    """ HTTPAdapter that applies a timeout to requests made without one. """
+
+    def __init__(self, timeout, *args, **kwargs):
+        self.timeout = timeout
+        super(_TimeoutHTTPAdapter, self).__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(_TimeoutHTTPAdapter, self).send(request, **kwargs)
+
+
+def _session():
+    """ Returns the requests Session shared by every call to the storage service, creating it if needed. """
+    with _client_lock:
+        if 'session' not in _client:
+            timeout = getattr(django_settings, 'STORAGE_SERVICE_CLIENT_TIMEOUT', DEFAULT_TIMEOUT)
+            retries = getattr(django_settings, 'STORAGE_SERVICE_CLIENT_RETRIES', DEFAULT_RETRIES)
+            # Only idempotent methods are retried, and only on connection errors
+            adapter = _TimeoutHTTPAdapter(timeout, max_retries=Retry(total=retries, read=False, backoff_factor=0.5))
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _client['session'] = session
+        return _client['session']
+
+
 def _storage_service_url():
     # Get storage service URL from DashboardSetting model
-    storage_service_url = get_setting('storage_service_url', None)
+    storage_service_url = _get_setting('storage_service_url', None)
     if storage_service_url is None:
         LOGGER.error("Storage server not configured.")
         storage_service_url = 'http://localhost:8000/'
@@ -47,22 +139,34 @@ def _storage_service_url():
     if storage_service_url[-1] != '/':
         storage_service_url+='/'
     storage_service_url = storage_service_url+'api/v2/'
-    LOGGER.debug("Storage service URL: {}".format(storage_service_url))
     return storage_service_url
 
 
 def _storage_api():
-    """ Returns slumber access to storage API. """
+    """
+    Returns slumber access to storage API.
+
+    The API and its HTTP session are kept between calls, and made again
+    only if the storage service settings change.
+    """
     storage_service_url = _storage_service_url()
-    username = get_setting('storage_service_user', 'test')
-    api_key = get_setting('storage_service_apikey', None)
-    api = slumber.API(storage_service_url, auth=TastypieApikeyAuth(username, api_key))
-    return api
+    username = _get_setting('storage_service_user', 'test')
+    api_key = _get_setting('storage_service_apikey', None)
+    key = (storage_service_url, username, api_key)
+    session = _session()
+    with _client_lock:
+        if _client.get('api_key') != key:
+            LOGGER.debug("Storage service URL: {}".format(storage_service_url))
+            # slumber leaves authentication to a session passed to it
+            session.auth = TastypieApikeyAuth(username, api_key)
+            _client['api'] = slumber.API(storage_service_url, session=session)
+            _client['api_key'] = key
+        return _client['api']
 
 def _storage_api_params():
     """ Returns API GET params username=USERNAME&api_key=KEY """
-    username = get_setting('storage_service_user', 'test')
-    api_key = get_setting('storage_service_apikey', None)
+    username = _get_setting('storage_service_user', 'test')
+    api_key = _get_setting('storage_service_apikey', None)
     return urllib.urlencode({'username': username, 'api_key': api_key})
 
 def _storage_relative_from_absolute(location_path, space_path):
@@ -102,6 +206,10 @@ def create_pipeline(create_default_locations=False, shared_path=None, api_userna
     return True
 
 def _get_pipeline(uuid):
+    """ Returns the pipeline with `uuid`, or None if it isn't available. Found pipelines are cached. """
+    return copy.deepcopy(_pipeline_cache.get(uuid, lambda: _fetch_pipeline(uuid), cache_if=lambda p: p is not None))
+
+def _fetch_pipeline(uuid):
     api = _storage_api()
     try:
         pipeline = api.pipeline(uuid).get()
@@ -124,14 +232,22 @@ def get_location(path=None, purpose=None, space=None):
         purposes, found in storage_service.locations.models.py
     path: Path to location.  If a space is passed in, paths starting with /
         have the space's path stripped.
+
+    Results are cached for STORAGE_SERVICE_CLIENT_CACHE_TTL seconds.
     """
-    api = _storage_api()
-    offset = 0
-    return_locations = []
     if space and path:
         path = _storage_relative_from_absolute(path, space['path'])
         space = space['uuid']
-    pipeline = _get_pipeline(get_setting('dashboard_uuid'))
+    elif space:
+        space = space['uuid']
+    locations = _location_cache.get((path, purpose, space), lambda: _fetch_locations(path, purpose, space), cache_if=lambda l: l is not None)
+    return copy.deepcopy(locations)
+
+def _fetch_locations(path, purpose, space):
+    api = _storage_api()
+    offset = 0
+    return_locations = []
+    pipeline = _get_pipeline(_get_setting('dashboard_uuid'))
     if pipeline is None:
         return None
     while True:
@@ -179,7 +295,7 @@ def copy_files(source_location, destination_location, files, api=None):
     """
     if api is None:
         api = _storage_api()
-    pipeline = _get_pipeline(get_setting('dashboard_uuid'))
+    pipeline = _get_pipeline(_get_setting('dashboard_uuid'))
     move_files = {
         'origin_location': source_location['resource_uri'],
         'files': files,
@@ -264,7 +380,7 @@ def create_file(uuid, origin_location, origin_path, current_location,
     """
 
     api = _storage_api()
-    pipeline = _get_pipeline(get_setting('dashboard_uuid'))
+    pipeline = _get_pipeline(_get_setting('dashboard_uuid'))
     if pipeline is None:
         return (None, 'Pipeline not available, see logs.')
     new_file = {
@@ -342,18 +458,61 @@ def extract_file_url(file_uuid, relative_path):
     Returns URL to storage service for `relative_path` in `file_uuid`.
     """
     storage_service_url = _storage_service_url()
-    api_params = _storage_api_params()
-    download_url = "{base_url}file/{uuid}/extract_file/?relative_path_to_file={path}&{params}".format(
-        base_url=storage_service_url, uuid=file_uuid, path=relative_path, params=api_params)
+    if isinstance(relative_path, unicode):
+        relative_path = relative_path.encode('utf-8')
+    params = urllib.urlencode({'relative_path_to_file': relative_path})
+    download_url = "{base_url}file/{uuid}/extract_file/?{params}&{api_params}".format(
+        base_url=storage_service_url, uuid=file_uuid, params=params, api_params=_storage_api_params())
     return download_url
 
-def extract_file(uuid, relative_path, save_path):
-    """ Fetches `relative_path` from package with `uuid` and saves to `save_path`. """
-    api = _storage_api()
-    params = {'relative_path_to_file': relative_path}
-    with open(save_path, 'w') as f:
-        f.write(api.file(uuid).extract_file.get(**params))
-        os.chmod(save_path, 0o660)
+def stream_file(url, headers=None):
+    """
+    Returns a streaming requests Response for `url`, one of the download URLs
+    above, made with the shared session.
+
+    headers: Extra request headers, e.g. a Range.
+    """
+    return _session().get(url, stream=True, headers=headers)
+
+def _raise_for_status(response):
+    """ Raises the slumber exception the API would have for an error response. """
+    if 400 <= response.status_code <= 499:
+        exception_class = slumber.exceptions.HttpClientError
+    elif 500 <= response.status_code <= 599:
+        exception_class = slumber.exceptions.HttpServerError
+    else:
+        return
+    raise exception_class("Error {}: {}".format(response.status_code, response.url),
+        response=response, content=response.content)
+
+def extract_file(uuid, relative_path, save_path, resume=False):
+    """
+    Fetches `relative_path` from package with `uuid` and saves to `save_path`.
+
+    The file is written a chunk at a time as it is received. If `resume` and
+    `save_path` already holds the start of the file, only the rest of it is
+    requested.
+    """
+    url = extract_file_url(uuid, relative_path)
+    headers = {}
+    offset = 0
+    if resume and os.path.isfile(save_path):
+        offset = os.path.getsize(save_path)
+        headers['Range'] = 'bytes={}-'.format(offset)
+    response = stream_file(url, headers)
+    try:
+        if offset and response.status_code == 416:
+            # Nothing left to fetch
+            return
+        _raise_for_status(response)
+        # The whole file is sent if the range isn't supported
+        mode = 'ab' if response.status_code == 206 else 'wb'
+        with open(save_path, mode) as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+            os.chmod(save_path, 0o660)
+    finally:
+        response.close()
 
 
 def pointer_file_url(file_uuid):
@@ -0,0 +1,394 @@
+#!/usr/bin/env python2
+
+# This file is part of Archivematica.
+#
+# Copyright 2010-2013 Artefactual Systems Inc. <http://artefactual.com>
+#
+# Archivematica is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Archivematica is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
+
+# @package Archivematica
+# @subpackage archivematicaCommon
+
+#~DOC~
+#
+# How tasks get from the MCPServer to the MCPClients and their results back.
+#
+# The MCPServer submits tasks to a task client, which returns straight away
+# and calls back with a TaskResult once an MCPClient has run the task. The
+# MCPClient threads take tasks from a task worker, which has the interface
+# of gearman.GearmanWorker.
+#
+# Two transports are available:
+#   gearman: tasks go through a gearman server, as they always have. The
+#     client keeps a few persistent connections open and multiplexes all
+#     running tasks over them, instead of connecting once per task.
+#   local: the MCPServer serves a queue itself, which MCPClients on the
+#     same host (or anywhere that can reach it) connect to; no gearman
+#     server is needed for single node deployments. Tasks go over the wire
+#     pickled, so anyone knowing the shared secret can run code in the
+#     MCPServer; there is no default secret, and the queue is best only
+#     served on a loopback address.
+
+import collections
+import cPickle
+import logging
+from multiprocessing import AuthenticationError
+from multiprocessing.managers import BaseManager, RemoteError
+import Queue
+import socket
+import threading
+import time
+
+import gearman
+from gearman.constants import JOB_COMPLETE, JOB_FAILED, JOB_UNKNOWN
+
+LOGGER = logging.getLogger('archivematica.common')
+
+TRANSPORTS = ('gearman', 'local')
+
+# Seconds between checks on running gearman jobs while new ones are waiting
+# to be submitted, and that a local worker waits for a job before asking again
+POLL_INTERVAL = 0.5
+
+
+class ServerUnavailable(gearman.errors.ServerUnavailable):
+    """The local task queue could not be reached; handled like gearman's own."""
+
+
+# The outcome of a submitted task. result is the unpickled value returned by
+# the MCPClient, or None if the task could not be run, in which case error
+# describes why.
+TaskResult = collections.namedtuple('TaskResult', 'unique result error')
+
+
+def createTaskClient(transport, address, authkey=None, connections=1, maxPending=0, dispatch=None):
+    """
+    Return the task client for the transport.
+
+    :param str transport: One of TRANSPORTS.
+    :param str address: host:port of the gearman server, or that the local queue listens on.
+    :param str authkey: Shared secret for the local queue; required for it.
+    :param int connections: Persistent gearman connections to use.
+    :param int maxPending: Tasks that may be submitted but not yet completed at once;
+        submit() blocks while there are this many. 0 is no limit.
+    :param dispatch: Called as dispatch(callback, args=(TaskResult,)) to run
+        completion callbacks; by default they are called by the transport's
+        own thread.
+    """
+    if transport == 'gearman':
+        return GearmanTaskClient([address], connections=connections, maxPending=maxPending, dispatch=dispatch)
+    elif transport == 'local':
+        _checkAuthkey(authkey)
+        return LocalTaskClient(_parseAddress(address), authkey, maxPending=maxPending, dispatch=dispatch)
+    raise ValueError('Unknown task transport %r; expected one of %s' % (transport, ', '.join(TRANSPORTS)))
+
+
+def createTaskWorker(transport, address, authkey=None):
+    """Return a worker for the transport, with the interface of gearman.GearmanWorker."""
+    if transport == 'gearman':
+        return gearman.GearmanWorker([address])
+    elif transport == 'local':
+        _checkAuthkey(authkey)
+        return LocalTaskWorker(_parseAddress(address), authkey)
+    raise ValueError('Unknown task transport %r; expected one of %s' % (transport, ', '.join(TRANSPORTS)))
+
+
+def _parseAddress(address):
+    host, _, port = address.rpartition(':')
+    return (host or 'localhost', int(port))
+
+
+def _checkAuthkey(authkey):
+    if not authkey:
+        raise ValueError('The local task transport needs a shared secret; set localTaskQueueAuthkey')
+
+
+def _isLoopback(host):
+    try:
+        return socket.gethostbyname(host).startswith('127.')
+    except socket.error:
+        return False
+
+
+def _callInline(callback, args=()):
+    callback(*args)
+
+
+class _TaskClient(object):
+    """Bookkeeping shared by the task clients."""
+
+    def __init__(self, maxPending=0, dispatch=None):
+        self.dispatch = dispatch or _callInline
+        self.pendingSemaphore = threading.Semaphore(maxPending) if maxPending else None
+
+    def _submitted(self):
+        if self.pendingSemaphore is not None:
+            self.pendingSemaphore.acquire()
+
+    def _completed(self, callback, result):
+        if self.pendingSemaphore is not None:
+            self.pendingSemaphore.release()
+        try:
+            self.dispatch(callback, args=(result,))
+        except Exception:
+            LOGGER.exception('Error handling result of task %s', result.unique)
+
+
+class GearmanTaskClient(_TaskClient):
+    """
+    Submits tasks to gearman without waiting for them to complete.
+
+    Each connection is owned by a thread that submits queued tasks and polls
+    for the results of the ones it has running, so no connection is set up or
+    torn down per task and no thread is tied up while a task runs.
+    """
+
+    def __init__(self, servers, connections=1, maxPending=0, dispatch=None):
+        super(GearmanTaskClient, self).__init__(maxPending, dispatch)
+        self.servers = servers
+        self.queue = Queue.Queue()
+        self.threads = []
+        for i in range(max(1, connections)):
+            t = threading.Thread(target=self._run, name='GearmanTaskClient-%d' % (i + 1))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, execute, data, unique, callback):
+        """Queue a task to be run by an MCPClient; callback is called with its TaskResult."""
+        self._submitted()
+        self.queue.put((execute.lower(), cPickle.dumps(data), unique, callback))
+
+    def _take(self, block):
+        """Tasks waiting to be submitted; if block, wait for at least one."""
+        tasks = []
+        try:
+            if block:
+                tasks.append(self.queue.get())
+            while True:
+                tasks.append(self.queue.get_nowait())
+        except Queue.Empty:
+            pass
+        return tasks
+
+    def _run(self):
+        client = gearman.GearmanClient(self.servers)
+        running = {}
+        waiting = []
+        failMaxSleep = 60
+        failSleepInitial = 1
+        failSleep = failSleepInitial
+        failSleepIncrementor = 2
+        while True:
+            waiting.extend(self._take(block=not running and not waiting))
+
+            if waiting:
+                try:
+                    requests = client.submit_multiple_jobs(
+                        [{'task': execute, 'data': data, 'unique': unique} for execute, data, unique, _ in waiting],
+                        wait_until_complete=False)
+                except gearman.errors.ServerUnavailable:
+                    if failSleep == failSleepInitial:
+                        LOGGER.exception('Error submitting job. Retrying.')
+                    time.sleep(failSleep)
+                    if failSleep < failMaxSleep:
+                        failSleep += failSleepIncrementor
+                else:
+                    failSleep = failSleepInitial
+                    for request, (_, _, _, callback) in zip(requests, waiting):
+                        running[request] = callback
+                    waiting = []
+
+            if not running:
+                continue
+            # Don't wait on running jobs for long if more could be submitted
+            pollTimeout = POLL_INTERVAL if self.queue.empty() else 0.01
+            try:
+                client.wait_until_jobs_completed(running.keys(), poll_timeout=pollTimeout)
+            except gearman.errors.ServerUnavailable:
+                # The jobs on the lost connections are left in JOB_UNKNOWN
+                LOGGER.exception('Lost connection to the gearman server')
+            for request in running.keys():
+                if request.state == JOB_COMPLETE:
+                    result = TaskResult(request.unique, cPickle.loads(request.result), None)
+                elif request.state == JOB_UNKNOWN:
+                    result = TaskResult(request.unique, None, 'connection failed!')
+                elif request.state == JOB_FAILED:
+                    result = TaskResult(request.unique, None, 'failed!')
+                else:
+                    continue
+                self._completed(running.pop(request), result)
+
+
+class LocalTaskQueue(object):
+    """
+    Tasks waiting for, or being run by, the MCPClients of a LocalTaskClient.
+
+    Lives in the MCPServer; the MCPClients call get() and complete() through
+    a multiprocessing manager, which serves each connection from a thread of
+    its own. The tasks taken through a connection are put back in the queue
+    once its thread has ended, i.e. the MCPClient disconnected or its
+    connection failed, as gearman does with the jobs of a worker that goes
+    away.
+    """
+
+    def __init__(self, completed):
+        self.completed = completed
+        self.condition = threading.Condition()
+        self.waiting = collections.deque()
+        # unique: (execute, data, unique, callback, thread of the connection)
+        self.running = {}
+        # Thread of each connection: uniques of the tasks taken through it
+        self.held = {}
+
+    def put(self, execute, data, unique, callback):
+        with self.condition:
+            self.waiting.append((execute, data, unique, callback))
+            self.condition.notify_all()
+
+    def get(self, tasks, timeout):
+        """
+        Take the oldest waiting task that is one of tasks.
+
+        :returns: (execute, unique, data), or None if there was none within timeout.
+        """
+        deadline = time.time() + timeout
+        holder = threading.current_thread()
+        with self.condition:
+            while True:
+                self._requeueAbandoned()
+                for i, (execute, data, unique, callback) in enumerate(self.waiting):
+                    if execute in tasks:
+                        del self.waiting[i]
+                        self.running[unique] = (execute, data, unique, callback, holder)
+                        self.held.setdefault(holder, set()).add(unique)
+                        return execute, unique, data
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def complete(self, unique, result):
+        """Report the pickled result of a task."""
+        try:
+            result = TaskResult(unique, cPickle.loads(result), None)
+        except Exception:
+            LOGGER.exception('Unable to read the result of task %s', unique)
+            result = TaskResult(unique, None, 'failed!')
+        self._finish(result)
+
+    def fail(self, unique):
+        """Report that a task could not be run."""
+        self._finish(TaskResult(unique, None, 'failed!'))
+
+    def _finish(self, result):
+        with self.condition:
+            task = self.running.pop(result.unique, None)
+            if task is not None:
+                self.held[task[4]].discard(result.unique)
+        if task is None:
+            LOGGER.warning('Result received for unknown task %s', result.unique)
+            return
+        self.completed(task[3], result)
+
+    def _requeueAbandoned(self):
+        """Put the tasks taken through connections that have gone away back in the queue."""
+        for holder in [holder for holder in self.held if not holder.is_alive()]:
+            for unique in self.held.pop(holder):
+                execute, data, unique, callback, _ = self.running.pop(unique)
+                LOGGER.warning('MCPClient running task %s went away; queueing it again', unique)
+                self.waiting.appendleft((execute, data, unique, callback))
+
+
+class _LocalClientManager(BaseManager):
+    pass
+
+_LocalClientManager.register('tasks')
+
+
+class LocalTaskClient(_TaskClient):
+    """Serves tasks to MCPClients using the local transport from this process."""
+
+    def __init__(self, address, authkey, maxPending=0, dispatch=None):
+        super(LocalTaskClient, self).__init__(maxPending, dispatch)
+        self.tasks = LocalTaskQueue(self._completed)
+        # A class of its own, as register() changes the class
+        serverManager = type('_LocalServerManager', (BaseManager,), {})
+        serverManager.register('tasks', callable=lambda: self.tasks, exposed=('get', 'complete', 'fail'))
+        self.server = serverManager(address=address, authkey=authkey).get_server()
+        self.address = self.server.address
+        t = threading.Thread(target=self.server.serve_forever, name='LocalTaskClient')
+        t.daemon = True
+        t.start()
+        LOGGER.info('Serving tasks on %s:%s', *self.address)
+        if not _isLoopback(self.address[0]):
+            LOGGER.warning('Serving tasks on %s, which is not a loopback address; anyone who can '
+                           'reach it and knows the shared secret can run code in the MCPServer',
+                           self.address[0])
+
+    def submit(self, execute, data, unique, callback):
+        """Queue a task to be run by an MCPClient; callback is called with its TaskResult."""
+        self._submitted()
+        self.tasks.put(execute.lower(), cPickle.dumps(data), unique, callback)
+
+
+class LocalJob(object):
+    """The parts of gearman.job.GearmanJob that MCPClient task handlers use."""
+
+    def __init__(self, task, unique, data):
+        self.task = task
+        self.unique = unique
+        self.data = data
+
+
+class LocalTaskWorker(object):
+    """Runs tasks taken from a LocalTaskClient, like a gearman.GearmanWorker."""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.worker_client_id = None
+        self.handlers = {}
+
+    def set_client_id(self, client_id):
+        self.worker_client_id = client_id
+
+    def register_task(self, task, callback):
+        self.handlers[task] = callback
+
+    def work(self, poll_timeout=POLL_INTERVAL):
+        """
+        Run tasks until the connection is lost.
+
+        Raises ServerUnavailable if the queue can't be reached or goes away.
+        """
+        try:
+            manager = _LocalClientManager(address=self.address, authkey=self.authkey)
+            manager.connect()
+            tasks = manager.tasks()
+            while True:
+                job = tasks.get(self.handlers.keys(), poll_timeout)
+                if job is None:
+                    continue
+                execute, unique, data = job
+                try:
+                    result = self.handlers[execute](self, LocalJob(execute, unique, data))
+                except Exception:
+                    # gearman would fail the job the same way
+                    LOGGER.exception('Error running task %s', unique)
+                    tasks.fail(unique)
+                else:
+                    tasks.complete(unique, result)
+        except (EOFError, IOError, socket.error, AuthenticationError, RemoteError) as e:
+            raise ServerUnavailable(str(e))
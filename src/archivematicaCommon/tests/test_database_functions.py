@@ -1,12 +1,13 @@
 # -*- coding: UTF-8 -*-
 import os
 import sys
+import uuid
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import databaseFunctions
 
 sys.path.append("/usr/share/archivematica/dashboard")
-from main.models import Agent, Event, File
+from main.models import Agent, Derivation, Event, File, Job, Task, UnitStatus
 
 from django.test import TestCase
 import pytest
@@ -37,6 +38,33 @@ class TestDatabaseFunctions(TestCase):
             databaseFunctions.insertIntoFiles("both", "both_path", sipUUID="sip", transferUUID="transfer")
         assert "both SIP and transfer UUID" in str(excinfo.value)
 
+    # bulkInsertIntoFiles
+
+    def test_bulk_insert_into_files(self):
+        databaseFunctions.bulkInsertIntoFiles([
+            {'fileUUID': "bulk_sip_file_1", 'filePath': "%SIPDirectory%objects/one", 'sipUUID': "0049fa6c-152f-44a0-93b0-c5e856a02292"},
+            {'fileUUID': "bulk_sip_file_2", 'filePath': "%SIPDirectory%objects/two", 'sipUUID': "0049fa6c-152f-44a0-93b0-c5e856a02292", 'use': "preservation"},
+            {'fileUUID': "bulk_transfer_file", 'filePath': "%transferDirectory%objects/three", 'transferUUID': "11449c3c-a31d-4663-8a01-10d1c705410f"},
+        ])
+        assert File.objects.filter(sip_id="0049fa6c-152f-44a0-93b0-c5e856a02292", uuid__startswith="bulk_sip_file").count() == 2
+        second = File.objects.get(uuid="bulk_sip_file_2")
+        assert second.originallocation == second.currentlocation == "%SIPDirectory%objects/two"
+        assert second.filegrpuse == "preservation"
+        assert second.enteredsystem is not None
+        transfer_file = File.objects.get(uuid="bulk_transfer_file")
+        assert transfer_file.transfer_id == "11449c3c-a31d-4663-8a01-10d1c705410f"
+        assert transfer_file.filegrpuse == "original"
+
+    def test_bulk_insert_into_files_raises_if_no_sip_or_transfer_provided(self):
+        with pytest.raises(Exception) as excinfo:
+            databaseFunctions.bulkInsertIntoFiles([
+                {'fileUUID': "bulk_sip_file", 'filePath': "path", 'sipUUID': "0049fa6c-152f-44a0-93b0-c5e856a02292"},
+                {'fileUUID': "no_sip", 'filePath': "no_sip_path"},
+            ])
+        assert "neither defined" in str(excinfo.value)
+        # Nothing was inserted
+        assert File.objects.filter(uuid="bulk_sip_file").count() == 0
+
     # getAMAgentsForFile
 
     def test_get_agent_for_file_with_sip_agent(self):
@@ -81,6 +109,148 @@ class TestDatabaseFunctions(TestCase):
         assert agents.get(id=2)
         assert agents.get(id=5)
 
+    # bulkInsertIntoEvents
+
+    def test_bulk_insert_into_events_links_agents_of_each_unit(self):
+        databaseFunctions.bulkInsertIntoEvents([
+            {'fileUUID': "88c8f115-80bc-4da4-a1e6-0158f5df13b9", 'eventIdentifierUUID': "bulk_sip_event"},
+            {'fileUUID': "1f4af873-8d60-4907-a92e-d1889e643524", 'eventIdentifierUUID': "bulk_transfer_event"},
+            {'fileUUID': "1f4af873-8d60-4907-a92e-d1889e643524", 'eventIdentifierUUID': "bulk_given_agents", 'agents': [1]},
+        ])
+        sip_agents = Event.objects.get(event_id="bulk_sip_event").agents.values_list('id', flat=True)
+        assert sorted(sip_agents) == [1, 2, 5]
+        transfer_agents = Event.objects.get(event_id="bulk_transfer_event").agents.values_list('id', flat=True)
+        assert sorted(transfer_agents) == [1, 2, 10]
+        given_agents = Event.objects.get(event_id="bulk_given_agents").agents.values_list('id', flat=True)
+        assert list(given_agents) == [1]
+
+    # bulkInsertIntoDerivations
+
+    def test_bulk_insert_into_derivations(self):
+        databaseFunctions.bulkInsertIntoDerivations([
+            {'sourceFileUUID': "88c8f115-80bc-4da4-a1e6-0158f5df13b9", 'derivedFileUUID': "1f4af873-8d60-4907-a92e-d1889e643524"},
+            {'sourceFileUUID': "dc569efe-c88f-4be3-94d3-d9eac0c5d410", 'derivedFileUUID': "d4e599bd-f9ab-48d4-9ae7-9e87d4ac1619"},
+        ])
+        derivations = Derivation.objects.filter(source_file_id__in=["88c8f115-80bc-4da4-a1e6-0158f5df13b9", "dc569efe-c88f-4be3-94d3-d9eac0c5d410"])
+        assert sorted(derivations.values_list('source_file_id', 'derived_file_id', 'event_id')) == [
+            ("88c8f115-80bc-4da4-a1e6-0158f5df13b9", "1f4af873-8d60-4907-a92e-d1889e643524", None),
+            ("dc569efe-c88f-4be3-94d3-d9eac0c5d410", "d4e599bd-f9ab-48d4-9ae7-9e87d4ac1619", None),
+        ]
+
+    def test_bulk_insert_into_derivations_raises_if_uuid_missing(self):
+        with pytest.raises(ValueError):
+            databaseFunctions.bulkInsertIntoDerivations([
+                {'sourceFileUUID': "88c8f115-80bc-4da4-a1e6-0158f5df13b9", 'derivedFileUUID': "1f4af873-8d60-4907-a92e-d1889e643524"},
+                {'sourceFileUUID': "88c8f115-80bc-4da4-a1e6-0158f5df13b9", 'derivedFileUUID': ""},
+            ])
+        assert Derivation.objects.filter(source_file_id="88c8f115-80bc-4da4-a1e6-0158f5df13b9").count() == 0
+
+    # filesWereRemoved
+
+    def test_files_were_removed(self):
+        uuids = ["88c8f115-80bc-4da4-a1e6-0158f5df13b9", "1f4af873-8d60-4907-a92e-d1889e643524"]
+        databaseFunctions.filesWereRemoved(uuids, eventDetail="removed in bulk")
+        for f in File.objects.filter(uuid__in=uuids):
+            assert f.removedtime is not None
+            assert f.currentlocation is None
+        assert Event.objects.filter(file_uuid__in=uuids, event_type="file removed", event_detail="removed in bulk").count() == 2
+
+    # bulkUpdate
+
+    def test_bulk_update(self):
+        locations = {
+            "88c8f115-80bc-4da4-a1e6-0158f5df13b9": "%SIPDirectory%objects/one.jpg",
+            "1f4af873-8d60-4907-a92e-d1889e643524": "%SIPDirectory%objects/two.jpg",
+        }
+        databaseFunctions.BULK_BATCH_SIZE, batch_size = 1, databaseFunctions.BULK_BATCH_SIZE
+        try:
+            with self.assertNumQueries(2):
+                databaseFunctions.bulkUpdate(File, 'currentlocation', locations, filegrpuse='preservation')
+        finally:
+            databaseFunctions.BULK_BATCH_SIZE = batch_size
+        files = File.objects.filter(uuid__in=locations)
+        assert dict(files.values_list('uuid', 'currentlocation')) == locations
+        assert set(files.values_list('filegrpuse', flat=True)) == set(['preservation'])
+
+    # logTasksCreatedSQL
+
+    def test_log_tasks_created_inserts_all_tasks(self):
+        Job.objects.create(jobuuid="e1e9d1f5-1a9d-4a4a-9f3e-0c6a9c0c7c3b", createdtime=databaseFunctions.getUTCDate())
+
+        class TaskManager(object):
+            class jobChainLink(object):
+                UUID = "e1e9d1f5-1a9d-4a4a-9f3e-0c6a9c0c7c3b"
+            execute = "identifyFileFormat_v0.0"
+
+        tasks = [
+            ({"%fileUUID%": "file-one", "%relativeLocation%": "%SIPDirectory%objects/one.txt"}, "task-one", "args one"),
+            ({"%fileUUID%": "file-two", "%relativeLocation%": "%SIPDirectory%objects/two.txt"}, "task-two", "args two"),
+        ]
+        databaseFunctions.logTasksCreatedSQL(TaskManager(), tasks)
+
+        created = Task.objects.filter(job_id=TaskManager.jobChainLink.UUID).order_by('taskuuid')
+        assert [t.taskuuid for t in created] == ["task-one", "task-two"]
+        assert [t.fileuuid for t in created] == ["file-one", "file-two"]
+        assert [t.filename for t in created] == ["one.txt", "two.txt"]
+        assert created[0].execution == "identifyFileFormat_v0.0"
+        assert created[0].arguments == "args one"
+
+    # updateUnitStatus
+
+    def _job(self, description, group='Approve transfer', unit_uuid='5a8d0539-8e5a-4aa9-98d8-5e5053140398'):
+        class unitTransfer(object):
+            UUID = unit_uuid
+            owningUnit = None
+
+        class JobChainLink(object):
+            UUID = str(uuid.uuid4())
+            unit = unitTransfer()
+            microserviceGroup = group
+        JobChainLink.description = description
+        return JobChainLink()
+
+    def _status(self):
+        return UnitStatus.objects.get(unit_uuid='5a8d0539-8e5a-4aa9-98d8-5e5053140398', unit_type='unitTransfer')
+
+    def test_update_unit_status_follows_latest_job(self):
+        approve = self._job('Approve standard transfer')
+        databaseFunctions.updateUnitStatus(approve, 'Executing command(s)', newJob=True)
+        databaseFunctions.updateUnitStatus(approve, 'Awaiting decision')
+        status = self._status()
+        assert status.status == UnitStatus.USER_INPUT
+        assert status.microservice == 'Approve standard transfer'
+
+        databaseFunctions.updateUnitStatus(self._job('Failed transfer', group='Failed transfer'), 'Executing command(s)', newJob=True)
+        # The previous job no longer changes the status
+        databaseFunctions.updateUnitStatus(approve, 'Completed successfully')
+        assert self._status().status == UnitStatus.FAILED
+
+    def test_update_unit_status_completes_transfers(self):
+        databaseFunctions.updateUnitStatus(self._job('Move transfer to backlog'), 'Executing command(s)', newJob=True)
+        status = self._status()
+        assert status.status == UnitStatus.COMPLETE
+        assert status.sip_uuid == 'BACKLOG'
+
+        create_sip = self._job('Create SIP from transfer objects')
+        databaseFunctions.updateUnitStatus(create_sip, 'Executing command(s)', newJob=True)
+        assert self._status().sip_uuid == ''
+        File.objects.create(uuid=str(uuid.uuid4()), transfer_id='5a8d0539-8e5a-4aa9-98d8-5e5053140398', sip_id='0049fa6c-152f-44a0-93b0-c5e856a02292')
+        databaseFunctions.updateUnitStatus(create_sip, 'Completed successfully')
+        status = self._status()
+        assert status.status == UnitStatus.COMPLETE
+        assert status.sip_uuid == '0049fa6c-152f-44a0-93b0-c5e856a02292'
+
+    def test_refresh_unit_status(self):
+        for i, (jobtype, currentstep) in enumerate((('Move transfer to backlog', 'Completed successfully'), ('Approve standard transfer', 'Awaiting decision'))):
+            Job.objects.create(jobuuid=str(uuid.uuid4()), jobtype=jobtype, currentstep=currentstep,
+                               sipuuid='5a8d0539-8e5a-4aa9-98d8-5e5053140398', unittype='unitTransfer',
+                               createdtime=databaseFunctions.getUTCDate(), createdtimedec=i)
+        status = databaseFunctions.refreshUnitStatus('5a8d0539-8e5a-4aa9-98d8-5e5053140398', 'unitTransfer')
+        assert status.status == UnitStatus.USER_INPUT
+        assert status.microservice == 'Approve standard transfer'
+        assert status.sip_uuid == 'BACKLOG'
+        assert databaseFunctions.refreshUnitStatus('no such unit', 'unitTransfer') is None
+
     # getAccessionNumberFromTransfer
 
     def test_get_accession_number_from_transfer(self):
@@ -3,7 +3,7 @@ import os
 import sys
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
-from dicts import ReplacementDict, ChoicesDict
+from dicts import ReplacementDict, ReplacementTemplate, ChoicesDict
 
 from main import models
 
@@ -103,6 +103,21 @@ def test_replacementdict_model_constructor_file_only():
     assert rd['%fileGrpUse%'] == FILE.filegrpuse
 
 
+def test_replacementdict_model_constructor_files():
+    other_file = models.File(
+        uuid='5a62b21c-1f2c-4d4b-a9a6-bf0f46d4e2a1',
+        transfer_id=TRANSFER.uuid,
+        originallocation='%sharedDirectory%orig2',
+        currentlocation='%sharedDirectory%new2',
+        filegrpuse='original'
+    )
+    rds = dict(ReplacementDict.frommodels([FILE, other_file]))
+
+    assert rds[FILE.uuid] == ReplacementDict.frommodel(file_=FILE, type_='file')
+    assert rds[other_file.uuid]['%currentLocation%'] == other_file.currentlocation
+    # The transfer is only fetched once
+    assert other_file.transfer is TRANSFER
+
 def test_replacementdict_options():
     d = ReplacementDict({'%relativeLocation%': 'bar'})
     assert d.to_gnu_options() == ['--relative-location=bar']
@@ -115,3 +130,14 @@ def test_replacementdict_replace_returns_bytestring():
     d = ReplacementDict({'%originalLocation%': '\x82\xdb\x82\xc1\x82\xd5\x82\xe9\x83\x81\x83C\x83\x8b'})
     out_str = d.replace(in_str)[0]
     assert type(out_str) == str
+
+
+def test_replacementtemplate_replace():
+    template = ReplacementTemplate(u'"%fileUUID%" "%SIPName%%fileUUID%" %date%', None)
+    assert template.keys == set(['%fileUUID%', '%SIPName%', '%date%'])
+
+    out = template.replace({'%fileUUID%': 'abc', '%SIPName%': u'การแปล'})
+    assert out == ['"abc" "\xe0\xb8\x81\xe0\xb8\xb2\xe0\xb8\xa3\xe0\xb9\x81\xe0\xb8\x9b\xe0\xb8\xa5abc" %date%', None]
+    assert type(out[0]) == str
+    # Values aren't replaced again
+    assert template.replace({'%fileUUID%': '%SIPName%', '%SIPName%': 'foo'})[0] == '"%SIPName%" "foo%SIPName%" %date%'
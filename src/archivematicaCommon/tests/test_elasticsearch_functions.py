@@ -1,5 +1,9 @@
+import copy
+import json
 import os
+import re
 import sys
+from xml.etree import ElementTree
 
 from elasticsearch import Elasticsearch
 import pytest
@@ -8,6 +12,8 @@ import vcr
 
 sys.path.append("/usr/lib/archivematica/archivematicaCommon")
 import elasticSearchFunctions
+from externals import xmltodict
+import namespaces as ns
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -90,3 +96,168 @@ class TestElasticSearchFunctions(unittest.TestCase):
     def test_set_tags_fails_when_file_cant_be_found(self):
         with pytest.raises(elasticSearchFunctions.EmptySearchResultError):
             elasticSearchFunctions.set_file_tags(self.client, 'no_such_file', [])
+
+
+class FakeBulkClient(object):
+    """ Answers bulk requests with the statuses given for each attempt. """
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+        self.transport = Elasticsearch().transport
+        self.cluster = self
+        self.health_checks = 0
+
+    def health(self):
+        self.health_checks += 1
+        return {'status': 'green'}
+
+    def bulk(self, body):
+        documents = body.splitlines()[1::2]
+        self.requests.append(documents)
+        statuses = self.statuses.pop(0)
+        items = [{'index': {'status': status, 'error': 'error' if status >= 300 else None}}
+                 for status in statuses[:len(documents)]]
+        for item in items:
+            if item['index']['error'] is None:
+                del item['index']['error']
+        return {'errors': any(status >= 300 for status in statuses), 'items': items}
+
+
+def test_bulk_index_sends_documents_in_chunks():
+    client = FakeBulkClient([201, 201], [201, 201], [201])
+    documents = [{'uuid': str(i)} for i in range(5)]
+    assert elasticSearchFunctions.bulk_index(client, documents, 'aips', 'aipfile', chunk_size=2) == 5
+    assert [len(request) for request in client.requests] == [2, 2, 1]
+    assert client.health_checks == 3
+
+
+def test_bulk_index_limits_chunk_bytes():
+    client = FakeBulkClient([201], [201])
+    documents = [{'uuid': 'x' * 100}, {'uuid': 'y' * 100}]
+    elasticSearchFunctions.bulk_index(client, documents, 'aips', 'aipfile', max_chunk_bytes=200)
+    assert len(client.requests) == 2
+
+
+def test_bulk_index_retries_only_failed_items():
+    client = FakeBulkClient([201, 429, 201, 503], [201, 201])
+    documents = [{'uuid': str(i)} for i in range(4)]
+    assert elasticSearchFunctions.bulk_index(client, documents, 'aips', 'aipfile', wait_between_tries=0) == 4
+    assert [json.loads(document)['uuid'] for document in client.requests[1]] == ['1', '3']
+
+
+def test_bulk_index_reports_each_failed_item():
+    client = FakeBulkClient([201, 400, 503], [503])
+    documents = [{'uuid': str(i)} for i in range(3)]
+    with pytest.raises(elasticSearchFunctions.BulkIndexError) as excinfo:
+        elasticSearchFunctions.bulk_index(client, documents, 'aips', 'aipfile', wait_between_tries=0, max_tries=2)
+    assert [document['uuid'] for document, _ in excinfo.value.errors] == ['1', '2']
+
+
+class FakeScrollClient(object):
+    """ Answers a search and its scroll requests with pages of hits. """
+
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.requests = []
+        self.cleared = []
+
+    def _page(self):
+        hits = [{'_id': str(i)} for i in self.pages.pop(0)]
+        return {'_scroll_id': 'scroll-%d' % len(self.requests), 'hits': {'total': 5, 'hits': hits}}
+
+    def search(self, **kwargs):
+        self.requests.append(('search', kwargs['size'], kwargs['scroll']))
+        return self._page()
+
+    def scroll(self, scroll_id, scroll):
+        self.requests.append(('scroll', scroll_id, scroll))
+        return self._page()
+
+    def clear_scroll(self, scroll_id):
+        self.cleared.append(scroll_id)
+
+
+def test_iter_search_results_scrolls_through_all_hits():
+    client = FakeScrollClient([0, 1], [2, 3], [4])
+    hits = elasticSearchFunctions.iter_search_results(client, {}, index='aips', size=2)
+    assert [hit['_id'] for hit in hits] == ['0', '1', '2', '3', '4']
+    assert client.requests == [('search', 2, '2m'), ('scroll', 'scroll-1', '2m'), ('scroll', 'scroll-2', '2m')]
+    assert client.cleared == ['scroll-3']
+
+
+def test_iter_search_results_clears_scroll_when_stopped_early():
+    client = FakeScrollClient([0, 1], [2, 3], [4])
+    hits = elasticSearchFunctions.iter_search_results(client, {}, index='aips', size=2)
+    assert next(hits)['_id'] == '0'
+    hits.close()
+    assert len(client.requests) == 1
+    assert client.cleared == ['scroll-1']
+
+
+def _whole_tree_documents(metsFilePath, uuid, sipName):
+    """ The documents index_mets_file_metadata indexed when it parsed the whole METS file. """
+    tree = ElementTree.parse(metsFilePath)
+    root = tree.getroot()
+    elasticSearchFunctions.remove_tool_output_from_mets(tree)
+
+    dmdSecData = {}
+    for item in root.findall("mets:dmdSec/mets:mdWrap/mets:xmlData", namespaces=ns.NSMAP):
+        dmdSecData = xmltodict.parse(ElementTree.tostring(item))
+    dublincore = root.find('mets:dmdSec/mets:mdWrap/mets:xmlData/dcterms:dublincore', namespaces=ns.NSMAP)
+    fileData = {
+        'AIPUUID': uuid,
+        'sipName': sipName,
+        'isPartOf': dublincore.findtext('dcterms:isPartOf', namespaces=ns.NSMAP),
+        'AICID': None,
+        'METS': {
+            'dmdSec': elasticSearchFunctions.rename_dict_keys_with_child_dicts(elasticSearchFunctions.normalize_dict_values(dmdSecData)),
+            'amdSec': {},
+        },
+        'transferMetadata': [
+            xmltodict.parse(ElementTree.tostring(element))['transfer_metadata']
+            for element in root.findall("mets:amdSec/mets:sourceMD/mets:mdWrap/mets:xmlData/transfer_metadata", namespaces=ns.NSMAP)],
+    }
+
+    documents = []
+    files = (root.findall("mets:fileSec/mets:fileGrp[@USE='original']/mets:file", namespaces=ns.NSMAP) +
+             root.findall("mets:fileSec/mets:fileGrp[@USE='metadata']/mets:file", namespaces=ns.NSMAP))
+    for file_ in files:
+        indexData = copy.deepcopy(fileData)
+        admID = file_.attrib.get('ADMID', None)
+        if admID is None:
+            uuids = re.findall(r'\w{8}-?\w{4}-?\w{4}-?\w{4}-?\w{12}', file_.attrib['ID'])
+            fileUUID = uuids[0] if len(set(uuids)) == 1 else None
+        else:
+            amdSecInfo = root.find("mets:amdSec[@ID='{}']".format(admID), namespaces=ns.NSMAP)
+            fileUUID = amdSecInfo.findtext("mets:techMD/mets:mdWrap/mets:xmlData/premis:object/premis:objectIdentifier/premis:objectIdentifierValue", namespaces=ns.NSMAP)
+            indexData['METS']['amdSec'] = elasticSearchFunctions.rename_dict_keys_with_child_dicts(
+                elasticSearchFunctions.normalize_dict_values(xmltodict.parse(ElementTree.tostring(amdSecInfo))))
+        indexData['FILEUUID'] = fileUUID
+        indexData['filePath'] = file_.find('mets:FLocat', namespaces=ns.NSMAP).attrib['{http://www.w3.org/1999/xlink}href']
+        indexData['fileExtension'] = os.path.splitext(indexData['filePath'])[1][1:].lower()
+        documents.append(indexData)
+    return documents
+
+
+def test_index_mets_file_metadata_matches_whole_tree_documents(monkeypatch):
+    indexed = []
+
+    def bulk_index(client, documents, index, doc_type):
+        indexed.extend(documents)
+    monkeypatch.setattr(elasticSearchFunctions, 'bulk_index', bulk_index)
+    monkeypatch.setattr(elasticSearchFunctions, 'get_dashboard_uuid', lambda: 'dashboard-uuid')
+
+    mets_path = os.path.join(THIS_DIR, 'fixtures', 'test-index-mets-file-metadata-METS.xml')
+    aip_uuid = '1a2b3c4d-5e6f-4a7b-8c9d-0e1f2a3b4c5d'
+    count = elasticSearchFunctions.index_mets_file_metadata(None, aip_uuid, mets_path, 'aips', 'aipfile', 'photographs')
+
+    assert count == 3
+    fields = ('AIPUUID', 'sipName', 'isPartOf', 'AICID', 'METS', 'transferMetadata', 'FILEUUID', 'filePath', 'fileExtension')
+    documents = [dict((field, document[field]) for field in fields) for document in indexed]
+    assert documents == _whole_tree_documents(mets_path, aip_uuid, 'photographs')
+    assert [document['FILEUUID'] for document in documents] == [
+        '7c7fbb8a-0b7a-4aa5-a0c3-2d1e7f54d3b5', 'f3a5c1e2-6d9b-4c8a-b7e0-1a2b3c4d5e6f', '5e2d7a1c-3b4f-4e6a-9c8d-7f6e5d4c3b2a']
+    # The FITS output is not indexed
+    assert 'fits' not in json.dumps(documents)
+    assert all(document['origin'] == 'dashboard-uuid' for document in indexed)
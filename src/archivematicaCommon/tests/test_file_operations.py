@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+import csv
+import os
+import sys
+
+sys.path.append("/usr/lib/archivematica/archivematicaCommon")
+import fileOperations
+
+import pytest
+
+CSV = """# original, access, preservation
+image.tif,manualNormalization/access/image.jpg,manualNormalization/preservation/image.tif
+image.tif,manualNormalization/access/other.jpg,
+d\xc3\xa9j\xc3\xa0.doc,,manualNormalization/preservation/d\xc3\xa9j\xc3\xa0.pdf
+
+report.doc,manualNormalization/access/report.pdf,
+"""
+
+
+def _write_csv(sip, contents):
+    mn = sip.join('objects', 'manualNormalization')
+    mn.ensure(dir=True)
+    mn.join('normalization.csv').write(contents, mode='wb')
+    return mn.join('normalization.csv')
+
+
+def test_manual_normalization_index_lookups(tmpdir):
+    _write_csv(tmpdir, CSV)
+    index = fileOperations.getManualNormalizationIndex(str(tmpdir))
+
+    # The first row for a name is the one used
+    assert index.normalizedFiles('image.tif') == ('manualNormalization/access/image.jpg', 'manualNormalization/preservation/image.tif')
+    assert index.normalizedFiles('d\xc3\xa9j\xc3\xa0.doc') == ('', 'manualNormalization/preservation/d\xc3\xa9j\xc3\xa0.pdf')
+    assert index.normalizedFiles('missing.doc') is None
+    assert index.originalOf('access', 'manualNormalization/access/other.jpg') == 'image.tif'
+    assert index.originalOf('preservation', 'manualNormalization/preservation/d\xc3\xa9j\xc3\xa0.pdf') == 'd\xc3\xa9j\xc3\xa0.doc'
+    assert index.originalOf('preservation', 'manualNormalization/access/report.pdf') is None
+
+
+def test_manual_normalization_index_is_saved_and_follows_the_csv(tmpdir):
+    assert fileOperations.getManualNormalizationIndex(str(tmpdir)) is None
+
+    csv_file = _write_csv(tmpdir, CSV)
+    fileOperations.getManualNormalizationIndex(str(tmpdir))
+    index_path = str(tmpdir.join(fileOperations.MANUAL_NORMALIZATION_INDEX))
+    saved = fileOperations.ManualNormalizationIndex.load(index_path)
+    assert saved.originalOf('access', 'manualNormalization/access/report.pdf') == 'report.doc'
+
+    csv_file.write('report.doc,manualNormalization/access/report.html,\n')
+    os.utime(str(csv_file), (0, 0))
+    index = fileOperations.getManualNormalizationIndex(str(tmpdir))
+    assert index.normalizedFiles('image.tif') is None
+    assert index.normalizedFiles('report.doc') == ('manualNormalization/access/report.html', '')
+
+
+def test_manual_normalization_index_reports_bad_rows(tmpdir):
+    _write_csv(tmpdir, 'image.tif,image.jpg\n')
+    with pytest.raises(csv.Error):
+        fileOperations.getManualNormalizationIndex(str(tmpdir))
@@ -0,0 +1,134 @@
+# -*- coding: UTF-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append("/usr/lib/archivematica/archivematicaCommon")
+import storageService
+
+sys.path.append("/usr/share/archivematica/dashboard")
+from main.models import DashboardSetting
+
+from django.test import TestCase
+import pytest
+import slumber
+
+
+class TestStorageServiceClient(TestCase):
+
+    def setUp(self):
+        storageService.clear_cache()
+        DashboardSetting.objects.create(name='storage_service_url', value='http://ss.example.com:8000')
+        DashboardSetting.objects.create(name='storage_service_user', value='demo')
+        DashboardSetting.objects.create(name='storage_service_apikey', value='key')
+        DashboardSetting.objects.create(name='dashboard_uuid', value='dd7d5df8-bb4e-4c1f-a81f-e0e55ccbc8d1')
+
+    def tearDown(self):
+        storageService.clear_cache()
+
+    def test_api_and_settings_are_reused(self):
+        api = storageService._storage_api()
+        assert api._store['base_url'] == 'http://ss.example.com:8000/api/v2/'
+        assert api._store['session'].auth.username == 'demo'
+        with self.assertNumQueries(0):
+            assert storageService._storage_api() is api
+            assert storageService._storage_api_params() == 'username=demo&api_key=key'
+
+    def test_api_follows_changed_settings(self):
+        api = storageService._storage_api()
+        DashboardSetting.objects.filter(name='storage_service_url').update(value='http://other.example.com/')
+        storageService.clear_cache()
+        new_api = storageService._storage_api()
+        assert new_api is not api
+        assert new_api._store['base_url'] == 'http://other.example.com/api/v2/'
+        # The HTTP session, and its connections, are kept
+        assert new_api._store['session'] is api._store['session']
+
+    def test_extract_file_url_quotes_the_path(self):
+        url = storageService.extract_file_url('uuid', u'objects/a&b #1+%20 caf\xe9.txt')
+        assert url == ('http://ss.example.com:8000/api/v2/file/uuid/extract_file/'
+                       '?relative_path_to_file=objects%2Fa%26b+%231%2B%2520+caf%C3%A9.txt&username=demo&api_key=key')
+
+    def test_locations_are_cached(self):
+        calls = []
+
+        def fetch_locations(path, purpose, space):
+            calls.append(purpose)
+            if purpose == 'missing':
+                return None
+            return [{'uuid': 'location-uuid', 'purpose': purpose}]
+
+        fetch = storageService._fetch_locations
+        storageService._fetch_locations = fetch_locations
+        try:
+            locations = storageService.get_location(purpose='BL')
+            # Changing the result doesn't change what's cached
+            locations[0]['uuid'] = 'changed'
+            assert storageService.get_location(purpose='BL') == [{'uuid': 'location-uuid', 'purpose': 'BL'}]
+            storageService.get_location(purpose='CP')
+            # Failures aren't cached
+            assert storageService.get_location(purpose='missing') is None
+            assert storageService.get_location(purpose='missing') is None
+        finally:
+            storageService._fetch_locations = fetch
+        assert calls == ['BL', 'CP', 'missing', 'missing']
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.url = 'http://ss.example.com:8000/api/v2/file/uuid/extract_file/'
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class TestExtractFile(TestCase):
+
+    def setUp(self):
+        storageService.clear_cache()
+        self.tmpdir = tempfile.mkdtemp()
+        self.save_path = os.path.join(self.tmpdir, 'METS.xml')
+        self.requests = []
+        self.stream_file = storageService.stream_file
+        storageService.stream_file = self.fake_stream_file
+
+    def tearDown(self):
+        storageService.stream_file = self.stream_file
+        shutil.rmtree(self.tmpdir)
+        storageService.clear_cache()
+
+    def fake_stream_file(self, url, headers=None):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+    def test_extract_file_writes_chunks(self):
+        response = FakeResponse(200, 'x' * (storageService.DOWNLOAD_CHUNK_SIZE + 10))
+        self.responses = [response]
+        storageService.extract_file('uuid', 'METS.xml', self.save_path)
+        assert os.path.getsize(self.save_path) == storageService.DOWNLOAD_CHUNK_SIZE + 10
+        assert self.requests == [{}]
+        assert response.closed
+
+    def test_extract_file_resumes(self):
+        with open(self.save_path, 'w') as f:
+            f.write('<mets>')
+        self.responses = [FakeResponse(206, '</mets>'), FakeResponse(416, '')]
+        storageService.extract_file('uuid', 'METS.xml', self.save_path, resume=True)
+        storageService.extract_file('uuid', 'METS.xml', self.save_path, resume=True)
+        with open(self.save_path) as f:
+            assert f.read() == '<mets></mets>'
+        assert self.requests == [{'Range': 'bytes=6-'}, {'Range': 'bytes=13-'}]
+
+    def test_extract_file_raises_on_errors(self):
+        self.responses = [FakeResponse(404, 'Not found')]
+        with pytest.raises(slumber.exceptions.HttpClientError):
+            storageService.extract_file('uuid', 'METS.xml', self.save_path)
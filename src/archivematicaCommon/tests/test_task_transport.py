@@ -0,0 +1,97 @@
+import cPickle
+import Queue
+import threading
+
+import pytest
+
+import taskTransport
+
+
+def _start_worker(client, handler):
+    worker = taskTransport.createTaskWorker('local', '%s:%s' % client.address, 'secret')
+    worker.set_client_id('test_1')
+    worker.register_task('echo', handler)
+
+    def work():
+        # Until the client goes away at exit
+        try:
+            worker.work(poll_timeout=0.1)
+        except taskTransport.ServerUnavailable:
+            pass
+
+    t = threading.Thread(target=work)
+    t.daemon = True
+    t.start()
+
+
+def test_local_transport_runs_tasks_and_calls_back():
+    client = taskTransport.createTaskClient('local', 'localhost:0', 'secret')
+    results = Queue.Queue()
+
+    def echo(worker, job):
+        data = cPickle.loads(job.data)
+        return cPickle.dumps({'client': worker.worker_client_id, 'unique': job.unique, 'arguments': data['arguments']})
+
+    _start_worker(client, echo)
+    client.submit('Echo', {'arguments': 'one'}, 'task-1', results.put)
+    client.submit('echo', {'arguments': 'two'}, 'task-2', results.put)
+
+    received = sorted([results.get(timeout=10), results.get(timeout=10)])
+    assert received == [
+        taskTransport.TaskResult('task-1', {'client': 'test_1', 'unique': 'task-1', 'arguments': 'one'}, None),
+        taskTransport.TaskResult('task-2', {'client': 'test_1', 'unique': 'task-2', 'arguments': 'two'}, None),
+    ]
+
+
+def test_local_transport_reports_failed_tasks():
+    client = taskTransport.createTaskClient('local', 'localhost:0', 'secret')
+    results = Queue.Queue()
+
+    def broken(worker, job):
+        raise ValueError('broken')
+
+    _start_worker(client, broken)
+    client.submit('echo', {}, 'task-1', results.put)
+
+    assert results.get(timeout=10) == taskTransport.TaskResult('task-1', None, 'failed!')
+
+
+def test_local_queue_requeues_tasks_of_lost_connections():
+    completed = []
+    tasks = taskTransport.LocalTaskQueue(lambda callback, result: completed.append((callback, result)))
+    tasks.put('echo', cPickle.dumps({}), 'task-1', 'callback-1')
+    tasks.put('echo', cPickle.dumps({}), 'task-2', 'callback-2')
+
+    # An MCPClient takes task-1 through its connection, then goes away
+    taken = []
+    t = threading.Thread(target=lambda: taken.append(tasks.get(['echo'], 0)))
+    t.start()
+    t.join()
+    assert taken[0][1] == 'task-1'
+
+    # task-1 is handed out again, before task-2; tasks held by connections
+    # still open are not
+    assert tasks.get(['echo'], 0)[1] == 'task-1'
+    assert tasks.get(['echo'], 0)[1] == 'task-2'
+    assert tasks.get(['echo'], 0) is None
+
+    tasks.complete('task-1', cPickle.dumps('done'))
+    tasks.fail('task-2')
+    assert completed == [
+        ('callback-1', taskTransport.TaskResult('task-1', 'done', None)),
+        ('callback-2', taskTransport.TaskResult('task-2', None, 'failed!')),
+    ]
+    assert tasks.running == {}
+
+
+def test_local_transport_needs_a_secret():
+    for authkey in (None, ''):
+        with pytest.raises(ValueError):
+            taskTransport.createTaskClient('local', 'localhost:0', authkey)
+        with pytest.raises(ValueError):
+            taskTransport.createTaskWorker('local', 'localhost:4731', authkey)
+
+
+def test_unknown_transport():
+    with pytest.raises(ValueError):
+        taskTransport.createTaskClient('carrier pigeon', 'localhost:4730')
@@ -95,6 +95,11 @@ class StorageSettingsForm(SettingsForm):
         help_text='API key of the storage service user. E.g. 45f7684483044809b2de045ba59dc876b11b9810'
     )
 
+    def save(self, *args, **kwargs):
+        super(StorageSettingsForm, self).save(*args, **kwargs)
+        # Don't keep using the old settings until they expire
+        storage_service.clear_cache()
+
 class ChecksumSettingsForm(SettingsForm):
     CHOICES = (
         ('md5', 'MD5'),
@@ -31,6 +31,7 @@ from django.http import Http404, HttpResponseNotAllowed, HttpResponseRedirect
 from django.shortcuts import redirect, render
 from django.template import RequestContext
 
+from contrib.mcp.client import MCPClient
 from main import forms
 from main import models
 from components.administration.forms import AtomDipUploadSettingsForm
@@ -58,6 +59,15 @@ logger = logging.getLogger('archivematica.dashboard')
 def administration(request):
     return redirect('components.administration.views_processing.list')
 
+
+def _reload_workflow():
+    """ MCPServer caches the workflow tables; tell it that one was edited. """
+    try:
+        MCPClient().reload_workflow()
+    except Exception:
+        logger.warning('Unable to ask MCPServer to reload the workflow', exc_info=True)
+
+
 def failure_report(request, report_id=None):
     if report_id != None:
         report = models.Report.objects.get(pk=report_id)
@@ -109,6 +119,7 @@ def atom_dips(request):
         arguments = ' '.join(opts)
         upload_setting.arguments = arguments
         upload_setting.save()
+        _reload_workflow()
 
         form.save()
         messages.info(request, 'Saved.')
@@ -153,6 +164,7 @@ def administration_as_dips(request):
             new_mscrDic.replacementdic = str(settings)
             logger.debug('New: %s', (new_mscrDic.replacementdic,))
             new_mscrDic.save()
+            _reload_workflow()
             logger.debug('Done')
             messages.info(request, 'Saved.')
     else:
@@ -256,6 +268,7 @@ def administration_atk_dips(request):
             new_mscrDic.replacementdic = str(settings)
             logger.debug('New: %s', new_mscrDic.replacementdic)
             new_mscrDic.save()
+            _reload_workflow()
             messages.info(request, 'Saved.')
     else:
         form = ArchivistsToolkitConfigForm(instance=atk)
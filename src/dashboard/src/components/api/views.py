@@ -34,6 +34,7 @@ from tastypie.authentication import ApiKeyAuthentication
 
 # This project, alphabetical
 import archivematicaFunctions
+import databaseFunctions
 from contrib.mcp.client import MCPClient
 from components.filesystem_ajax import views as filesystem_ajax_views
 from components.unit import views as unit_views
@@ -77,32 +78,34 @@ def get_unit_status(unit_uuid, unit_type):
     SIP UUID is populated only if the unit_type was unitTransfer and status is
     COMPLETE.  Otherwise, it is None.
 
+    The status is read from the unit's UnitStatus, which MCPServer keeps up to
+    date; it is worked out from the unit's jobs if there is none yet.
+
     :param str unit_uuid: UUID of the SIP or Transfer
     :param str unit_type: unitSIP or unitTransfer
     :return: Dict with status info.
     """
-    ret = {}
-    job = models.Job.objects.filter(sipuuid=unit_uuid).filter(unittype=unit_type).order_by('-createdtime', '-createdtimedec')[0]
-    ret['microservice'] = job.jobtype
-    if job.currentstep == 'Awaiting decision':
-        ret['status'] = 'USER_INPUT'
-    elif 'failed' in job.microservicegroup.lower():
-        ret['status'] = 'FAILED'
-    elif 'reject' in job.microservicegroup.lower():
-        ret['status'] = 'REJECTED'
-    elif job.jobtype == 'Remove the processing directory':  # Done storing AIP
-        ret['status'] = 'COMPLETE'
-    elif models.Job.objects.filter(sipuuid=unit_uuid).filter(jobtype='Create SIP from transfer objects').exists():
-        ret['status'] = 'COMPLETE'
-        # Get SIP UUID
-        sips = models.File.objects.filter(transfer_id=unit_uuid, sip__isnull=False).values('sip').distinct()
-        if sips:
-            ret['sip_uuid'] = sips[0]['sip']
-    elif models.Job.objects.filter(sipuuid=unit_uuid).filter(jobtype='Move transfer to backlog').exists():
-        ret['status'] = 'COMPLETE'
-        ret['sip_uuid'] = 'BACKLOG'
-    else:
-        ret['status'] = 'PROCESSING'
+    unit_status = models.UnitStatus.objects.filter(unit_uuid=unit_uuid, unit_type=unit_type).first()
+    if unit_status is None:
+        unit_status = databaseFunctions.refreshUnitStatus(unit_uuid, unit_type)
+    if unit_status is None:
+        # No jobs have been run for it yet
+        return {'status': models.UnitStatus.PROCESSING, 'microservice': None}
+
+    ret = {
+        'status': unit_status.status,
+        'microservice': unit_status.microservice,
+    }
+    if unit_status.status == models.UnitStatus.COMPLETE and unit_status.sip_uuid is not None:
+        if unit_status.sip_uuid == '':
+            # The SIP was not created yet when MCPServer last updated the status
+            sip_uuid = models.File.objects.filter(transfer_id=unit_uuid, sip__isnull=False) \
+                .values_list('sip', flat=True).first()
+            if sip_uuid:
+                models.UnitStatus.objects.filter(pk=unit_status.pk, sip_uuid='').update(sip_uuid=sip_uuid)
+                ret['sip_uuid'] = sip_uuid
+        else:
+            ret['sip_uuid'] = unit_status.sip_uuid
 
     return ret
 
@@ -255,12 +258,20 @@ def completed_transfers(request):
 
         GET /api/transfer/completed?username=<am-username>&api_key=<am-api-key>
 
+    With `since=<UNIX timestamp>`, only those completed since then are
+    returned.
     """
     if request.method == 'GET':
         auth_error = authenticate_request(request)
         response = {}
         if auth_error is None:
-            completed = _completed_units(unit_type='transfer')
+            try:
+                since = _since(request)
+            except (ValueError, OverflowError):
+                response['message'] = 'Invalid since parameter: %s' % request.GET['since']
+                response['error'] = True
+                return helpers.json_response(response, status_code=400)
+            completed = _completed_units(unit_type='transfer', since=since)
             response['results'] = completed
             response['message'] = 'Fetched completed transfers successfully.'
             return helpers.json_response(response)
@@ -277,12 +288,20 @@ def completed_ingests(request):
 
         GET /api/ingest/completed?username=<am-username>&api_key=<am-api-key>
 
+    With `since=<UNIX timestamp>`, only those completed since then are
+    returned.
     """
     if request.method == 'GET':
         auth_error = authenticate_request(request)
         response = {}
         if auth_error is None:
-            completed = _completed_units(unit_type='ingest')
+            try:
+                since = _since(request)
+            except (ValueError, OverflowError):
+                response['message'] = 'Invalid since parameter: %s' % request.GET['since']
+                response['error'] = True
+                return helpers.json_response(response, status_code=400)
+            completed = _completed_units(unit_type='ingest', since=since)
             response['results'] = completed
             response['message'] = 'Fetched completed ingests successfully.'
             return helpers.json_response(response)
@@ -294,19 +313,32 @@ def completed_ingests(request):
         return django.http.HttpResponseNotAllowed(permitted_methods=['GET'])
 
 
-def _completed_units(unit_type='transfer'):
+def _since(request):
+    """
+    Returns the datetime of the `since` GET parameter of `request`, a UNIX
+    timestamp, or None if it has none. Raises ValueError or OverflowError if
+    it is invalid.
+    """
+    since = request.GET.get('since')
+    if not since:
+        return None
+    return helpers.datetime_from_epoch(float(since))
+
+
+def _completed_units(unit_type='transfer', since=None):
     """Return all completed units of type `unit_type`, one of 'transfer' or
-    'ingest'.
+    'ingest', optionally only those completed since the datetime `since`.
     """
     model_name = {'transfer': 'Transfer', 'ingest': 'SIP'}.get(unit_type)
     model = getattr(models, model_name)
-    completed = []
-    units = model.objects.filter(hidden=False)
-    for unit in units:
-        status = get_unit_status(unit.uuid, 'unit{0}'.format(model_name))
-        if status.get('status') == 'COMPLETE':
-            completed.append(unit.uuid)
-    return completed
+    completed = models.UnitStatus.objects.filter(
+        unit_type='unit{0}'.format(model_name),
+        status=models.UnitStatus.COMPLETE,
+        unit_uuid__in=model.objects.filter(hidden=False).values('uuid'),
+    )
+    if since is not None:
+        completed = completed.filter(updated__gte=since)
+    return list(completed.order_by('updated').values_list('unit_uuid', flat=True))
 
 
 def unapproved_transfers(request):
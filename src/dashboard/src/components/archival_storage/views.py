@@ -265,12 +265,12 @@ def create_aic(request, *args, **kwargs):
             }
         }
         es_client = elasticSearchFunctions.get_client()
-        results = es_client.search(
+        results = elasticSearchFunctions.iter_search_results(
+            es_client,
             body=query,
             index='aips',
             doc_type='aip',
             fields='uuid,name',
-            size=elasticSearchFunctions.MAX_QUERY_SIZE,  # return all records
         )
 
         # Create files in staging directory with AIP information
@@ -293,7 +293,7 @@ def create_aic(request, *args, **kwargs):
         databaseFunctions.createSIP(mcp_destination, UUID=temp_uuid, sip_type='AIC')
 
         # Create files with filename = AIP UUID, and contents = AIP name
-        for aip in results['hits']['hits']:
+        for aip in results:
             filepath = os.path.join(destination, aip['fields']['uuid'][0])
             with open(filepath, 'w') as f:
                 os.chmod(filepath, 0o660)
@@ -342,7 +342,7 @@ def aip_file_download(request, uuid):
     )
 
     redirect_url = storage_service.extract_file_url(aip['fields']['uuid'][0], file_relative_path)
-    return helpers.stream_file_from_storage_service(redirect_url, 'Storage service returned {}; check logs?')
+    return helpers.stream_file_from_storage_service(redirect_url, 'Storage service returned {}; check logs?', request=request)
 
 
 def aip_pointer_file_download(request, uuid):
@@ -465,13 +465,14 @@ def list_display(request):
             }
         }
     }
-    deleted_aip_results = es_client.search(
+    deleted_aip_results = elasticSearchFunctions.iter_search_results(
+        es_client,
         body=query,
         index='aips',
         doc_type='aip',
         fields='uuid,status'
     )
-    for deleted_aip in deleted_aip_results['hits']['hits']:
+    for deleted_aip in deleted_aip_results:
         aips_deleted_or_pending_deletion.append(deleted_aip['fields']['uuid'][0])
 
     # Fetch results and paginate
@@ -57,14 +57,15 @@ def check_and_remove_deleted_transfers(es_client):
         }
     }
 
-    deletion_pending_results = es_client.search(
+    deletion_pending_results = elasticSearchFunctions.iter_search_results(
+        es_client,
         body=query,
         index='transfers',
         doc_type='transfer',
         fields='uuid,status'
     )
 
-    for hit in deletion_pending_results['hits']['hits']:
+    for hit in deletion_pending_results:
         transfer_uuid = hit['fields']['uuid'][0]
 
         api_results = storage_service.get_file_info(uuid=transfer_uuid)
@@ -244,4 +245,4 @@ def download(request, uuid):
     :param uuid: UUID for the transfer we're downloading the package from
     :return: Respond with a TAR'd version of the requested package
     """
-    return helpers.stream_file_from_storage_service(storage_service.download_file_url(uuid))
+    return helpers.stream_file_from_storage_service(storage_service.download_file_url(uuid), request=request)
@@ -24,7 +24,9 @@ import shutil
 import tempfile
 import uuid
 
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import CharField, Value
+from django.db.models.functions import Concat, Substr
 import django.http
 import django.template.defaultfilters
 
@@ -49,6 +51,9 @@ ORIGINAL_DIR = os.path.join(SHARED_DIRECTORY_ROOT, 'www', 'AIPsStore', 'transfer
 DEFAULT_BACKLOG_PATH = 'originals/'
 DEFAULT_ARRANGE_PATH = '/arrange/'
 
+# Rows inserted or updated per query by the arrange bulk operations
+ARRANGE_BATCH_SIZE = 500
+
 TRANSFER_TYPE_DIRECTORIES = {
     'standard': 'standardTransfer',
     'unzipped bag': 'baggitDirectory',
@@ -343,12 +348,13 @@ def create_arranged_sip(staging_sip_path, files, sip_uuid):
         sip.save()
 
     # Update currentLocation of files
+    currentlocations = {}
     for file_ in files:
         if file_.get('uuid'):
             # Strip 'arrange/sip_name' from file path
             in_sip_path = '/'.join(file_['destination'].split('/')[2:])
-            currentlocation = '%SIPDirectory%'+ in_sip_path
-            models.File.objects.filter(uuid=file_['uuid']).update(sip=sip_uuid, currentlocation=currentlocation)
+            currentlocations[file_['uuid']] = '%SIPDirectory%'+ in_sip_path
+    databaseFunctions.bulkUpdate(models.File, 'currentlocation', currentlocations, sip=sip_uuid)
 
     # Create directories for logs and metadata, if they don't exist
     for directory in ('logs', 'metadata', os.path.join('metadata', 'submissionDocumentation')):
@@ -460,21 +466,20 @@ def copy_from_arrange_to_completed_common(filepath, sip_uuid, sip_name):
             error = create_arranged_sip(staging_sip_path, files, sip_uuid)
 
         if error is None:
-            for arranged_entry in arrange:
+            relative_paths = {}
+            for entry_id, arrange_path in arrange.values_list('id', 'arrange_path'):
                 # Update arrange_path to be relative to new SIP's objects
                 # Use normpath to strip trailing / from directories
-                relative_path = arranged_entry.arrange_path.replace(filepath, '', 1)
+                relative_path = arrange_path.replace(filepath, '', 1)
                 if relative_path == 'objects/':
                     # If objects directory created manually, delete it as we
                     # don't want the LoD for it, and it's not needed elsewhere
-                    arranged_entry.delete()
+                    models.SIPArrange.objects.filter(id=entry_id).delete()
                     continue
                 relative_path = relative_path.replace('objects/', '', 1)
-                relative_path = os.path.normpath(relative_path)
-                arranged_entry.arrange_path = relative_path
-                arranged_entry.sip_id = sip_uuid
-                arranged_entry.sip_created = True
-                arranged_entry.save()
+                relative_paths[entry_id] = os.path.normpath(relative_path)
+            databaseFunctions.bulkUpdate(models.SIPArrange, 'arrange_path', relative_paths,
+                                         sip=sip_uuid, sip_created=True)
 
     if error is not None:
         response = {
@@ -537,21 +542,53 @@ def move_files_within_arrange(sourcepath, destination):
             # Strip the last folder off sourcepath, but leave a trailing /, so
             # we retain the folder name when we move the files.
             source_parent = '/'.join(sourcepath.split('/')[:-2])+'/'
-            for entry in folder_contents:
-                entry.arrange_path = entry.arrange_path.replace(source_parent,destination,1)
-                entry.save()
+            # Replace the source_parent prefix with destination in one query;
+            # SQL positions count characters, not bytes, and start at 1
+            if not isinstance(source_parent, unicode):
+                source_parent = source_parent.decode('utf-8')
+            folder_contents.update(arrange_path=Concat(
+                Value(destination),
+                Substr('arrange_path', len(source_parent) + 1),
+                output_field=CharField()))
         else:  # source is a file
             models.SIPArrange.objects.filter(arrange_path=sourcepath).update(arrange_path=destination+os.path.basename(sourcepath))
     else:  # destination is a file (this should have been caught by JS)
         raise ValueError('You cannot drag and drop onto a file.')
 
 
-def _get_arrange_directory_tree(backlog_uuid, original_path, arrange_path):
+def _get_backlog_file_metadata(relative_path, file_metadata):
+    """ Returns the Storage Service's information about the backlog file at
+    relative_path.
+
+    The Storage Service is asked for all the files of a transfer at once, and
+    they are kept in file_metadata, a dict of {transfer UUID: {relative path:
+    file information}}. Files whose transfer can't be told from their path,
+    or that the transfer's listing is missing, are fetched on their own.
+
+    :raises storage_service.ResourceNotFound: if there is no such file.
+    """
+    match = re.match(r'^[^/]*-(?P<uuid>[\w]{8}(-[\w]{4}){3}-[\w]{12})/', relative_path)
+    if match:
+        transfer_uuid = match.group('uuid')
+        if transfer_uuid not in file_metadata:
+            try:
+                files = storage_service.get_file_metadata(sipuuid=transfer_uuid)
+            except storage_service.ResourceNotFound:
+                files = []
+            file_metadata[transfer_uuid] = {f['relative_path']: f for f in files}
+        if relative_path in file_metadata[transfer_uuid]:
+            return file_metadata[transfer_uuid][relative_path]
+    return storage_service.get_file_metadata(relative_path=relative_path)[0]
+
+
+def _get_arrange_directory_tree(backlog_uuid, original_path, arrange_path, file_metadata=None):
     """ Fetches all the children of original_path from backlog_uuid and creates
     an identical tree in arrange_path.
 
     Helper function for copy_to_arrange.
     """
+    if file_metadata is None:
+        file_metadata = {}
     # TODO Use ElasticSearch, since that's where we're getting the original info from now?  Could be easier to get file UUID that way
     ret = []
     browse = storage_service.browse_location(backlog_uuid, original_path)
@@ -563,7 +600,7 @@ def _get_arrange_directory_tree(backlog_uuid, original_path, arrange_path):
             path = os.path.join(original_path, entry)
             relative_path = path.replace(DEFAULT_BACKLOG_PATH, '', 1)
             try:
-                file_info = storage_service.get_file_metadata(relative_path=relative_path)[0]
+                file_info = _get_backlog_file_metadata(relative_path, file_metadata)
             except storage_service.ResourceNotFound:
                 logger.warning('No file information returned from the Storage Service for file at relative_path: %s', relative_path)
                 raise
@@ -587,13 +624,15 @@ def _get_arrange_directory_tree(backlog_uuid, original_path, arrange_path):
                         'arrange_path': arrange_dir,
                         'file_uuid': None,
                         'transfer_uuid': None})
-            ret.extend(_get_arrange_directory_tree(backlog_uuid, original_dir, arrange_dir))
+            ret.extend(_get_arrange_directory_tree(backlog_uuid, original_dir, arrange_dir, file_metadata))
 
     return ret
 
 
-def copy_files_to_arrange(sourcepath, destination, fetch_children=False, backlog_uuid=None):
+def copy_files_to_arrange(sourcepath, destination, fetch_children=False, backlog_uuid=None, file_metadata=None):
     sourcepath = sourcepath.lstrip('/')  # starts with 'originals/', not '/originals/'
+    if file_metadata is None:
+        file_metadata = {}
     # Insert each file into the DB
 
     # Lots of error checking:
@@ -635,7 +674,7 @@ def copy_files_to_arrange(sourcepath, destination, fetch_children=False, backlog
             })
         if fetch_children:
             try:
-                to_add.extend(_get_arrange_directory_tree(backlog_uuid, sourcepath, arrange_path))
+                to_add.extend(_get_arrange_directory_tree(backlog_uuid, sourcepath, arrange_path, file_metadata))
             except storage_service.ResourceNotFound as e:
                 raise ValueError('Storage Service failed with the message: {}'.format(str(e)))
     else:
@@ -645,7 +684,7 @@ def copy_files_to_arrange(sourcepath, destination, fetch_children=False, backlog
             arrange_path = destination
         relative_path = sourcepath.replace(DEFAULT_BACKLOG_PATH, '', 1)
         try:
-            file_info = storage_service.get_file_metadata(relative_path=relative_path)[0]
+            file_info = _get_backlog_file_metadata(relative_path, file_metadata)
         except storage_service.ResourceNotFound:
             raise ValueError('No file information returned from the Storage Service for file at relative_path: {}'.format(relative_path))
         file_uuid = file_info.get('fileuuid')
@@ -659,20 +698,46 @@ def copy_files_to_arrange(sourcepath, destination, fetch_children=False, backlog
     logger.info('arrange_path: %s', arrange_path)
     logger.debug('files to be added: %s', to_add)
 
+    # Duplicate original_paths are skipped, since a file can only be in one
+    # SIP; look for the ones already arranged before inserting the rest
+    original_paths = [e['original_path'] for e in to_add if e['original_path'] is not None]
+    arranged = set()
+    for i in range(0, len(original_paths), ARRANGE_BATCH_SIZE):
+        arranged.update(models.SIPArrange.objects.filter(
+            original_path__in=original_paths[i:i + ARRANGE_BATCH_SIZE]
+        ).values_list('original_path', flat=True))
+    entries = []
     for entry in to_add:
+        if entry['original_path'] is not None:
+            if entry['original_path'] in arranged:
+                logger.info('Skipping already arranged: %s', entry)
+                continue
+            arranged.add(entry['original_path'])
+        entries.append(models.SIPArrange(
+            original_path=entry['original_path'],
+            arrange_path=entry['arrange_path'],
+            file_uuid=entry['file_uuid'],
+            transfer_uuid=entry['transfer_uuid'],
+        ))
+
+    for i in range(0, len(entries), ARRANGE_BATCH_SIZE):
+        batch = entries[i:i + ARRANGE_BATCH_SIZE]
         try:
-            # TODO enforce uniqueness on arrange panel?
-            models.SIPArrange.objects.create(
-                original_path=entry['original_path'],
-                arrange_path=entry['arrange_path'],
-                file_uuid=entry['file_uuid'],
-                transfer_uuid=entry['transfer_uuid'],
-            )
+            with transaction.atomic():
+                models.SIPArrange.objects.bulk_create(batch)
         except IntegrityError:
-            # FIXME Expecting this to catch duplicate original_paths, which
-            # we want to ignore since a file can only be in one SIP.  Needs
-            # to be updated not to ignore other classes of IntegrityErrors.
-            logger.exception('Integrity error inserting: %s', entry)
+            # Something was arranged in the meantime, insert the batch one
+            # by one to skip only the duplicates
+            for entry in batch:
+                try:
+                    # TODO enforce uniqueness on arrange panel?
+                    with transaction.atomic():
+                        entry.save()
+                except IntegrityError:
+                    # FIXME Expecting this to catch duplicate original_paths, which
+                    # we want to ignore since a file can only be in one SIP.  Needs
+                    # to be updated not to ignore other classes of IntegrityErrors.
+                    logger.exception('Integrity error inserting: %s', entry)
 
 
 def copy_to_arrange(request, sources=None, destinations=None, fetch_children=False):
@@ -725,11 +790,14 @@ def copy_to_arrange(request, sources=None, destinations=None, fetch_children=Fal
             {'error': True, 'message': '{} is not in base backlog path nor arrange path'.format(sources[0])}
         )
 
+    # Storage Service file information, shared by all the sources
+    file_metadata = {}
     try:
         for source, dest in zip(sources, destinations):
             if action == 'copy':
                 copy_files_to_arrange(source, dest,
-                    fetch_children=fetch_children, backlog_uuid=backlog_uuid)
+                    fetch_children=fetch_children, backlog_uuid=backlog_uuid,
+                    file_metadata=file_metadata)
                 response = {'message': 'Files added to the SIP.'}
                 status_code = 201
             elif action == 'move':
@@ -856,7 +924,7 @@ def download_ss(request):
     relative_path = filepath[filepath.find('/')+1:]
 
     redirect_url = storage_service.extract_file_url(transfer_uuid, relative_path)
-    return helpers.stream_file_from_storage_service(redirect_url, 'Storage service returned {}; check logs?')
+    return helpers.stream_file_from_storage_service(redirect_url, 'Storage service returned {}; check logs?', request=request)
 
 
 def download_fs(request):
@@ -892,4 +960,4 @@ def download_by_uuid(request, uuid):
         return helpers.json_response(response, status_code=404)
     relative_path = f.currentlocation.replace('%transferDirectory%', '')
     redirect_url = storage_service.extract_file_url(f.transfer_id, relative_path)
-    return helpers.stream_file_from_storage_service(redirect_url, 'Storage service returned {}; check logs?')
+    return helpers.stream_file_from_storage_service(redirect_url, 'Storage service returned {}; check logs?', request=request)
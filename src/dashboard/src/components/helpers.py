@@ -15,25 +15,36 @@
 # You should have received a copy of the GNU General Public License
 # along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
 
+import calendar
 import ConfigParser
+import datetime
+import itertools
 import logging
 import mimetypes
 import os
 import pprint
+import re
 import requests
 import urllib
 from urlparse import urljoin
 import json
+from lxml import etree
 
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.utils import timezone
 from django.utils.dateformat import format
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger, InvalidPage
 from django.core.urlresolvers import reverse
 from django.db.models import Max
 from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
-from django.core.servers.basehttp import FileWrapper
 from django.shortcuts import render
+from contrib.mcp.client import MCPClient
+from contrib import utils
 from main import models
 
+import storageService as storage_service
+
 logger = logging.getLogger('archivematica.dashboard')
 
 class AtomError(Exception):
@@ -147,21 +158,177 @@ def task_duration_in_seconds(task):
         duration = '< 1'
     return duration
 
+JOB_PRIORITIES = {
+    'completedUnsuccessfully': 0,
+    'requiresAprroval': 1,
+    'requiresApproval': 1,
+    'exeCommand': 2,
+    'verificationCommand': 3,
+    'completedSuccessfully': 4,
+    'cleanupSuccessfulCommand': 5,
+}
+
+def _job_priority(job):
+    return JOB_PRIORITIES.get(job.currentstep, 0)
+
 def get_jobs_by_sipuuid(uuid):
     jobs = models.Job.objects.filter(sipuuid=uuid,subjobof='').order_by('-createdtime', 'subjobof')
-    priorities = {
-        'completedUnsuccessfully': 0,
-        'requiresAprroval': 1,
-        'requiresApproval': 1,
-        'exeCommand': 2,
-        'verificationCommand': 3,
-        'completedSuccessfully': 4,
-        'cleanupSuccessfulCommand': 5,
-    }
-    def get_priority(job):
-        try: return priorities[job.currentstep]
-        except Exception: return 0
-    return sorted(jobs, key = get_priority) # key = lambda job: priorities[job.currentstep]
+    return sorted(jobs, key=_job_priority)
+
+# Jobs for which the dashboard shows the name of the file that failed
+NORMALIZATION_FAILED_JOB_TYPES = (
+    'Access normalization failed - copying',
+    'Preservation normalization failed - copying',
+    'thumbnail normalization failed - copying',
+)
+
+def _unit_model(unit_type):
+    return {'unitSIP': models.SIP, 'unitTransfer': models.Transfer}[unit_type]
+
+def _epoch(value):
+    return calendar.timegm(value.utctimetuple())
+
+def datetime_from_epoch(timestamp):
+    """
+    Returns the datetime of `timestamp`, in seconds since the epoch, aware or
+    naive as the USE_TZ setting requires. Raises ValueError or OverflowError
+    if it is out of range.
+    """
+    value = datetime.datetime.fromtimestamp(timestamp, timezone.utc)
+    if not django_settings.USE_TZ:
+        value = timezone.make_naive(value, timezone.utc)
+    return value
+
+def _mcp_choices():
+    """
+    Asks MCPServer for the jobs awaiting a decision.
+
+    Returns whether MCPServer could be reached, and a dict mapping the UUIDs
+    of the jobs awaiting a decision to a dict of {chain: description}.
+    """
+    try:
+        mcp_status = etree.XML(MCPClient().list())
+    except Exception:
+        return False, {}
+    choices = {}
+    for unit in mcp_status.findall('choicesAvailableForUnit'):
+        choices.setdefault(unit.findtext('UUID'), dict(
+            (choice.findtext('chainAvailable'), choice.findtext('description'))
+            for choice in unit.findall('choices/choice')))
+    return True, choices
+
+def _get_units_status(unit_type, since):
+    mcp_available, choices = _mcp_choices()
+    status = {'objects': [], 'mcp': mcp_available, 'cursor': since}
+
+    hidden_units = _unit_model(unit_type).objects.filter(hidden=True).values('uuid')
+    jobs = models.Job.objects.filter(unittype=unit_type, subjobof='') \
+        .exclude(sipuuid__icontains='None') \
+        .exclude(sipuuid__in=hidden_units)
+    if since is not None:
+        # Units change when a job is created or when one of their tasks
+        # finishes; the job's current step changes along with those.
+        since_time = datetime_from_epoch(since)
+        created = models.Job.objects.filter(unittype=unit_type, subjobof='', createdtime__gte=since_time) \
+            .values_list('sipuuid').annotate(latest=Max('createdtime'))
+        finished = models.Task.objects.filter(job__unittype=unit_type, job__subjobof='', endtime__gte=since_time) \
+            .values_list('job__sipuuid').annotate(latest=Max('endtime'))
+        changed = {}
+        for sip_uuid, latest in itertools.chain(created, finished):
+            changed[sip_uuid] = max(latest, changed.get(sip_uuid, latest))
+        if not changed:
+            return status
+        status['cursor'] = max(since, _epoch(max(changed.values())))
+        jobs = jobs.filter(sipuuid__in=changed.keys())
+
+    units = {}
+    for job in jobs.order_by('-createdtime', 'subjobof'):
+        units.setdefault(job.sipuuid, []).append(job)
+    if since is None and units:
+        status['cursor'] = _epoch(max(unit_jobs[0].createdtime for unit_jobs in units.values()))
+
+    failed_jobs = [job.jobuuid for unit_jobs in units.values() for job in unit_jobs
+                   if job.jobtype in NORMALIZATION_FAILED_JOB_TYPES]
+    filenames = {}
+    if failed_jobs:
+        filenames = dict(models.Task.objects.filter(job__in=failed_jobs).values_list('job', 'filename'))
+
+    for sip_uuid, unit_jobs in units.iteritems():
+        # Units are listed while they have jobs that aren't hidden
+        visible = [job.createdtime for job in unit_jobs if not job.hidden]
+        if not visible:
+            continue
+        unit_jobs = sorted(unit_jobs, key=_job_priority)
+        directory = utils.get_directory_name_from_job(unit_jobs)
+        if unit_type == 'unitTransfer':
+            directory = os.path.basename(directory)
+        item = {
+            'uuid': sip_uuid,
+            'id': sip_uuid,
+            'directory': directory,
+            'timestamp': _epoch(max(visible)),
+            'jobs': [],
+        }
+        for job in unit_jobs:
+            new_job = {
+                'uuid': job.jobuuid,
+                'type': job.jobtype,
+                'microservicegroup': job.microservicegroup,
+                'subjobof': job.subjobof,
+                'currentstep': job.currentstep,
+                'timestamp': '%d.%s' % (_epoch(job.createdtime), str(job.createdtimedec).split('.')[-1]),
+            }
+            # allow user to know name of file that has failed normalization
+            if job.jobuuid in filenames:
+                new_job['filename'] = filenames[job.jobuuid]
+            if job.jobuuid in choices:
+                new_job['choices'] = choices[job.jobuuid]
+            item['jobs'].append(new_job)
+        status['objects'].append(item)
+    status['objects'].sort(key=lambda item: item['timestamp'], reverse=True)
+    return status
+
+def get_units_status(unit_type, since=None, events=None):
+    """
+    Returns the status of the transfers or SIPs (`unit_type` is unitTransfer
+    or unitSIP) shown in the dashboard, as a dict with:
+
+    * objects: the units, each with its jobs in display order
+    * mcp: whether MCPServer could be reached
+    * cursor: the `since` value that will return the units changed from now on
+
+    Without `since` all units are returned, otherwise only those with a job
+    created or a task finished since then (seconds since the epoch).
+
+    The status is built with a fixed number of queries however many units
+    there are, and cached for STATUS_CACHE_TIMEOUT seconds so that dashboards
+    polling together share it. `events` is the position in MCPServer's event
+    log ("<log>:<sequence>") of the events the status is requested for, so
+    that a status cached before those events is not returned.
+    """
+    key = 'units_status:%s:%s:%s' % (unit_type, since, events)
+    status = cache.get(key)
+    if status is None:
+        status = _get_units_status(unit_type, since)
+        cache.set(key, status, django_settings.STATUS_CACHE_TIMEOUT)
+    return status
+
+def units_status_response(request, unit_type):
+    """ JSON response with get_units_status, for the `since` and `events` GET parameters. """
+    since = request.GET.get('since')
+    if since:
+        try:
+            since = int(float(since))
+            # Out of range timestamps would fail to convert later on
+            datetime_from_epoch(since)
+        except (ValueError, OverflowError):
+            return json_response({'error': True, 'message': 'Invalid since parameter: %s' % since}, 400)
+    else:
+        since = None
+    events = request.GET.get('events') or None
+    if events is not None and not re.match(r'^[0-9a-f-]+:\d+$', events):
+        return json_response({'error': True, 'message': 'Invalid events parameter: %s' % events}, 400)
+    return json_response(get_units_status(unit_type, since, events))
 
 def get_metadata_type_id_by_description(description):
     return models.MetadataAppliesToType.objects.get(description=description)
@@ -262,17 +429,68 @@ def send_file_or_return_error_response(request, filepath, content_type, verb='do
             'verb': verb
         })
 
+# Bytes sent at a time when streaming files
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def _parse_range(range_header, size):
+    """
+    Parse a Range header for a single range of bytes.
+
+    Returns (start, end) inclusive, None if the header is missing or isn't
+    a single byte range, or False if the range can't be satisfied.
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', (range_header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # The last `end` bytes
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+def _file_chunks(f, length):
+    """ Yield `length` bytes from `f` in chunks, closing it when done. """
+    try:
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
 def send_file(request, filepath):
     """
-    Send a file through Django without loading the whole file into
-    memory at once. The FileWrapper will turn the file object into an
-    iterator for chunks of 8KB.
+    Send a file through Django a chunk at a time, without loading the whole
+    file into memory. A Range header for a single range of bytes is honoured,
+    so interrupted downloads can be resumed.
     """
     filename = os.path.basename(filepath)
     extension = os.path.splitext(filepath)[1].lower()
-
-    wrapper = FileWrapper(file(filepath))
-    response = HttpResponse(wrapper)
+    size = os.path.getsize(filepath)
+
+    byte_range = _parse_range(request.META.get('HTTP_RANGE'), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return response
+
+    f = open(filepath, 'rb')
+    if byte_range:
+        start, end = byte_range
+        f.seek(start)
+        response = StreamingHttpResponse(_file_chunks(f, end - start + 1), status=206)
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        response['Content-Length'] = end - start + 1
+    else:
+        response = StreamingHttpResponse(_file_chunks(f, size))
+        response['Content-Length'] = size
+    response['Accept-Ranges'] = 'bytes'
 
     # force download for certain filetypes
     extensions_to_download = ['.7z', '.zip']
@@ -285,7 +503,6 @@ def send_file(request, filepath):
         mimetype = mimetypes.guess_type(filename)[0]
         response['Content-type'] = mimetype
 
-    response['Content-Length'] = os.path.getsize(filepath)
     return response
 
 def file_is_an_archive(file):
@@ -335,12 +552,38 @@ def processing_config_path():
         'sharedMicroServiceTasksConfigs/processingMCPConfigs'
     )
 
-def stream_file_from_storage_service(url, error_message='Remote URL returned {}'):
-    stream = requests.get(url, stream=True)
-    if stream.status_code == 200:
+# Headers of storage service responses that are passed on to the client
+PROXIED_HEADERS = ('Content-Length', 'Content-Range', 'Content-Encoding', 'Content-Disposition', 'Accept-Ranges', 'Last-Modified', 'ETag')
+
+def _response_chunks(stream):
+    """ Yield the body of a streaming requests Response as sent, closing it when done. """
+    try:
+        for chunk in stream.raw.stream(STREAM_CHUNK_SIZE, decode_content=False):
+            yield chunk
+    finally:
+        stream.close()
+
+def stream_file_from_storage_service(url, error_message='Remote URL returned {}', request=None):
+    """
+    Stream the file at `url` from the storage service to the client, a chunk
+    at a time.
+
+    If `request` is given, its Range header is passed on, so the client can
+    resume a download if the storage service supports it.
+    """
+    headers = {}
+    if request is not None and 'HTTP_RANGE' in request.META:
+        headers['Range'] = request.META['HTTP_RANGE']
+    stream = storage_service.stream_file(url, headers)
+    if stream.status_code in (200, 206):
         content_type = stream.headers.get('content-type', 'text/plain')
-        return StreamingHttpResponse(stream, content_type=content_type)
+        response = StreamingHttpResponse(_response_chunks(stream), status=stream.status_code, content_type=content_type)
+        for header in PROXIED_HEADERS:
+            if header in stream.headers:
+                response[header] = stream.headers[header]
+        return response
     else:
+        stream.close()
         response = {
             'success': False,
             'message': error_message.format(stream.status_code)
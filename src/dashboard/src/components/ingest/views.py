@@ -17,11 +17,8 @@
 
 # Standard library, alphabetical by import source
 import base64
-import calendar
 import cPickle
-import json
 import logging
-from lxml import etree
 import os
 import requests
 import shutil
@@ -33,7 +30,6 @@ import uuid
 from django.conf import settings as django_settings
 from django.contrib import messages
 from django.core.urlresolvers import reverse
-from django.db.models import Max
 from django.forms.models import modelformset_factory
 from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, redirect
@@ -45,7 +41,6 @@ from django.views.generic import View
 
 # This project, alphabetical by import source
 from contrib import utils
-from contrib.mcp.client import MCPClient
 from components import advanced_search
 from components import helpers
 from components import decorators
@@ -88,63 +83,7 @@ class SipsView(View):
         })
 
 def ingest_status(request, uuid=None):
-    # Equivalent to: "SELECT SIPUUID, MAX(createdTime) AS latest FROM Jobs WHERE unitType='unitSIP' GROUP BY SIPUUID
-    objects = models.Job.objects.filter(hidden=False, subjobof='').values('sipuuid').annotate(timestamp=Max('createdtime')).exclude(sipuuid__icontains = 'None').filter(unittype__exact = 'unitSIP')
-    mcp_available = False
-    try:
-        client = MCPClient()
-        mcp_status = etree.XML(client.list())
-        mcp_available = True
-    except Exception: pass
-    def encoder(obj):
-        items = []
-        for item in obj:
-            # Check if hidden (TODO: this method is slow)
-            if models.SIP.objects.is_hidden(item['sipuuid']):
-                continue
-            jobs = helpers.get_jobs_by_sipuuid(item['sipuuid'])
-            item['directory'] = utils.get_directory_name_from_job(jobs)
-            item['timestamp'] = calendar.timegm(item['timestamp'].timetuple())
-            item['uuid'] = item['sipuuid']
-            item['id'] = item['sipuuid']
-            del item['sipuuid']
-            item['jobs'] = []
-            for job in jobs:
-                newJob = {}
-                item['jobs'].append(newJob)
-
-                # allow user to know name of file that has failed normalization
-                if job.jobtype == 'Access normalization failed - copying' or job.jobtype == 'Preservation normalization failed - copying' or job.jobtype == 'thumbnail normalization failed - copying':
-                    task = models.Task.objects.get(job=job)
-                    newJob['filename'] = task.filename
-
-                newJob['uuid'] = job.jobuuid
-                newJob['type'] = job.jobtype
-                newJob['microservicegroup'] = job.microservicegroup
-                newJob['subjobof'] = job.subjobof
-                newJob['currentstep'] = job.currentstep
-                newJob['timestamp'] = '%d.%s' % (calendar.timegm(job.createdtime.timetuple()), str(job.createdtimedec).split('.')[-1])
-                try: mcp_status
-                except NameError: pass
-                else:
-                    xml_unit = mcp_status.xpath('choicesAvailableForUnit[UUID="%s"]' % job.jobuuid)
-                    if xml_unit:
-                        xml_unit_choices = xml_unit[0].findall('choices/choice')
-                        choices = {}
-                        for choice in xml_unit_choices:
-                            choices[choice.find("chainAvailable").text] = choice.find("description").text
-                        newJob['choices'] = choices
-            items.append(item)
-        return items
-
-    response = {}
-    response['objects'] = objects
-    response['mcp'] = mcp_available
-
-    return HttpResponse(
-        json.JSONEncoder(default=encoder).encode(response),
-        content_type='application/json'
-    )
+    return helpers.units_status_response(request, 'unitSIP')
 
 def ingest_sip_metadata_type_id():
     return helpers.get_metadata_type_id_by_description('SIP')
@@ -380,6 +319,8 @@ def _es_results_to_directory_tree(path, return_list, not_draggable=False):
     # Helper function for transfer_backlog
     # Paths MUST be input in sorted order
     # Otherwise the same directory might end up with multiple entries
+    # Only the last entry of each list is looked at, so the work per path
+    # depends on its depth, not on how many paths came before it
     parts = path.split('/', 1)
     if parts[0] in ('logs', 'metadata'):
         not_draggable = True
@@ -400,11 +341,9 @@ def _es_results_to_directory_tree(path, return_list, not_draggable=False):
         _es_results_to_directory_tree(others, this_node['children'],
             not_draggable=not_draggable)
 
-        # Generate count of all non-directory objects in this tree
-        object_count = sum(e['properties'].get('object count', 0) for e in this_node['children'])
-        object_count += len([e for e in this_node['children'] if not e.get('children')])
-
-        this_node['properties']['object count'] = object_count
+        # Count of all non-directory objects in this tree; each path adds one
+        this_node['properties']['object count'] += 1
+        object_count = this_node['properties']['object count']
         this_node['properties']['display_string'] = '{} objects'.format(object_count)
         # If any children of a dir are draggable, the whole dir should be
         # Otherwise, directories have the draggability of their first child
@@ -460,13 +399,14 @@ def _es_results_to_appraisal_tab_format(record, record_map, directory_list, not_
             # directory_list should consist only of top-level records
             if is_transfer:
                 directory_list.append(dir_record)
+            # Parents come first, so a directory is added to its parent's
+            # children only when it is created
+            if parent is not None:
+                parent['children'].append(dir_record)
+                parent['object_count'] += 1
         else:
             dir_record = record_map[node]
 
-        if parent is not None and dir_record not in parent['children']:
-            parent['children'].append(dir_record)
-            parent['object_count'] += 1
-
         parent = dir_record
 
     dir_parts = dir.split('/')
@@ -495,6 +435,19 @@ def _es_results_to_appraisal_tab_format(record, record_map, directory_list, not_
     record_map[dir]['object_count'] += 1
 
 
+def _arranged_backlog_paths():
+    """
+    Returns the set of backlog relative paths, as indexed in Elasticsearch,
+    of the files that have been copied into arrange.
+
+    SIPArrange.original_path is the relative path prefixed with the backlog
+    directory, e.g. originals/transfer-<uuid>/objects/file.jpg
+    """
+    original_paths = models.SIPArrange.objects.filter(
+        original_path__isnull=False).values_list('original_path', flat=True)
+    return set(path.split('/', 1)[-1] for path in original_paths)
+
+
 def transfer_backlog(request, ui):
     """
     AJAX endpoint to query for and return transfer backlog items.
@@ -511,6 +464,19 @@ def transfer_backlog(request, ui):
     if ui == 'appraisal' or request.GET.get('hidemetadatalogs'):
         backlog_filter = elasticSearchFunctions.BACKLOG_FILTER_NO_MD_LOGS
 
+    # The files of a single transfer can be asked for, to load the tree of
+    # each transfer when it is opened rather than all of them at once
+    transfer_uuid = request.GET.get('transfer_uuid')
+    if transfer_uuid:
+        backlog_filter = {
+            'bool': {
+                'must': [
+                    backlog_filter,
+                    {'term': {'sipuuid': transfer_uuid}},
+                ]
+            }
+        }
+
     if not 'query' in request.GET:
         query = elasticSearchFunctions.MATCH_ALL_QUERY.copy()
         query['filter'] = backlog_filter
@@ -530,21 +496,19 @@ def transfer_backlog(request, ui):
             logger.exception('Error accessing index.')
             return HttpResponse('Error accessing index.')
 
-    # perform search
+    # perform search, converting results into a more workable form
     try:
-        results = elasticSearchFunctions.search_all_results(
-            es_client,
-            body=query,
-            index='transfers',
-            doc_type='transferfile',
-        )
+        results = list(elasticSearchFunctions.augment_search_hits(
+            elasticSearchFunctions.iter_search_results(
+                es_client,
+                body=query,
+                index='transfers',
+                doc_type='transferfile',
+            )))
     except:
         logger.exception('Error accessing index.')
         return HttpResponse('Error accessing index.')
 
-    # Convert results into a more workable form
-    results = elasticSearchFunctions.augment_raw_search_results(results)
-
     # Convert to a form JS can use:
     # [{'name': <filename>,
     #   'properties': {'not_draggable': False}},
@@ -561,14 +525,12 @@ def transfer_backlog(request, ui):
     # ]
     return_list = []
     directory_map = {}
+    # If a path is in SIPArrange.original_path, then it shouldn't be draggable
+    arranged_paths = _arranged_backlog_paths()
     # _es_results_to_directory_tree requires that paths MUST be sorted
     results.sort(key=lambda x: x['relative_path'])
     for path in results:
-        # If a path is in SIPArrange.original_path, then it shouldn't be draggable
-        not_draggable = False
-        if models.SIPArrange.objects.filter(
-            original_path__endswith=path['relative_path']).exists():
-            not_draggable = True
+        not_draggable = path['relative_path'] in arranged_paths
         if ui == 'legacy':
             _es_results_to_directory_tree(path['relative_path'], return_list, not_draggable=not_draggable)
         else:
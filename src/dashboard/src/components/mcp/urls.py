@@ -21,4 +21,5 @@ from components.mcp import views
 urlpatterns = [
     url(r'execute/$', views.execute),
     url(r'list/$', views.list),
+    url(r'events/$', views.events),
 ]
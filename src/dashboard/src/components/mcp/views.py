@@ -15,10 +15,15 @@
 # You should have received a copy of the GNU General Public License
 # along with Archivematica.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+
 from django.http import HttpResponse
 from contrib.mcp.client import MCPClient
+from components import helpers
 from lxml import etree
 
+logger = logging.getLogger('archivematica.dashboard')
+
 def execute(request):
     result = ''
     if 'uuid' in request.REQUEST:
@@ -38,3 +43,22 @@ def list(request):
             response += etree.tostring(job)
     response = '<MCP>%s</MCP>' % response
     return HttpResponse(response, content_type='text/xml')
+
+def events(request):
+    """
+    JSON job events published by MCPServer since the `since` sequence number
+    of its event log `log`. Returns the whole log's sequence number and
+    complete=false, without events, when either GET parameter is missing or
+    outdated.
+    """
+    since = request.GET.get('since')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return helpers.json_response({'error': True, 'message': 'Invalid since parameter: %s' % since}, 400)
+    try:
+        response = MCPClient().events(since, request.GET.get('log'))
+    except Exception:
+        logger.exception('Error getting events from MCPServer')
+        return helpers.json_response({'error': True, 'message': 'Unable to connect to MCPServer'}, 503)
+    return helpers.json_response(response)
@@ -54,6 +54,24 @@ class MCPClient:
         elif completed_job_request.state == gearman.JOB_FAILED:
             raise RPCError("getJobsAwaitingApproval failed (check MCPServer logs)")
 
+    def events(self, since=None, log=None):
+        """
+        Job events published by MCPServer after sequence number `since` of its
+        event log `log`, as returned by MCPServer's EventLog.since().
+        """
+        gm_client = gearman.GearmanClient([self.server])
+        data = cPickle.dumps({"since": since, "log": log})
+        completed_job_request = gm_client.submit_job("getEvents", data, None)
+        if completed_job_request.state == gearman.JOB_COMPLETE:
+            return cPickle.loads(completed_job_request.result)
+        raise RPCError("getEvents failed (check MCPServer logs)")
+
+    def reload_workflow(self):
+        """Ask MCPServer to reload its copy of the workflow tables; doesn't wait for it."""
+        gm_client = gearman.GearmanClient([self.server])
+        gm_client.submit_job("reloadWorkflow", "", None, background=True)
+        gm_client.shutdown()
+
     def notifications(self):
         gm_client = gearman.GearmanClient([self.server])
         completed_job_request = gm_client.submit_job("getNotifications", "", None)
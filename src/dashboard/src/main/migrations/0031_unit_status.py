@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.utils import timezone
+
+
+def data_migration(apps, schema_editor):
+    """
+    Work out the status of the existing Transfers and SIPs from their jobs,
+    as databaseFunctions.refreshUnitStatus does.
+    """
+    Job = apps.get_model('main', 'Job')
+    File = apps.get_model('main', 'File')
+    UnitStatus = apps.get_model('main', 'UnitStatus')
+
+    completed = {}
+    for unit_uuid, jobtype in Job.objects.filter(jobtype__in=('Create SIP from transfer objects', 'Move transfer to backlog')).values_list('sipuuid', 'jobtype').distinct():
+        if jobtype == 'Create SIP from transfer objects' or unit_uuid not in completed:
+            completed[unit_uuid] = jobtype
+
+    now = timezone.now()
+    statuses = []
+    for model_name, unit_type in (('Transfer', 'unitTransfer'), ('SIP', 'unitSIP')):
+        for unit_uuid in apps.get_model('main', model_name).objects.values_list('uuid', flat=True):
+            job = Job.objects.filter(sipuuid=unit_uuid, unittype=unit_type).order_by('-createdtime', '-createdtimedec').first()
+            if job is None:
+                continue
+            sip_uuid = None
+            if completed.get(unit_uuid) == 'Create SIP from transfer objects':
+                sip_uuid = File.objects.filter(transfer_id=unit_uuid, sip__isnull=False).values_list('sip', flat=True).first() or ''
+            elif completed.get(unit_uuid) == 'Move transfer to backlog':
+                sip_uuid = 'BACKLOG'
+
+            if job.currentstep == 'Awaiting decision':
+                status = 'USER_INPUT'
+            elif 'failed' in job.microservicegroup.lower():
+                status = 'FAILED'
+            elif 'reject' in job.microservicegroup.lower():
+                status = 'REJECTED'
+            elif job.jobtype == 'Remove the processing directory' or sip_uuid is not None:
+                status = 'COMPLETE'
+            else:
+                status = 'PROCESSING'
+
+            statuses.append(UnitStatus(
+                unit_uuid=unit_uuid,
+                unit_type=unit_type,
+                status=status,
+                microservice=job.jobtype,
+                job_uuid=job.jobuuid,
+                sip_uuid=sip_uuid,
+                updated=now,
+            ))
+    UnitStatus.objects.bulk_create(statuses, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0030_rights_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnitStatus',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('unit_uuid', models.CharField(help_text=b'Semantically a foreign key to SIP or Transfer', max_length=36)),
+                ('unit_type', models.CharField(help_text=b"Same as the unittype of the unit's jobs, e.g. unitSIP or unitTransfer", max_length=50)),
+                ('status', models.CharField(default=b'PROCESSING', max_length=20, choices=[(b'FAILED', b'Failed'), (b'REJECTED', b'Rejected'), (b'USER_INPUT', b'Awaiting user input'), (b'COMPLETE', b'Complete'), (b'PROCESSING', b'Processing')])),
+                ('microservice', models.CharField(help_text=b'Type of the current job of the unit', max_length=250, blank=True)),
+                ('job_uuid', models.CharField(help_text=b'UUID of the current job of the unit', max_length=36, blank=True)),
+                ('sip_uuid', models.CharField(help_text=b'For a transfer, the UUID of the SIP created from it, "BACKLOG" if it was sent to backlog, or empty until the SIP is known', max_length=36, null=True, blank=True)),
+                ('updated', models.DateTimeField(help_text=b'When the status was last changed')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='unitstatus',
+            unique_together=set([('unit_uuid', 'unit_type')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='unitstatus',
+            index_together=set([('unit_type', 'status', 'updated')]),
+        ),
+        migrations.RunPython(data_migration),
+    ]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# Indexes including a text or blob column, by model, with the number of
+# characters of that column MySQL should index. MySQL can't index those
+# columns whole, and Django doesn't know how to create an index on a prefix of
+# one.
+TEXT_INDEXES = (
+    ('File', (('sip', 'currentlocation', 'removedtime'), ('transfer', 'currentlocation', 'removedtime')), 255),
+    ('UnitVariable', (('unituuid', 'unittype', 'variable'),), 100),
+)
+
+
+def create_text_indexes(apps, schema_editor):
+    for model_name, index_together, prefix_length in TEXT_INDEXES:
+        model = apps.get_model('main', model_name)
+        if schema_editor.connection.vendor != 'mysql':
+            schema_editor.alter_index_together(model, [], index_together)
+            continue
+        for field_names in index_together:
+            fields = [model._meta.get_field(field_name) for field_name in field_names]
+            columns = [field.column for field in fields]
+            schema_editor.execute('CREATE INDEX %s ON %s (%s)' % (
+                schema_editor.quote_name(schema_editor._create_index_name(model, columns, suffix='_idx')),
+                schema_editor.quote_name(model._meta.db_table),
+                ', '.join(
+                    schema_editor.quote_name(field.column) +
+                    ('(%d)' % prefix_length if isinstance(field, models.TextField) else '')
+                    for field in fields),
+            ))
+
+
+def drop_text_indexes(apps, schema_editor):
+    for model_name, index_together, _ in TEXT_INDEXES:
+        model = apps.get_model('main', model_name)
+        schema_editor.alter_index_together(model, index_together, [])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0031_unit_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='currentstep',
+            field=models.CharField(db_index=True, max_length=50, db_column=b'currentStep', blank=True),
+        ),
+        migrations.AlterField(
+            model_name='siparrange',
+            name='arrange_path',
+            field=models.CharField(max_length=255, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='endtime',
+            field=models.DateTimeField(default=None, null=True, db_column=b'endTime', db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('sipuuid', 'unittype', 'createdtime'), ('unittype', 'subjobof', 'createdtime')]),
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_text_indexes, drop_text_indexes),
+            ],
+            state_operations=[
+                migrations.AlterIndexTogether(
+                    name='file',
+                    index_together=set([('transfer', 'currentlocation', 'removedtime'), ('sip', 'currentlocation', 'removedtime')]),
+                ),
+                migrations.AlterIndexTogether(
+                    name='unitvariable',
+                    index_together=set([('unituuid', 'unittype', 'variable')]),
+                ),
+            ],
+        ),
+    ]
@@ -305,7 +305,7 @@ class Transfer(models.Model):
 class SIPArrange(models.Model):
     """ Information about arranged files: original and arranged location, current status. """
     original_path = models.CharField(max_length=255, null=True, blank=True, default=None, unique=True)
-    arrange_path = models.CharField(max_length=255)
+    arrange_path = models.CharField(max_length=255, db_index=True)
     file_uuid = UUIDField(auto=False, null=True, blank=True, default=None)
     transfer_uuid = UUIDField(auto=False, null=True, blank=True, default=None)
     sip = models.ForeignKey(SIP, to_field='uuid', null=True, blank=True, default=None)
@@ -360,6 +360,12 @@ class File(models.Model):
 
     class Meta:
         db_table = u'Files'
+        # Indexes including currentlocation are created with a prefix length
+        # on MySQL; see migration 0032_hot_query_indexes.
+        index_together = (
+            ('sip', 'currentlocation', 'removedtime'),
+            ('transfer', 'currentlocation', 'removedtime'),
+        )
 
     def __unicode__(self):
         return u'{uuid}: {originallocation} now at {currentlocation}'.format(
@@ -393,7 +399,7 @@ class Job(models.Model):
     directory = models.TextField(blank=True)
     sipuuid = models.CharField(max_length=36, db_column='SIPUUID')  # Foreign key to SIPs or Transfers
     unittype = models.CharField(max_length=50, db_column='unitType', blank=True)
-    currentstep = models.CharField(max_length=50, db_column='currentStep', blank=True)
+    currentstep = models.CharField(max_length=50, db_column='currentStep', blank=True, db_index=True)
     microservicegroup = models.CharField(max_length=50, db_column='microserviceGroup', blank=True)
     hidden = models.BooleanField(default=False)
     microservicechainlink = models.ForeignKey('MicroServiceChainLink', db_column='MicroServiceChainLinksPK', null=True, blank=True)
@@ -401,6 +407,10 @@ class Job(models.Model):
 
     class Meta:
         db_table = u'Jobs'
+        index_together = (
+            ('sipuuid', 'unittype', 'createdtime'),
+            ('unittype', 'subjobof', 'createdtime'),
+        )
 
 
 class Task(models.Model):
@@ -418,7 +428,7 @@ class Task(models.Model):
     # actually a `varbinary(1000)` in the database
     arguments = models.CharField(max_length=1000, blank=True)
     starttime = models.DateTimeField(db_column='startTime', null=True, default=None)
-    endtime = models.DateTimeField(db_column='endTime', null=True, default=None)
+    endtime = models.DateTimeField(db_column='endTime', null=True, default=None, db_index=True)
     client = models.CharField(max_length=50, blank=True)
     # stdout and stderror actually `longblobs` in the database
     stdout = models.TextField(db_column='stdOut', blank=True)
@@ -856,6 +866,43 @@ class UnitVariable(models.Model):
 
     class Meta:
         db_table = u'UnitVariables'
+        # Created with a prefix length for variable on MySQL; see migration
+        # 0032_hot_query_indexes.
+        index_together = (('unituuid', 'unittype', 'variable'),)
+
+
+class UnitStatus(models.Model):
+    """
+    The status of a unit (SIP or Transfer), as shown by the API, kept up to
+    date by MCPServer as the unit's jobs are created and completed so it
+    doesn't have to be worked out from all of the unit's jobs.
+
+    See databaseFunctions.updateUnitStatus.
+    """
+    FAILED = 'FAILED'
+    REJECTED = 'REJECTED'
+    USER_INPUT = 'USER_INPUT'
+    COMPLETE = 'COMPLETE'
+    PROCESSING = 'PROCESSING'
+    STATUS_CHOICES = (
+        (FAILED, 'Failed'),
+        (REJECTED, 'Rejected'),
+        (USER_INPUT, 'Awaiting user input'),
+        (COMPLETE, 'Complete'),
+        (PROCESSING, 'Processing'),
+    )
+
+    unit_uuid = models.CharField(max_length=36, help_text='Semantically a foreign key to SIP or Transfer')
+    unit_type = models.CharField(max_length=50, help_text='Same as the unittype of the unit\'s jobs, e.g. unitSIP or unitTransfer')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PROCESSING)
+    microservice = models.CharField(max_length=250, blank=True, help_text='Type of the current job of the unit')
+    job_uuid = models.CharField(max_length=36, blank=True, help_text='UUID of the current job of the unit')
+    sip_uuid = models.CharField(max_length=36, null=True, blank=True, help_text='For a transfer, the UUID of the SIP created from it, "BACKLOG" if it was sent to backlog, or empty until the SIP is known')
+    updated = models.DateTimeField(help_text='When the status was last changed')
+
+    class Meta:
+        unique_together = (('unit_uuid', 'unit_type'),)
+        index_together = (('unit_type', 'status', 'updated'),)
 
 
 # END MCP data interoperability
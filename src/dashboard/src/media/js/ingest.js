@@ -470,6 +470,7 @@ $(function()
 
     window.AppView = BaseAppView.extend({
       el: $('#sip-container'),
+      unitType: 'unitSIP',
       pagingCookie: 'archivematicaCurrentIngestPage'
     });
 
@@ -838,6 +838,23 @@ BaseAppView = Backbone.View.extend({
 
   idle: false,
 
+  // Each poll asks MCPServer for the job events published since the previous
+  // one, and only fetches the status when there are events about this tab's
+  // units (unitType), or when events may have been missed. Status requests
+  // only ask for the units changed since the previous one, except every
+  // fullPollEvery polls, which get every unit to drop the removed ones.
+  eventsUrl: '/mcp/events/',
+
+  eventLog: null,
+
+  eventSequence: null,
+
+  fullPollEvery: 12,
+
+  pollCount: 0,
+
+  cursor: null,
+
   initialize: function(options)
     {
       this.statusUrl = options.statusUrl;
@@ -1052,14 +1069,78 @@ BaseAppView = Backbone.View.extend({
     },
 
   poll: function(start)
+    {
+      var full = 0 === this.pollCount % this.fullPollEvery;
+
+      this.pollCount++;
+
+      $.ajax({
+        context: this,
+        dataType: 'json',
+        type: 'GET',
+        url: this.eventsUrl + '?' + new Date().getTime(),
+        data: null === this.eventLog ? {} : {log: this.eventLog, since: this.eventSequence},
+        success: function(response)
+          {
+            var unitType = this.unitType
+              , changed = !response.complete || _.any(response.events, function(event)
+                  {
+                    return event.unitType == unitType;
+                  });
+
+            this.eventLog = response.log;
+            this.eventSequence = response.sequence;
+
+            if (changed || full || getURLParameter('paged'))
+              {
+                this.pollStatus(start, full);
+              }
+            else
+              {
+                this.schedulePoll();
+              }
+          },
+        error: function()
+          {
+            // MCPServer can't be reached, the status will say so
+            this.pollStatus(start, full);
+          }
+      });
+    },
+
+  schedulePoll: function()
+    {
+      var self = this;
+
+      if (!self.idle)
+      {
+        setTimeout(function()
+          {
+            self.poll();
+          }, this.interval);
+      }
+    },
+
+  pollStatus: function(start, full)
     {
       this.firstPoll = undefined !== start;
 
+      full = full || null === this.cursor || getURLParameter('paged');
+
+      var data = full ? {} : {since: this.cursor};
+
+      // A status cached before the events just seen would hide them
+      if (null !== this.eventLog)
+        {
+          data.events = this.eventLog + ':' + this.eventSequence;
+        }
+
       $.ajax({
         context: this,
         dataType: 'json',
         type: 'GET',
         url: this.statusUrl + '?' + new Date().getTime(),
+        data: data,
         beforeSend: function()
           {
             window.statusWidget.startPoll();
@@ -1072,6 +1153,8 @@ BaseAppView = Backbone.View.extend({
           {
             var objects = response.objects;
 
+            this.cursor = response.cursor;
+
             if (getURLParameter('paged'))
               {
                 this.updateSips(objects);
@@ -1099,7 +1182,7 @@ BaseAppView = Backbone.View.extend({
               }
 
             // Delete sips
-            if (Sips.length > objects.length)
+            if (full && Sips.length > objects.length)
             {
               var unusedSips = Sips.reject(function(sip)
                   {
@@ -1121,17 +1204,9 @@ BaseAppView = Backbone.View.extend({
           },
         complete: function()
           {
-            var self = this;
-
             window.statusWidget.endPoll();
 
-            if (!self.idle)
-            {
-              setTimeout(function()
-                {
-                  self.poll();
-                }, this.interval);
-            }
+            this.schedulePoll();
           }
       });
     }
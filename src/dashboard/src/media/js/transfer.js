@@ -227,6 +227,7 @@ $(function()
 
     window.AppView = BaseAppView.extend({
       el: $('#sip-container'),
+      unitType: 'unitTransfer',
       pagingCookie: 'archivematicaCurrentTransferPage'
     });
 
@@ -282,12 +282,18 @@ else:
 MCP_SERVER = ('127.0.0.1', 4730) # localhost:4730
 POLLING_INTERVAL = 5 # Seconds
 STATUS_POLLING_INTERVAL = 5 # Seconds
+STATUS_CACHE_TIMEOUT = 3 # Seconds to share the transfer and ingest status between polls
 TASKS_PER_PAGE = 10 # for paging in tasks dialog
 UUID_REGEX = '[\w]{8}(-[\w]{4}){3}-[\w]{12}'
 
 FPR_URL = 'https://fpr.archivematica.org/fpr/api/v2/'
 FPR_VERIFY_CERT = True
 
+# Storage service client (archivematicaCommon/lib/storageService.py)
+STORAGE_SERVICE_CLIENT_TIMEOUT = 86400 # Seconds
+STORAGE_SERVICE_CLIENT_RETRIES = 3 # Connection attempts for idempotent requests
+STORAGE_SERVICE_CLIENT_CACHE_TTL = 60 # Seconds to reuse settings, pipeline and locations
+
 ALLOWED_HOSTS = ('*')
 MICROSERVICES_HELP = {
     'Approve transfer': 'Select "Approve transfer" to begin processing or "Reject transfer" to start over again.',
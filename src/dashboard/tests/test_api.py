@@ -0,0 +1,56 @@
+#!/usr/bin/env python2
+
+import calendar
+import datetime
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from components.api import views
+from main import models
+
+
+class TestCompletedUnits(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        for uuid, hidden, status, day in (
+                ('1b1e4fc8-6e9b-4f1b-8e3e-2a4e0f3b6a11', False, 'COMPLETE', 1),
+                ('2c2f5ad9-7fac-4a2c-9f4f-3b5f1a4c7b22', False, 'COMPLETE', 3),
+                ('3d3a6bea-8abd-4b3d-8a5a-4c6a2b5d8c33', True, 'COMPLETE', 3),
+                ('4e4b7cfb-9bce-4c4e-9b6b-5d7b3c6e9d44', False, 'PROCESSING', 3)):
+            models.Transfer.objects.create(uuid=uuid, hidden=hidden, currentlocation='%sharedPath%transfer/')
+            models.UnitStatus.objects.create(
+                unit_uuid=uuid, unit_type='unitTransfer', status=status,
+                updated=datetime.datetime(2016, 1, day, tzinfo=timezone.utc))
+
+    def test_completed_units(self):
+        with self.assertNumQueries(1):
+            completed = views._completed_units('transfer')
+        assert completed == ['1b1e4fc8-6e9b-4f1b-8e3e-2a4e0f3b6a11', '2c2f5ad9-7fac-4a2c-9f4f-3b5f1a4c7b22']
+        assert views._completed_units('ingest') == []
+
+    def test_completed_units_since(self):
+        since = datetime.datetime(2016, 1, 2, tzinfo=timezone.utc)
+        assert views._completed_units('transfer', since=since) == ['2c2f5ad9-7fac-4a2c-9f4f-3b5f1a4c7b22']
+
+        request = self.factory.get('/', {'since': str(calendar.timegm(since.utctimetuple()))})
+        assert views._since(request) == since
+        assert views._since(self.factory.get('/')) is None
+
+    def test_unit_status(self):
+        models.UnitStatus.objects.filter(unit_uuid='1b1e4fc8-6e9b-4f1b-8e3e-2a4e0f3b6a11').update(
+            microservice='Create SIP from transfer objects', sip_uuid='')
+        assert views.get_unit_status('1b1e4fc8-6e9b-4f1b-8e3e-2a4e0f3b6a11', 'unitTransfer') == {
+            'status': 'COMPLETE',
+            'microservice': 'Create SIP from transfer objects',
+        }
+
+        models.SIP.objects.create(uuid='5f5c8d0c-acdf-4d5f-8c7c-6e8c4d7fae55')
+        models.File.objects.create(uuid='6a6d9e1d-bde0-4e6a-9d8d-7f9d5e8abf66', transfer_id='1b1e4fc8-6e9b-4f1b-8e3e-2a4e0f3b6a11', sip_id='5f5c8d0c-acdf-4d5f-8c7c-6e8c4d7fae55')
+        status = views.get_unit_status('1b1e4fc8-6e9b-4f1b-8e3e-2a4e0f3b6a11', 'unitTransfer')
+        assert status['sip_uuid'] == '5f5c8d0c-acdf-4d5f-8c7c-6e8c4d7fae55'
+        with self.assertNumQueries(1):
+            assert views.get_unit_status('1b1e4fc8-6e9b-4f1b-8e3e-2a4e0f3b6a11', 'unitTransfer') == status
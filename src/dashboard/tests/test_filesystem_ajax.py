@@ -8,7 +8,9 @@ from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
 
+from components.filesystem_ajax import views
 from main import models
+import storageService as storage_service
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -147,3 +149,69 @@ class TestSIPArrange(TestCase):
         assert base64.b64encode('subsip') in response_dict['entries']
         assert base64.b64encode('newsip') in response_dict['entries']
         assert len(response_dict['entries']) == 2
+
+
+class TestArrangeBulkOperations(TestCase):
+
+    fixture_files = ['sip_arrange.json']
+    fixtures = [os.path.join(THIS_DIR, 'fixtures', p) for p in fixture_files]
+
+    transfer_uuid = 'a29e7e86-eca9-43b6-b059-6f23a9802dc8'
+
+    def setUp(self):
+        self.metadata_requests = []
+        self.browse_location = storage_service.browse_location
+        self.get_file_metadata = storage_service.get_file_metadata
+        storage_service.browse_location = self.fake_browse_location
+        storage_service.get_file_metadata = self.fake_get_file_metadata
+
+    def tearDown(self):
+        storage_service.browse_location = self.browse_location
+        storage_service.get_file_metadata = self.get_file_metadata
+
+    def fake_browse_location(self, uuid, path):
+        directory = 'originals/transfer-%s/' % self.transfer_uuid
+        if path == directory:
+            return {'entries': ['objects', 'logs'], 'directories': ['objects', 'logs']}
+        if path == directory + 'objects/':
+            return {'entries': ['a.jpg', 'b.jpg', 'processingMCP.xml'], 'directories': []}
+        raise AssertionError('Unexpected browse of %s' % path)
+
+    def fake_get_file_metadata(self, **kwargs):
+        self.metadata_requests.append(kwargs)
+        assert kwargs == {'sipuuid': self.transfer_uuid}
+        return [{'relative_path': 'transfer-%s/objects/%s' % (self.transfer_uuid, name),
+                 'fileuuid': uuid,
+                 'sipuuid': self.transfer_uuid}
+                for name, uuid in (('a.jpg', 'ae8d4290-fe52-4954-b72a-0f591bee2e2f'),
+                                   ('b.jpg', 'a4ec8a8e-c1a7-4e2d-9a2a-a0f3ff4a5d5d'))]
+
+    def test_copy_directory_to_arrange(self):
+        # One of the files is already arranged
+        models.SIPArrange.objects.create(
+            original_path='originals/transfer-%s/objects/b.jpg' % self.transfer_uuid,
+            arrange_path='/arrange/toplevel/b.jpg')
+        views.copy_files_to_arrange(
+            'originals/transfer-%s/' % self.transfer_uuid, '/arrange/toplevel/',
+            fetch_children=True, backlog_uuid='backlog-uuid')
+        assert self.metadata_requests == [{'sipuuid': self.transfer_uuid}]
+        added = models.SIPArrange.objects.filter(arrange_path__startswith='/arrange/toplevel/transfer/')
+        assert sorted(added.values_list('arrange_path', 'file_uuid')) == [
+            ('/arrange/toplevel/transfer/', None),
+            ('/arrange/toplevel/transfer/objects/', None),
+            ('/arrange/toplevel/transfer/objects/a.jpg', 'ae8d4290-fe52-4954-b72a-0f591bee2e2f'),
+        ]
+
+    def test_move_directory_within_arrange(self):
+        models.SIPArrange.objects.create(arrange_path=u'/arrange/newsip/objects/caf\xe9/')
+        views.move_files_within_arrange('/arrange/newsip/', '/arrange/toplevel/')
+        assert sorted(models.SIPArrange.objects.filter(arrange_path__startswith='/arrange/toplevel/newsip/')
+                      .values_list('arrange_path', flat=True)) == [
+            '/arrange/toplevel/newsip/',
+            '/arrange/toplevel/newsip/objects/',
+            u'/arrange/toplevel/newsip/objects/caf\xe9/',
+            '/arrange/toplevel/newsip/objects/evelyn_s_photo.jpg',
+            '/arrange/toplevel/newsip/objects/evelyn_s_second_photo/',
+            '/arrange/toplevel/newsip/objects/evelyn_s_second_photo/evelyn_s_second_photo.jpg',
+        ]
+        assert not models.SIPArrange.objects.filter(arrange_path__startswith='/arrange/newsip/').exists()
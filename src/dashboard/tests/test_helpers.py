@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+
+import calendar
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from components import helpers
+from main import models
+
+
+class TestSendFile(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'video.mkv')
+        with open(self.path, 'wb') as f:
+            f.write('0123456789')
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _send(self, range_header=None):
+        headers = {'HTTP_RANGE': range_header} if range_header else {}
+        return helpers.send_file(self.factory.get('/', **headers), self.path)
+
+    def test_sends_whole_file(self):
+        response = self._send()
+        assert response.status_code == 200
+        assert response.streaming
+        assert ''.join(response.streaming_content) == '0123456789'
+        assert response['Content-Length'] == '10'
+        assert response['Accept-Ranges'] == 'bytes'
+
+    def test_sends_ranges(self):
+        for range_header, content, content_range in (
+                ('bytes=2-5', '2345', 'bytes 2-5/10'),
+                ('bytes=7-', '789', 'bytes 7-9/10'),
+                ('bytes=-3', '789', 'bytes 7-9/10'),
+                ('bytes=8-20', '89', 'bytes 8-9/10')):
+            response = self._send(range_header)
+            assert response.status_code == 206
+            assert ''.join(response.streaming_content) == content
+            assert response['Content-Range'] == content_range
+            assert response['Content-Length'] == str(len(content))
+
+    def test_ignores_unsupported_ranges(self):
+        response = self._send('bytes=0-1,4-5')
+        assert response.status_code == 200
+        assert ''.join(response.streaming_content) == '0123456789'
+
+    def test_rejects_unsatisfiable_ranges(self):
+        response = self._send('bytes=10-')
+        assert response.status_code == 416
+        assert response['Content-Range'] == 'bytes */10'
+
+
+class TestUnitsStatus(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.mcp_choices = helpers._mcp_choices
+        helpers._mcp_choices = lambda: (True, {'job-2': {'chain-uuid': 'Approve'}})
+        self.sip = models.SIP.objects.create(uuid='b9a1c2c0-6e4f-4d5a-8b1f-0d3c2e1f4a5b', currentpath='%sharedPath%currentlyProcessing/images-b9a1c2c0-6e4f-4d5a-8b1f-0d3c2e1f4a5b/')
+        self.hidden_sip = models.SIP.objects.create(uuid='5d2a0e3c-1f4b-4c6d-9e8f-7a6b5c4d3e2f', hidden=True)
+        self.job(self.sip.uuid, 'job-1', datetime.datetime(2015, 1, 1, 10, 0, tzinfo=timezone.utc), currentstep='Completed successfully')
+        failed = self.job(self.sip.uuid, 'job-2', datetime.datetime(2015, 1, 1, 10, 5, tzinfo=timezone.utc), jobtype='Access normalization failed - copying')
+        models.Task.objects.create(taskuuid='task-2', job=failed, createdtime=failed.createdtime, filename='image.tif')
+        self.job(self.hidden_sip.uuid, 'job-3', datetime.datetime(2015, 1, 1, 9, 0, tzinfo=timezone.utc))
+
+    def tearDown(self):
+        helpers._mcp_choices = self.mcp_choices
+        cache.clear()
+
+    def job(self, sip_uuid, job_uuid, createdtime, **kwargs):
+        return models.Job.objects.create(
+            jobuuid=job_uuid, sipuuid=sip_uuid, unittype='unitSIP',
+            createdtime=createdtime, directory=self.sip.currentpath, **kwargs)
+
+    def test_lists_all_units(self):
+        with self.assertNumQueries(2):
+            status = helpers.get_units_status('unitSIP')
+        assert status['mcp'] is True
+        assert status['cursor'] == calendar.timegm((2015, 1, 1, 10, 5, 0))
+        assert [unit['uuid'] for unit in status['objects']] == [self.sip.uuid]
+        unit = status['objects'][0]
+        assert unit['directory'] == 'images'
+        assert unit['timestamp'] == status['cursor']
+        assert [job['uuid'] for job in unit['jobs']] == ['job-2', 'job-1']
+        assert unit['jobs'][0]['filename'] == 'image.tif'
+        assert unit['jobs'][0]['choices'] == {'chain-uuid': 'Approve'}
+        # Cached for the next poll
+        with self.assertNumQueries(0):
+            assert helpers.get_units_status('unitSIP') == status
+
+    def test_lists_changed_units(self):
+        cursor = helpers.get_units_status('unitSIP')['cursor']
+        with self.assertNumQueries(2):
+            status = helpers.get_units_status('unitSIP', cursor + 1)
+        assert status['objects'] == []
+        assert status['cursor'] == cursor + 1
+
+        # A finished task changes its unit
+        task = models.Task.objects.get(taskuuid='task-2')
+        task.endtime = datetime.datetime(2015, 1, 1, 10, 6, tzinfo=timezone.utc)
+        task.save()
+        with self.assertNumQueries(4):
+            status = helpers.get_units_status('unitSIP', cursor + 2)
+        assert [unit['uuid'] for unit in status['objects']] == [self.sip.uuid]
+        assert len(status['objects'][0]['jobs']) == 2
+        assert status['cursor'] == cursor + 60
+
+    def test_status_after_events_is_not_the_cached_one(self):
+        status = helpers.get_units_status('unitSIP', events='log-1:5')
+        self.job(self.sip.uuid, 'job-4', datetime.datetime(2015, 1, 1, 10, 10, tzinfo=timezone.utc))
+        # Dashboards that saw the same events share the status
+        with self.assertNumQueries(0):
+            assert helpers.get_units_status('unitSIP', events='log-1:5') == status
+        with self.assertNumQueries(2):
+            status = helpers.get_units_status('unitSIP', events='log-1:6')
+        assert [job['uuid'] for job in status['objects'][0]['jobs']] == ['job-4', 'job-2', 'job-1']
+
+    def test_response(self):
+        factory = RequestFactory()
+        response = helpers.units_status_response(factory.get('/', {'since': '1420106700'}), 'unitSIP')
+        assert json.loads(response.content)['cursor'] == 1420106700
+        for since in ('yesterday', 'inf', 'nan', '1e20'):
+            response = helpers.units_status_response(factory.get('/', {'since': since}), 'unitSIP')
+            assert response.status_code == 400
+        response = helpers.units_status_response(factory.get('/', {'events': '0f1e2d3c-4b5a-4968-8776-a5b4c3d2e1f0:12'}), 'unitSIP')
+        assert response.status_code == 200
+        response = helpers.units_status_response(factory.get('/', {'events': 'log 1:12'}), 'unitSIP')
+        assert response.status_code == 400
@@ -0,0 +1,54 @@
+#!/usr/bin/env python2
+
+import base64
+
+from django.test import TestCase
+
+from components.ingest import views
+from main import models
+
+
+class TestTransferBacklogTree(TestCase):
+
+    def test_directory_tree(self):
+        tree = []
+        for path in ('transfer/logs/log.txt',
+                     'transfer/objects/a.jpg',
+                     'transfer/objects/sub/b.jpg',
+                     'transfer/objects/sub/c.jpg'):
+            views._es_results_to_directory_tree(path, tree, not_draggable=path.endswith('c.jpg'))
+        assert len(tree) == 1
+        transfer = tree[0]
+        assert transfer['name'] == base64.b64encode('transfer')
+        assert transfer['properties']['object count'] == 4
+        assert transfer['properties']['display_string'] == '4 objects'
+        logs, objects = transfer['children']
+        assert logs['properties']['not_draggable'] is True
+        assert objects['properties']['object count'] == 3
+        sub = objects['children'][1]
+        assert sub['properties']['object count'] == 2
+        assert sub['properties']['not_draggable'] is False
+        assert [child['properties']['not_draggable'] for child in sub['children']] == [False, True]
+
+    def test_appraisal_tab_format(self):
+        record_map = {}
+        transfers = []
+        for path in ('transfer/objects/a.jpg', 'transfer/objects/sub/b.jpg', 'transfer/objects/sub/c.jpg'):
+            record = {'relative_path': path, 'fileuuid': path, 'size': 1, 'tags': [],
+                      'bulk_extractor_reports': [], 'format': []}
+            views._es_results_to_appraisal_tab_format(record, record_map, transfers)
+        assert len(transfers) == 1
+        objects = record_map['transfer/objects']
+        assert transfers[0]['children'] == [objects]
+        assert [child['type'] for child in objects['children']] == ['file', 'directory']
+        assert objects['object_count'] == 2
+        assert record_map['transfer/objects/sub']['object_count'] == 2
+
+    def test_arranged_backlog_paths(self):
+        models.SIPArrange.objects.create(
+            original_path='originals/transfer-a29e7e86-eca9-43b6-b059-6f23a9802dc8/objects/a.jpg',
+            arrange_path='/arrange/sip/a.jpg')
+        models.SIPArrange.objects.create(arrange_path='/arrange/sip/')
+        with self.assertNumQueries(1):
+            paths = views._arranged_backlog_paths()
+        assert paths == {'transfer-a29e7e86-eca9-43b6-b059-6f23a9802dc8/objects/a.jpg'}
@@ -0,0 +1,55 @@
+#!/usr/bin/env python2
+
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from components.mcp import views
+
+
+class FakeMCPClient(object):
+    """ Answers getEvents requests as an MCPServer whose event log is at sequence 12. """
+    requests = []
+    available = True
+
+    def events(self, since=None, log=None):
+        if not self.available:
+            raise Exception('getEvents failed')
+        self.requests.append((since, log))
+        return {'log': 'log-1', 'sequence': 12, 'events': [], 'complete': since is not None}
+
+
+class TestEvents(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.mcp_client = views.MCPClient
+        views.MCPClient = FakeMCPClient
+        FakeMCPClient.requests = []
+        FakeMCPClient.available = True
+
+    def tearDown(self):
+        views.MCPClient = self.mcp_client
+
+    def test_events_since(self):
+        response = views.events(self.factory.get('/', {'log': 'log-1', 'since': '10'}))
+        assert response.status_code == 200
+        assert json.loads(response.content) == {'log': 'log-1', 'sequence': 12, 'events': [], 'complete': True}
+        assert FakeMCPClient.requests == [(10, 'log-1')]
+
+    def test_events_without_since(self):
+        response = views.events(self.factory.get('/'))
+        assert json.loads(response.content)['complete'] is False
+        assert FakeMCPClient.requests == [(None, None)]
+
+    def test_invalid_since(self):
+        response = views.events(self.factory.get('/', {'log': 'log-1', 'since': 'yesterday'}))
+        assert response.status_code == 400
+        assert FakeMCPClient.requests == []
+
+    def test_mcp_server_unavailable(self):
+        FakeMCPClient.available = False
+        response = views.events(self.factory.get('/', {'log': 'log-1', 'since': '10'}))
+        assert response.status_code == 503
+        assert json.loads(response.content)['error'] is True
@@ -0,0 +1,168 @@
+#!/usr/bin/env python2
+
+"""
+Checks that the most frequent queries of MCPServer, MCPClient and the
+dashboard on the Jobs, Tasks, Files, UnitVariables and SIPArrange tables use
+an index, on a database seeded with a few thousand rows. The query plan is
+the database's own (EXPLAIN), so these only fail on a missing or unusable
+index, whatever the volume of the tables.
+"""
+
+import datetime
+import re
+import uuid
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from main import models
+
+UNITS = 20
+JOBS_PER_UNIT = 25
+TASKS_PER_JOB = 10
+FILES_PER_UNIT = 50
+
+
+def query_plan(queryset):
+    """Returns the query plan of `queryset`, one entry per table."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def uses_index(queryset, table, columns=()):
+    """
+    Returns True if `queryset` looks up the rows of `table` in an index, on
+    `columns` if given, rather than scanning the table.
+    """
+    plan = query_plan(queryset)
+    if connection.vendor == 'mysql':
+        return any(row['table'] == table and row['key'] is not None for row in plan)
+    # e.g. SEARCH Jobs USING INDEX Jobs_SIPUUID_..._idx (SIPUUID=? AND unitType=?)
+    for detail in plan:
+        match = re.match(r'SEARCH (?:TABLE )?%s (?:AS \w+ )?USING .*?INDEX .*?\((.*)\)' % table, detail)
+        if match and all(re.search(r'\b%s\b' % column, match.group(1)) for column in columns):
+            return True
+    return False
+
+
+class TestQueryPlans(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        created = datetime.datetime(2016, 1, 1, tzinfo=timezone.utc)
+        cls.sip_uuid = cls.transfer_uuid = None
+        sips, transfers, jobs, tasks, files, variables = [], [], [], [], [], []
+        for unit in range(UNITS):
+            unit_uuid = str(uuid.uuid4())
+            if unit % 2:
+                unit_type = 'unitSIP'
+                sips.append(models.SIP(uuid=unit_uuid, currentpath='%sharedPath%currentlyProcessing/sip/'))
+                cls.sip_uuid = unit_uuid
+            else:
+                unit_type = 'unitTransfer'
+                transfers.append(models.Transfer(uuid=unit_uuid, currentlocation='%sharedPath%currentlyProcessing/transfer/'))
+                cls.transfer_uuid = unit_uuid
+            for job in range(JOBS_PER_UNIT):
+                job_uuid = str(uuid.uuid4())
+                jobs.append(models.Job(
+                    jobuuid=job_uuid, sipuuid=unit_uuid, unittype=unit_type,
+                    jobtype='Job %d' % job, microservicegroup='Group %d' % (job // 5),
+                    createdtime=created + datetime.timedelta(minutes=unit * JOBS_PER_UNIT + job),
+                    currentstep='Awaiting decision' if job == JOBS_PER_UNIT - 1 else 'Completed successfully'))
+                for task in range(TASKS_PER_JOB):
+                    tasks.append(models.Task(
+                        taskuuid=str(uuid.uuid4()), job_id=job_uuid, createdtime=created,
+                        endtime=created + datetime.timedelta(minutes=unit * JOBS_PER_UNIT + job),
+                        filename='file-%d.tif' % task, exitcode=0))
+            for variable in ('activeAgent', 'replacementDict', 'normalizationDirectory'):
+                variables.append(models.UnitVariable(
+                    unittype=unit_type[4:], unituuid=unit_uuid,
+                    variable=variable, variablevalue='value'))
+            for i in range(FILES_PER_UNIT):
+                location = '%SIPDirectory%objects/file-{}.tif'.format(i)
+                if unit_type == 'unitSIP':
+                    files.append(models.File(uuid=str(uuid.uuid4()), sip_id=unit_uuid, originallocation=location, currentlocation=location))
+                else:
+                    files.append(models.File(uuid=str(uuid.uuid4()), transfer_id=unit_uuid, originallocation=location, currentlocation=location))
+        models.SIP.objects.bulk_create(sips)
+        models.Transfer.objects.bulk_create(transfers)
+        models.Job.objects.bulk_create(jobs, batch_size=100)
+        models.Task.objects.bulk_create(tasks, batch_size=100)
+        models.File.objects.bulk_create(files, batch_size=100)
+        models.UnitVariable.objects.bulk_create(variables, batch_size=100)
+        models.SIPArrange.objects.bulk_create([
+            models.SIPArrange(
+                arrange_path='/arrange/series-{}/file-{}.tif'.format(i // 10, i),
+                original_path='/originals/file-{}.tif'.format(i))
+            for i in range(UNITS * FILES_PER_UNIT)], batch_size=100)
+        cls.job_uuid = job_uuid
+
+    # MCPServer
+
+    def test_jobs_awaiting_decision(self):
+        assert uses_index(models.Job.objects.filter(currentstep='Awaiting decision'), 'Jobs', ['currentStep'])
+
+    def test_unit_variable(self):
+        assert uses_index(models.UnitVariable.objects.filter(
+            unittype='SIP', unituuid=self.sip_uuid, variable='normalizationDirectory'),
+            'UnitVariables', ['unitUUID', 'unitType', 'variable'])
+        assert uses_index(models.UnitVariable.objects.filter(
+            unituuid=self.sip_uuid, variable='replacementDict'),
+            'UnitVariables', ['unitUUID'])
+
+    # databaseFunctions and MCPClient
+
+    def test_latest_job_of_unit(self):
+        assert uses_index(models.Job.objects.filter(
+            sipuuid=self.sip_uuid, unittype='unitSIP').order_by('-createdtime', '-createdtimedec'),
+            'Jobs', ['SIPUUID', 'unitType'])
+
+    def test_tasks_of_job(self):
+        assert uses_index(models.Task.objects.filter(job=self.job_uuid).exclude(exitcode=0), 'Tasks', ['jobuuid'])
+
+    def test_file_by_location(self):
+        assert uses_index(models.File.objects.filter(
+            removedtime__isnull=True, sip_id=self.sip_uuid,
+            currentlocation='%SIPDirectory%objects/file-1.tif'),
+            'Files', ['sipUUID', 'currentLocation'])
+        assert uses_index(models.File.objects.filter(
+            transfer_id=self.transfer_uuid,
+            currentlocation='%SIPDirectory%objects/file-1.tif'),
+            'Files', ['transferUUID', 'currentLocation'])
+
+    # Dashboard
+
+    def test_jobs_of_unit(self):
+        assert uses_index(models.Job.objects.filter(sipuuid=self.sip_uuid, subjobof=''), 'Jobs', ['SIPUUID'])
+
+    def test_changed_units(self):
+        since = datetime.datetime(2016, 1, 1, 8, tzinfo=timezone.utc)
+        assert uses_index(models.Job.objects.filter(
+            unittype='unitSIP', subjobof='', createdtime__gte=since),
+            'Jobs', ['unitType', 'subJobOf', 'createdTime'])
+        # Either the tasks of the unit type's jobs, or the recent tasks
+        finished = models.Task.objects.filter(job__unittype='unitSIP', job__subjobof='', endtime__gte=since)
+        assert uses_index(finished, 'Jobs', ['unitType', 'subJobOf']) or uses_index(finished, 'Tasks', ['endTime'])
+        assert uses_index(finished, 'Tasks')
+
+    def test_completed_units(self):
+        since = datetime.datetime(2016, 1, 1, 8, tzinfo=timezone.utc)
+        assert uses_index(models.UnitStatus.objects.filter(
+            unit_type='unitSIP', status=models.UnitStatus.COMPLETE, updated__gt=since),
+            'main_unitstatus', ['unit_type', 'status'])
+
+    def test_arranged_files(self):
+        assert uses_index(models.SIPArrange.objects.filter(
+            arrange_path='/arrange/series-1/file-10.tif'),
+            'main_siparrange', ['arrange_path'])
+        if connection.vendor == 'mysql':
+            # SQLite's LIKE is case insensitive, so it can't use the index
+            assert uses_index(models.SIPArrange.objects.filter(
+                arrange_path__startswith='/arrange/series-1/'), 'main_siparrange')